@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# ===========================
+# Contrôle d'admission et propagation des délais
+# ===========================
+# Chaque service transmet au suivant le temps qu'il reste à la requête (en
+# millisecondes) dans l'en-tête X-Request-Budget-Ms. Un service qui reçoit une
+# requête dont le budget est épuisé la rejette aussitôt (503) au lieu de la traiter
+# pour un client qui a déjà abandonné.
+
+BUDGET_HEADER = "X-Request-Budget-Ms"
+
+# Délai (secondes) suggéré aux clients dans l'en-tête Retry-After des réponses 503
+RETRY_AFTER = int(os.getenv("RETRY_AFTER", "1"))
+
+
+class Overloaded(Exception):
+    """
+    Requête refusée par le contrôle d'admission (file pleine ou délai dépassé).
+    """
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+def request_deadline(headers, timeout):
+    """
+    Retourne l'échéance (horloge monotone) d'une requête reçue : le budget transmis
+    par le service en amont, plafonné par le délai `timeout` (secondes) du service.
+    """
+    budget = timeout
+    value = headers.get(BUDGET_HEADER)
+    if value:
+        try:
+            budget = min(budget, int(value) / 1000)
+        except ValueError:
+            pass
+    return time.monotonic() + budget
+
+
+def remaining(deadline):
+    """
+    Temps restant (secondes) avant l'échéance, négatif si elle est dépassée.
+    """
+    return deadline - time.monotonic()
+
+
+def budget_header(deadline):
+    """
+    En-tête transmettant au service en aval le budget restant.
+    """
+    return {BUDGET_HEADER: str(max(0, int(remaining(deadline) * 1000)))}
+
+
+class ConcurrencyLimiter:
+    """
+    Limite le nombre de requêtes simultanées. Au-delà, les requêtes attendent dans
+    une file bornée jusqu'à leur échéance ; une file pleine ou une échéance dépassée
+    lève Overloaded.
+    """
+    def __init__(self, limit, max_queue):
+        self.limit = limit
+        self.max_queue = max_queue
+        self._active = 0
+        self._waiting = 0
+        self._cond = threading.Condition(threading.Lock())
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "timeouts": 0}
+
+    def acquire(self, deadline):
+        with self._cond:
+            if self._active < self.limit and not self._waiting:
+                self._active += 1
+                self._stats["admitted"] += 1
+                return
+            if self._waiting >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise Overloaded(f"admission queue full ({self._waiting} waiting)", "queue_full")
+            self._waiting += 1
+            self._stats["queued"] += 1
+            try:
+                while self._active >= self.limit:
+                    timeout = remaining(deadline)
+                    if timeout <= 0:
+                        self._stats["timeouts"] += 1
+                        # Une libération reçue juste avant l'échéance revient au suivant
+                        self._cond.notify()
+                        raise Overloaded("deadline exceeded while queued", "deadline")
+                    self._cond.wait(timeout)
+            finally:
+                self._waiting -= 1
+            self._active += 1
+            self._stats["admitted"] += 1
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self, deadline):
+        self.acquire(deadline)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "active": self._active,
+                "waiting": self._waiting,
+                "max_queue": self.max_queue,
+                **self._stats,
+            }
@@ -5,6 +5,9 @@ import os
 # Nombre de requêtes pour le benchmark
 NB_REQUESTS = 1000
 
+# Taille des lots pour le benchmark d'écriture groupée (/query/batch)
+BATCH_SIZE = 100
+
 # Fichier contenant l'adresse IP du Gatekeeper
 GATEKEEPER_IP_FILE = "public_ip_gatekeeper.txt"
 
@@ -31,26 +34,13 @@ def run_proxy_benchmark(gatekeeper_ip, strategy, timeout=5):
         'write': {'success': 0, 'fail': 0, 'time': 0}
     }
 
-    # 1. Configuration de la stratégie
-    if strategy != "direct":
-        try:
-            response = requests.get(
-                f'http://{gatekeeper_ip}:5000/set_strategy/{strategy}', timeout=timeout
-            )
-            if response.status_code != 200:
-                print(f"Échec de la configuration de la stratégie {strategy} : {response.text}")
-                return results
-        except Exception as e:
-            print(f"Erreur lors de la configuration de la stratégie : {str(e)}")
-            return results
-
-    # 2. Benchmark de lecture
+    # 1. Benchmark de lecture (la stratégie est choisie pour chaque requête)
     start_time = time.time()
     for i in range(NB_REQUESTS):
         try:
             response = requests.post(
                 f'http://{gatekeeper_ip}:5000/query',
-                json={'query': f'SELECT * FROM actor WHERE actor_id = {(i % 200) + 1}'},
+                json={'query': f'SELECT * FROM actor WHERE actor_id = {(i % 200) + 1}', 'strategy': strategy},
                 timeout=timeout
             )
             if response.status_code == 200 and response.json().get('status') == 'success':
@@ -66,13 +56,16 @@ def run_proxy_benchmark(gatekeeper_ip, strategy, timeout=5):
 
     results['read']['time'] = time.time() - start_time
 
-    # 3. Benchmark d'écriture
+    # 2. Benchmark d'écriture
     start_time = time.time()
     for i in range(NB_REQUESTS):
         try:
             response = requests.post(
                 f'http://{gatekeeper_ip}:5000/query',
-                json={'query': f'INSERT INTO actor (first_name, last_name) VALUES ("Test{i}", "User{i}")'},
+                json={
+                    'query': f'INSERT INTO actor (first_name, last_name) VALUES ("Test{i}", "User{i}")',
+                    'strategy': strategy
+                },
                 timeout=timeout
             )
             if response.status_code == 200 and response.json().get('status') == 'success':
@@ -90,6 +83,45 @@ def run_proxy_benchmark(gatekeeper_ip, strategy, timeout=5):
 
     return results
 
+# Fonction pour exécuter le benchmark d'écriture groupée
+def run_batch_write_benchmark(gatekeeper_ip, batch_size=BATCH_SIZE, timeout=30):
+    """
+    Envoie les mêmes écritures que le benchmark d'écriture, regroupées en lots
+    exécutés chacun dans une seule transaction sur le manager.
+    """
+    print(f"\nExécution du benchmark d'écriture groupée (lots de {batch_size})...")
+    results = {'success': 0, 'fail': 0, 'time': 0}
+
+    start_time = time.time()
+    for offset in range(0, NB_REQUESTS, batch_size):
+        statements = [
+            {
+                'query': 'INSERT INTO actor (first_name, last_name) VALUES (%s, %s)',
+                'params': [f'Test{i}', f'User{i}']
+            }
+            for i in range(offset, min(offset + batch_size, NB_REQUESTS))
+        ]
+        try:
+            response = requests.post(
+                f'http://{gatekeeper_ip}:5000/query/batch',
+                json={'statements': statements},
+                timeout=timeout
+            )
+            if response.status_code == 200:
+                for result in response.json().get('results', []):
+                    if result.get('status') == 'success':
+                        results['success'] += 1
+                    else:
+                        results['fail'] += 1
+            else:
+                results['fail'] += len(statements)
+        except Exception as e:
+            results['fail'] += len(statements)
+            print(f"Erreur lors de l'écriture groupée : {str(e)}")
+
+    results['time'] = time.time() - start_time
+    return results
+
 # Fonction pour afficher les résultats des benchmarks
 def print_benchmark_results(results):
     """
@@ -121,7 +153,7 @@ def main():
         return
 
     # Liste des stratégies à tester
-    strategies = ['direct', 'random', 'customized']
+    strategies = ['direct', 'random', 'customized', 'least_outstanding', 'power_of_two', 'sharded']
     benchmark_results = {}
 
     for strategy in strategies:
@@ -130,6 +162,13 @@ def main():
         benchmark_results[strategy] = results
         print_benchmark_results(results)
 
+    batch_results = run_batch_write_benchmark(gatekeeper_ip)
+    print("\nÉcritures groupées :")
+    print(f"Succès : {batch_results['success']}")
+    print(f"Échecs : {batch_results['fail']}")
+    print(f"Temps total : {batch_results['time']:.2f} secondes")
+    print(f"Temps moyen par requête : {(batch_results['time'] / NB_REQUESTS):.4f} secondes")
+
     # Sauvegarde des résultats dans un fichier
     with open('benchmark_results.txt', 'w') as f:
         f.write("Résultats du Benchmark\n")
@@ -150,6 +189,13 @@ def main():
             f.write(f"Temps total : {results['write']['time']:.2f} secondes\n")
             f.write(f"Temps moyen par requête : {(results['write']['time'] / NB_REQUESTS):.4f} secondes\n")
 
+        f.write(f"\nÉcritures groupées (lots de {BATCH_SIZE})\n")
+        f.write("-----------------------\n")
+        f.write(f"Succès : {batch_results['success']}\n")
+        f.write(f"Échecs : {batch_results['fail']}\n")
+        f.write(f"Temps total : {batch_results['time']:.2f} secondes\n")
+        f.write(f"Temps moyen par requête : {(batch_results['time'] / NB_REQUESTS):.4f} secondes\n")
+
     print("\nLes résultats ont été enregistrés dans 'benchmark_results.txt'.")
 
 if __name__ == "__main__":
@@ -0,0 +1,113 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+# ===========================
+# Topologie du cluster (workers et poids)
+# ===========================
+# Format de cluster.json :
+#   {"workers": [{"host": "10.0.0.11", "weight": 2}, {"host": "10.0.0.12"}, "10.0.0.13"]}
+# Sans ce fichier, les workers sont lus dans les fichiers public_ip_worker*.txt.
+
+CLUSTER_CONFIG_FILE = os.getenv("CLUSTER_CONFIG", "cluster.json")
+LEGACY_WORKER_FILES = "public_ip_worker*.txt"
+
+logger = logging.getLogger(__name__)
+
+
+class ClusterConfig:
+    """
+    Liste ordonnée des workers et poids associés (1 par défaut).
+    """
+    def __init__(self, workers, weights=None):
+        self.workers = list(workers)
+        self.weights = dict(weights or {})
+
+    def to_dict(self):
+        return {"workers": [{"host": host, "weight": self.weights.get(host, 1.0)} for host in self.workers]}
+
+
+def parse_cluster_config(data):
+    """
+    Valide une topologie décodée depuis JSON. Lève ValueError si elle est invalide.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get("workers"), list):
+        raise ValueError("Cluster config must be an object with a 'workers' list")
+    workers, weights = [], {}
+    for entry in data["workers"]:
+        if isinstance(entry, str):
+            entry = {"host": entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get("host"), str) or not entry["host"].strip():
+            raise ValueError(f"Invalid worker entry: {entry!r}")
+        host = entry["host"].strip()
+        if host in weights:
+            raise ValueError(f"Duplicate worker: {host}")
+        try:
+            weight = float(entry.get("weight", 1))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid weight for worker {host}: {entry.get('weight')!r}")
+        if weight <= 0:
+            raise ValueError(f"Worker weight must be positive: {host}")
+        workers.append(host)
+        weights[host] = weight
+    return ClusterConfig(workers, weights)
+
+
+def load_cluster_config(path=CLUSTER_CONFIG_FILE, default_weights=None):
+    """
+    Charge la topologie depuis `path`, ou à défaut depuis les fichiers
+    public_ip_worker*.txt avec les poids `default_weights`.
+    """
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return parse_cluster_config(json.load(f))
+
+    workers = []
+    for worker_file in sorted(glob.glob(LEGACY_WORKER_FILES)):
+        with open(worker_file, "r") as f:
+            host = f.read().strip()
+        if not host:
+            raise ValueError(f"File {worker_file} is empty.")
+        workers.append(host)
+    if not workers:
+        raise FileNotFoundError(f"Error: neither {path} nor {LEGACY_WORKER_FILES} found.")
+    return ClusterConfig(workers, default_weights)
+
+
+class ClusterConfigWatcher:
+    """
+    Surveille la date de modification du fichier de topologie et appelle
+    `on_change(config)` à chaque changement. Une topologie invalide est ignorée
+    et la topologie courante est conservée.
+    """
+    def __init__(self, path, on_change, interval):
+        self.path = path
+        self._on_change = on_change
+        self._interval = interval
+        self._mtime = self._current_mtime()
+        self._thread = threading.Thread(target=self._run, name="cluster-config-watch", daemon=True)
+        self._thread.start()
+
+    def _current_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            mtime = self._current_mtime()
+            if mtime is None or mtime == self._mtime:
+                continue
+            self._mtime = mtime
+            try:
+                with open(self.path, "r") as f:
+                    config = parse_cluster_config(json.load(f))
+                logger.info(f"Cluster config {self.path} changed, applying {len(config.workers)} worker(s)")
+                self._on_change(config)
+            except Exception as e:
+                logger.error(f"Ignoring invalid cluster config {self.path}: {e}")
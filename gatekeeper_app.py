@@ -1,17 +1,27 @@
+import hmac
+import json
 import os
+import re
+import threading
+import time
+from functools import lru_cache
 from flask import Flask, request, jsonify
 import requests
 import logging
+from log_pipeline import abbreviate, configure_logging
+from admission import RETRY_AFTER, budget_header, remaining, request_deadline
+from metrics import Registry, instrument_flask
+from passthrough import decode_body, relay
+from upstream import UpstreamClient, instrument_client
+import tracing
+from sql_lexer import (
+    QueryType, classify, expand_executable_comments, extract_tables, fingerprint, main_verb, split_statements,
+    tokenize
+)
 
 # Configuration des logs
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("gatekeeper.log"),  # Log to a file
-        logging.StreamHandler()  # Log to console
-    ]
-)
+# Écriture en arrière-plan (fichier et console), échantillonnage et limitation de débit
+LOG_STATS = configure_logging("gatekeeper.log")
 logger = logging.getLogger(__name__)
 
 # Fichier requis
@@ -39,6 +49,214 @@ TRUST_HOST_IP = read_ip(trust_host_ip_file)
 # Initialisation de l'application Flask
 app = Flask(__name__)
 
+# Délais maximaux d'attente du Trusted Host (secondes), réduits par le budget reçu de l'amont
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+BATCH_UPSTREAM_TIMEOUT = float(os.getenv("BATCH_UPSTREAM_TIMEOUT", "30"))
+
+# Stratégie du Proxy choisie requête par requête (le champ "strategy" du corps est relayé tel quel)
+STRATEGY_HEADER = "X-Proxy-Strategy"
+
+# Métriques exposées sur /metrics
+METRICS = Registry()
+instrument_flask(app, METRICS, "gatekeeper")
+METRICS.callback_gauge(
+    "gatekeeper_log_records_dropped", "Log records dropped since start (sampling, rate limit, full queue)", ("reason",),
+    lambda: {(reason,): count for reason, count in LOG_STATS.snapshot().items()})
+tracing.instrument_flask(app, "gatekeeper")
+UPSTREAM_DURATION = METRICS.histogram(
+    "gatekeeper_upstream_duration_seconds", "Time waiting for the Trusted Host response", ("endpoint",))
+UPSTREAM_ERRORS = METRICS.counter(
+    "gatekeeper_upstream_errors_total", "Failed calls to the Trusted Host", ("endpoint", "cause"))
+
+# Connexions persistantes (keep-alive) vers le Trusted Host, partagées par tous les threads
+UPSTREAM = UpstreamClient()
+instrument_client(UPSTREAM, METRICS, "gatekeeper")
+
+# ===========================
+# Pare-feu de requêtes
+# ===========================
+# Fichier des règles (rechargé quand il est modifié), intervalle de surveillance
+# (0 = désactivée) et nombre de décisions conservées par empreinte de requête
+FIREWALL_RULES_FILE = os.getenv("FIREWALL_RULES", "firewall.json")
+FIREWALL_POLL_INTERVAL = float(os.getenv("FIREWALL_POLL_INTERVAL", "5"))
+FIREWALL_CACHE_SIZE = int(os.getenv("FIREWALL_CACHE_SIZE", "4096"))
+# Secret partagé exigé (en-tête X-Admin-Token) par les endpoints d'administration du
+# pare-feu ; sans secret configuré, ces endpoints sont désactivés
+ADMIN_TOKEN = os.getenv("GATEKEEPER_ADMIN_TOKEN", "")
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+FIREWALL_RULE_KEYS = {
+    "max_length", "max_statements", "forbidden_statements", "forbidden_types",
+    "deny_patterns", "allow_patterns", "allow_fingerprints", "tables",
+}
+FIREWALL_TABLE_KEYS = {"allow", "deny", "read_only"}
+
+FIREWALL_DECISIONS = METRICS.counter(
+    "gatekeeper_firewall_decisions_total", "Queries checked by the firewall, by decision and rule", ("decision", "rule"))
+
+
+def _compile_patterns(patterns):
+    """
+    Réunit une liste d'expressions régulières en une seule (une alternative nommée
+    par motif) : l'empreinte est parcourue une seule fois quel que soit le nombre de règles.
+    """
+    if not patterns:
+        return None
+    for pattern in patterns:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise ValueError(f"Invalid firewall pattern {pattern!r}: {e}")
+    return re.compile("|".join(f"(?P<p{index}>{pattern})" for index, pattern in enumerate(patterns)), re.IGNORECASE)
+
+
+def _rule_list(rules, key):
+    value = rules.get(key, [])
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"Firewall rule '{key}' must be a list of strings")
+    return value
+
+
+def _rule_limit(rules, key):
+    value = rules.get(key)
+    if value is not None and (not isinstance(value, int) or value <= 0):
+        raise ValueError(f"Firewall rule '{key}' must be a positive integer")
+    return value
+
+
+class FirewallPolicy:
+    """
+    Règles du pare-feu compilées. Format de firewall.json (toutes les clés sont facultatives) :
+      {"max_length": 8192, "max_statements": 1,
+       "forbidden_statements": ["DROP", "GRANT"], "forbidden_types": ["ddl"],
+       "deny_patterns": ["sleep *[(]", "information_schema"],
+       "allow_patterns": [], "allow_fingerprints": [],
+       "tables": {"allow": [], "deny": ["user"], "read_only": ["film"]}}
+    Les motifs s'appliquent à l'empreinte de la requête (commentaires ordinaires retirés,
+    contenu des commentaires exécutables conservé, littéraux remplacés par ?). Si une liste d'autorisation est définie, seules les requêtes qui
+    y figurent passent. Avec des règles de tables, une requête dont les tables ne peuvent
+    pas être déterminées est refusée. La décision est mise en cache par empreinte.
+    """
+    def __init__(self, rules=None, cache_size=FIREWALL_CACHE_SIZE):
+        rules = rules or {}
+        if not isinstance(rules, dict):
+            raise ValueError("Firewall rules must be a JSON object")
+        unknown = set(rules) - FIREWALL_RULE_KEYS
+        if unknown:
+            raise ValueError(f"Unknown firewall rules: {sorted(unknown)}")
+        tables = rules.get("tables", {})
+        if not isinstance(tables, dict) or set(tables) - FIREWALL_TABLE_KEYS:
+            raise ValueError(f"Firewall rule 'tables' accepts only {sorted(FIREWALL_TABLE_KEYS)}")
+
+        self.rules = rules
+        self.max_length = _rule_limit(rules, "max_length")
+        self.max_statements = _rule_limit(rules, "max_statements")
+        self.forbidden_statements = {word.upper() for word in _rule_list(rules, "forbidden_statements")}
+        try:
+            self.forbidden_types = {QueryType(kind.lower()) for kind in _rule_list(rules, "forbidden_types")}
+        except ValueError:
+            raise ValueError(f"Firewall rule 'forbidden_types' accepts only {[kind.value for kind in QueryType]}")
+        self.deny_patterns = _rule_list(rules, "deny_patterns")
+        self.deny = _compile_patterns(self.deny_patterns)
+        self.allow = _compile_patterns(_rule_list(rules, "allow_patterns"))
+        self.allow_fingerprints = {fingerprint(query) for query in _rule_list(rules, "allow_fingerprints")}
+        self.allowed_tables = {table.lower() for table in _rule_list(tables, "allow")}
+        self.denied_tables = {table.lower() for table in _rule_list(tables, "deny")}
+        self.read_only_tables = {table.lower() for table in _rule_list(tables, "read_only")}
+        self.enabled = any(value for value in rules.values())
+        self._decide = lru_cache(maxsize=cache_size)(self._evaluate)
+
+    def check(self, query):
+        """
+        Retourne None si la requête est autorisée, sinon (règle, détail).
+        """
+        if not self.enabled or not isinstance(query, str):
+            return None
+        # Avant l'empreinte : une requête démesurée n'est jamais analysée
+        if self.max_length and len(query) > self.max_length:
+            return "max_length", f"{len(query)} > {self.max_length} characters"
+        # Le contenu des commentaires exécutables (/*!...*/) est analysé comme du SQL
+        return self._decide(fingerprint(expand_executable_comments(query)))
+
+    def _evaluate(self, query_fingerprint):
+        if self.deny is not None:
+            match = self.deny.search(query_fingerprint)
+            if match:
+                return "deny_pattern", self.deny_patterns[int(match.lastgroup[1:])]
+        if (self.allow is not None or self.allow_fingerprints) and query_fingerprint not in self.allow_fingerprints \
+                and not (self.allow is not None and self.allow.search(query_fingerprint)):
+            return "not_allowed", "query matches no allow rule"
+
+        statements = split_statements(tokenize(query_fingerprint))
+        if self.max_statements and len(statements) > self.max_statements:
+            return "max_statements", f"{len(statements)} > {self.max_statements} statements"
+        for statement in statements:
+            # Verbe principal, après une éventuelle CTE (WITH x AS (...) DELETE ...)
+            verb = main_verb(statement)
+            if verb in self.forbidden_statements:
+                return "forbidden_statement", verb
+        query_type = classify(query_fingerprint) if self.forbidden_types or self.read_only_tables else None
+        if query_type in self.forbidden_types:
+            return "forbidden_type", query_type.value
+
+        if self.allowed_tables or self.denied_tables or self.read_only_tables:
+            tables = extract_tables(query_fingerprint)
+            # Tables indéterminées : refusée, sauf une lecture soumise aux seules tables en lecture seule
+            if not tables and (self.allowed_tables or self.denied_tables or query_type is not QueryType.READ):
+                return "table", "unknown"
+            for table in sorted(tables):
+                if table in self.denied_tables or (self.allowed_tables and table not in self.allowed_tables):
+                    return "table", table
+                if table in self.read_only_tables and query_type is not QueryType.READ:
+                    return "read_only_table", table
+        return None
+
+    def stats(self):
+        info = self._decide.cache_info()
+        return {
+            "rules": self.rules,
+            "enabled": self.enabled,
+            "cache": {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize},
+        }
+
+
+def load_firewall_policy(path=FIREWALL_RULES_FILE):
+    """
+    Charge les règles depuis `path` ; sans fichier, aucune requête n'est filtrée.
+    """
+    if not os.path.exists(path):
+        return FirewallPolicy()
+    with open(path, "r") as f:
+        return FirewallPolicy(json.load(f))
+
+
+def watch_firewall_rules(path, interval):
+    """
+    Recharge les règles à chaque modification du fichier. Des règles invalides sont
+    ignorées et les règles courantes conservées.
+    """
+    global FIREWALL
+    last_mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+    while True:
+        time.sleep(interval)
+        mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        if mtime is None or mtime == last_mtime:
+            continue
+        last_mtime = mtime
+        try:
+            FIREWALL = load_firewall_policy(path)
+            logger.info(f"Firewall rules {path} changed, reloaded")
+        except (OSError, ValueError) as e:
+            logger.error(f"Ignoring invalid firewall rules {path}: {e}")
+
+
+FIREWALL = load_firewall_policy()
+if FIREWALL_POLL_INTERVAL > 0:
+    threading.Thread(
+        target=watch_firewall_rules, args=(FIREWALL_RULES_FILE, FIREWALL_POLL_INTERVAL),
+        name="firewall-rules-watch", daemon=True
+    ).start()
+
 @app.route('/health', methods=['GET'])
 def health():
     """
@@ -46,19 +264,92 @@ def health():
     """
     return jsonify({"status": "ok"})
 
+def strategy_header():
+    """
+    Relaie l'en-tête X-Proxy-Strategy (stratégie choisie pour cette requête seulement).
+    """
+    strategy = request.headers.get(STRATEGY_HEADER)
+    return {STRATEGY_HEADER: strategy} if strategy else {}
+
+def shed():
+    """
+    Réponse 503 immédiate pour une requête dont le budget est déjà épuisé.
+    """
+    return jsonify({"status": "error", "message": "Request deadline exceeded"}), 503, {"Retry-After": str(RETRY_AFTER)}
+
+def firewall_rejection(rejected, index=None):
+    """
+    Réponse 403 pour une requête rejetée par le pare-feu.
+    """
+    rule, detail = rejected
+    FIREWALL_DECISIONS.inc("deny", rule)
+    where = f" (statement {index})" if index is not None else ""
+    logger.warning(f"Query rejected by firewall rule {rule}{where}: {detail}")
+    return jsonify({"status": "error", "message": f"Query rejected by firewall{where}: {rule} ({detail})"}), 403
+
+def forward(response, what):
+    """
+    Relaie la réponse du Trusted Host (code, type, corps, Retry-After) sans la décoder.
+    """
+    if response.status_code == 200:
+        logger.info(f"{what} successfully forwarded to Trusted Host.")
+    else:
+        UPSTREAM_ERRORS.inc(request.endpoint, str(response.status_code))
+        # Corps d'erreur : court, lu pour le journal puis relayé tel quel
+        logger.error(f"Error from Trusted Host: {abbreviate(response.text)}")
+    return relay(response)
+
+def admin_authorized():
+    """
+    Vérifie le secret d'administration transmis dans l'en-tête X-Admin-Token.
+    """
+    token = request.headers.get(ADMIN_TOKEN_HEADER, "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def admin_forbidden():
+    logger.warning(f"Rejected unauthorized admin request to {request.path} from {request.remote_addr}")
+    return jsonify({"status": "error", "message": "Forbidden"}), 403
+
+@app.route('/firewall', methods=['GET'])
+def firewall():
+    """
+    Retourne les règles du pare-feu en vigueur et les statistiques du cache de décisions
+    (réservé à l'administration : les règles ne doivent pas être visibles des clients).
+    """
+    if not admin_authorized():
+        return admin_forbidden()
+    return jsonify({"status": "success", **FIREWALL.stats()})
+
+@app.route('/admin/reload_firewall', methods=['POST'])
+def reload_firewall():
+    """
+    Recharge les règles du pare-feu depuis le fichier des règles. Les règles ne
+    peuvent être modifiées que dans ce fichier, jamais par le corps d'une requête.
+    """
+    global FIREWALL
+    if not admin_authorized():
+        return admin_forbidden()
+    try:
+        FIREWALL = load_firewall_policy()
+    except (OSError, ValueError) as e:
+        logger.warning(f"Rejected firewall reload: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 400
+    logger.info("Firewall rules reloaded")
+    return jsonify({"status": "success", **FIREWALL.stats()})
+
 @app.route('/set_strategy/<strategy>', methods=['GET'])
 def set_strategy(strategy):
     """
     Définit la stratégie sur le Trusted Host.
     """
-    valid_strategies = ["direct", "random", "customized"]
+    valid_strategies = ["direct", "random", "customized", "least_outstanding", "power_of_two", "sharded"]
     if strategy not in valid_strategies:
         logger.warning(f"Invalid strategy requested: {strategy}")
         return jsonify({"status": "error", "message": f"Invalid strategy: {strategy}"}), 400
 
     try:
         trusted_host_url = f'http://{TRUST_HOST_IP}:5000/set_strategy/{strategy}'
-        response = requests.get(trusted_host_url, timeout=5)
+        response = UPSTREAM.get(trusted_host_url, timeout=5)
         if response.status_code == 200:
             logger.info(f"Strategy set to {strategy} successfully on Trusted Host.")
             return jsonify({"status": "success", "strategy": strategy})
@@ -72,28 +363,104 @@ def set_strategy(strategy):
 @app.route('/query', methods=['POST'])
 def handle_request():
     """
-    Transmet les requêtes SQL au Trusted Host.
+    Transmet les requêtes SQL au Trusted Host. Le corps est transmis tel quel et la réponse
+    relayée sans être désérialisée.
     """
+    deadline = request_deadline(request.headers, UPSTREAM_TIMEOUT)
+    if remaining(deadline) <= 0:
+        return shed()
     try:
-        data = request.json
-        if not data or 'query' not in data:
+        body = request.get_data()
+        try:
+            fields = decode_body(body)
+        except ValueError as e:
+            logger.warning(f"Invalid request: malformed JSON body: {e}")
+            return jsonify({"status": "error", "message": "Invalid JSON body"}), 400
+        if not fields or 'query' not in fields:
             logger.warning("Invalid request: Missing 'query' field.")
             return jsonify({"status": "error", "message": "Query is missing"}), 400
 
-        query = data['query']
-        logger.info(f"Received query: {query}")
+        logger.info(f"Received query: {abbreviate(fields['query'])}")
+
+        policy = FIREWALL
+        rejected = policy.check(fields['query'])
+        if rejected:
+            return firewall_rejection(rejected)
+        if policy.enabled:
+            FIREWALL_DECISIONS.inc("allow", "none")
 
-        # Forward the query to Trusted Host
         trusted_host_url = f'http://{TRUST_HOST_IP}:5000/query'
-        response = requests.post(trusted_host_url, json=data, timeout=10)
+        # Le format de réponse est négocié par le Proxy : l'en-tête Accept est transmis tel quel
+        headers = tracing.outgoing_headers({
+            "Accept": request.headers.get("Accept", "application/json"),
+            "Content-Type": "application/json"
+        })
+        headers.update(budget_header(deadline))
+        headers.update(strategy_header())
+        # Réponses simples, colonnaires, binaires ou en flux NDJSON : toutes relayées par morceaux
+        with UPSTREAM_DURATION.time("query"), tracing.span("forward"):
+            response = UPSTREAM.post(trusted_host_url, data=body, headers=headers, timeout=remaining(deadline), stream=True)
+        tracing.record_upstream(response)
+        return forward(response, "Query")
+    except requests.Timeout as e:
+        UPSTREAM_ERRORS.inc(request.endpoint, type(e).__name__)
+        logger.error(f"Trusted Host did not answer within the request deadline: {e}")
+        return jsonify({"status": "error", "message": f"Upstream timeout: {e}"}), 504
+    except requests.RequestException as e:
+        UPSTREAM_ERRORS.inc(request.endpoint, type(e).__name__)
+        logger.error(f"Error communicating with Trusted Host: {e}")
+        return jsonify({"status": "error", "message": f"Unable to process request: {e}"}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
 
-        if response.status_code == 200:
-            logger.info("Query successfully forwarded to Trusted Host.")
-            return response.json()
-        else:
-            logger.error(f"Error from Trusted Host: {response.text}")
-            return jsonify({"status": "error", "message": response.text}), response.status_code
+@app.route('/query/batch', methods=['POST'])
+def handle_batch_request():
+    """
+    Transmet une liste ordonnée de requêtes SQL au Trusted Host. Le corps est transmis tel
+    quel et la réponse relayée sans être désérialisée.
+    """
+    deadline = request_deadline(request.headers, BATCH_UPSTREAM_TIMEOUT)
+    if remaining(deadline) <= 0:
+        return shed()
+    try:
+        body = request.get_data()
+        try:
+            fields = decode_body(body)
+        except ValueError as e:
+            logger.warning(f"Invalid batch request: malformed JSON body: {e}")
+            return jsonify({"status": "error", "message": "Invalid JSON body"}), 400
+        statements = fields.get('statements') if fields else None
+        if not statements or not isinstance(statements, list):
+            logger.warning("Invalid batch request: Missing 'statements' field.")
+            return jsonify({"status": "error", "message": "Statements are missing"}), 400
+
+        count = len(statements)
+        logger.info(f"Received batch of {count} statements")
+
+        policy = FIREWALL
+        if policy.enabled:
+            for index, statement in enumerate(statements):
+                rejected = policy.check(statement.get("query") if isinstance(statement, dict) else statement)
+                if rejected:
+                    return firewall_rejection(rejected, index)
+            FIREWALL_DECISIONS.inc("allow", "none", amount=count)
+
+        # Un lot peut contenir beaucoup d'instructions : délai plus long qu'une requête simple
+        trusted_host_url = f'http://{TRUST_HOST_IP}:5000/query/batch'
+        headers = tracing.outgoing_headers({
+            "Content-Type": "application/json", **budget_header(deadline), **strategy_header()
+        })
+        with UPSTREAM_DURATION.time("batch"), tracing.span("forward"):
+            response = UPSTREAM.post(trusted_host_url, data=body, headers=headers, timeout=remaining(deadline), stream=True)
+        tracing.record_upstream(response)
+        return forward(response, "Batch")
+    except requests.Timeout as e:
+        UPSTREAM_ERRORS.inc(request.endpoint, type(e).__name__)
+        logger.error(f"Trusted Host did not answer within the request deadline: {e}")
+        return jsonify({"status": "error", "message": f"Upstream timeout: {e}"}), 504
     except requests.RequestException as e:
+        UPSTREAM_ERRORS.inc(request.endpoint, type(e).__name__)
         logger.error(f"Error communicating with Trusted Host: {e}")
         return jsonify({"status": "error", "message": f"Unable to process request: {e}"}), 500
     except Exception as e:
@@ -102,6 +469,7 @@ def handle_request():
 
 if __name__ == '__main__':
     try:
+        # Serveur de développement, sans keep-alive : en déploiement, le service tourne sous gunicorn
         app.run(host='0.0.0.0', port=5000)
     except Exception as e:
         logger.critical(f"Failed to start the application: {e}")
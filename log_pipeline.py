@@ -0,0 +1,163 @@
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# ===========================
+# Journalisation non bloquante
+# ===========================
+# Les threads de requête ne font que déposer l'enregistrement dans une file bornée ;
+# un thread dédié l'écrit dans le fichier et sur la console. Avant la file, les
+# enregistrements sont échantillonnés par niveau et limités en débit par point
+# d'appel ; si la file est pleine, ils sont abandonnés et comptés.
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Débit maximal par point d'appel (enregistrements par seconde, 0 = illimité)
+LOG_RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "100"))
+# Longueur maximale du texte des requêtes SQL journalisé
+LOG_QUERY_MAX_LENGTH = int(os.getenv("LOG_QUERY_MAX_LENGTH", "200"))
+
+
+def parse_sample_rates(value):
+    """
+    Analyse des taux d'échantillonnage de la forme "DEBUG=0,INFO=0.1". Les niveaux
+    absents sont tous conservés.
+    """
+    rates = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        level, _, rate = item.partition("=")
+        levelno = logging.getLevelName(level.strip().upper())
+        try:
+            if not isinstance(levelno, int):
+                raise ValueError
+            rates[levelno] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            raise ValueError(f"Invalid log sample rate: {item}")
+    return rates
+
+LOG_SAMPLE_RATES = parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", ""))
+
+
+class LogStats:
+    """
+    Compteurs des enregistrements abandonnés, par raison.
+    """
+    def __init__(self):
+        self._dropped = {"sampled": 0, "rate_limited": 0, "queue_full": 0}
+        self._lock = threading.Lock()
+
+    def drop(self, reason):
+        with self._lock:
+            self._dropped[reason] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._dropped)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Conserve une fraction des enregistrements de chaque niveau configuré.
+    """
+    def __init__(self, rates, stats):
+        super().__init__()
+        self.rates = rates
+        self.stats = stats
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        if rate is None or rate >= 1 or random.random() < rate:
+            return True
+        self.stats.drop("sampled")
+        return False
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limite chaque point d'appel (fichier, ligne) à `limit` enregistrements par
+    seconde. Le premier enregistrement de la seconde suivante indique combien ont
+    été supprimés. Les messages CRITICAL ne sont jamais limités. Les compteurs ne
+    sont pas verrouillés : sous concurrence, la limite est approximative.
+    """
+    def __init__(self, limit, stats):
+        super().__init__()
+        self.limit = limit
+        self.stats = stats
+        self._sites = {}  # (fichier, ligne) -> [début de la fenêtre, émis, supprimés]
+
+    def filter(self, record):
+        if record.levelno >= logging.CRITICAL:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        window = self._sites.get(key)
+        if window is None or now - window[0] >= 1.0:
+            suppressed = window[2] if window is not None else 0
+            self._sites[key] = [now, 1, 0]
+            if suppressed:
+                record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+                record.args = None
+            return True
+        if window[1] < self.limit:
+            window[1] += 1
+            return True
+        window[2] += 1
+        self.stats.drop("rate_limited")
+        return False
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler qui abandonne l'enregistrement au lieu d'attendre si la file est pleine.
+    """
+    def __init__(self, log_queue, stats):
+        super().__init__(log_queue)
+        self.stats = stats
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.stats.drop("queue_full")
+
+
+def configure_logging(log_file, level=logging.INFO, sample_rates=None, rate_limit=LOG_RATE_LIMIT,
+                      queue_size=LOG_QUEUE_SIZE):
+    """
+    Configure le logger racine (fichier `log_file` et console) avec écriture en
+    arrière-plan. Retourne les compteurs d'enregistrements abandonnés.
+    """
+    stats = LogStats()
+    formatter = logging.Formatter(LOG_FORMAT)
+    writers = [logging.FileHandler(log_file), logging.StreamHandler()]
+    for writer in writers:
+        writer.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    handler = NonBlockingQueueHandler(log_queue, stats)
+    handler.addFilter(SamplingFilter(LOG_SAMPLE_RATES if sample_rates is None else sample_rates, stats))
+    if rate_limit > 0:
+        handler.addFilter(RateLimitFilter(rate_limit, stats))
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [handler]
+
+    listener = QueueListener(log_queue, *writers, respect_handler_level=True)
+    listener.start()
+    # Vide la file à l'arrêt du service
+    atexit.register(listener.stop)
+    return stats
+
+
+def abbreviate(text, limit=LOG_QUERY_MAX_LENGTH):
+    """
+    Tronque un texte long (requête SQL) avant de le journaliser.
+    """
+    text = str(text)
+    return text if len(text) <= limit else f"{text[:limit]}... ({len(text)} chars)"
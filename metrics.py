@@ -0,0 +1,277 @@
+import threading
+import time
+from bisect import bisect_left
+
+# ===========================
+# Métriques au format Prometheus
+# ===========================
+# Les valeurs sont réparties en un nombre fixe de fragments (stripes), chacun protégé
+# par son propre verrou ; un thread écrit dans le fragment désigné par son identifiant
+# système (get_ident() est une adresse alignée, presque toujours multiple de 16).
+# Les threads concurrents se gênent rarement, la mémoire ne dépend pas du nombre de
+# threads créés (le serveur en crée un par requête), et les fragments ne sont agrégés
+# qu'au moment où /metrics est lu.
+
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Nombre de fragments par métrique
+METRIC_STRIPES = 16
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _ShardedMetric:
+    """
+    Base des métriques fragmentées. Chaque fragment est un couple (verrou,
+    {tuple d'étiquettes: valeur}).
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = [(threading.Lock(), {}) for _ in range(METRIC_STRIPES)]
+
+    def _shard(self):
+        return self._shards[threading.get_native_id() % METRIC_STRIPES]
+
+    def _snapshot(self):
+        """
+        Copie du contenu de chaque fragment, prise sous son verrou.
+        """
+        snapshot = []
+        for lock, cells in self._shards:
+            with lock:
+                snapshot.append(self._copy_cells(cells))
+        return snapshot
+
+    @staticmethod
+    def _copy_cells(cells):
+        return dict(cells)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples())
+        return lines
+
+
+class Counter(_ShardedMetric):
+    kind = "counter"
+
+    def inc(self, *labelvalues, amount=1):
+        lock, cells = self._shard()
+        with lock:
+            cells[labelvalues] = cells.get(labelvalues, 0) + amount
+
+    def _totals(self):
+        totals = {}
+        for cells in self._snapshot():
+            for labels, value in cells.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def _render_samples(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self._totals().items())
+        ]
+
+
+class Gauge(Counter):
+    """
+    Jauge incrémentée et décrémentée (requêtes en cours) : la somme des fragments
+    donne la valeur courante.
+    """
+    kind = "gauge"
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def track(self, *labelvalues):
+        return _GaugeTracker(self, labelvalues)
+
+
+class _GaugeTracker:
+    def __init__(self, gauge, labelvalues):
+        self._gauge = gauge
+        self._labelvalues = labelvalues
+
+    def __enter__(self):
+        self._gauge.inc(*self._labelvalues)
+        return self
+
+    def __exit__(self, *exc):
+        self._gauge.dec(*self._labelvalues)
+        return False
+
+
+class Histogram(_ShardedMetric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        index = bisect_left(self.buckets, value)
+        lock, cells = self._shard()
+        with lock:
+            cell = cells.get(labelvalues)
+            if cell is None:
+                # [compteurs par seau (+Inf compris), somme, nombre]
+                cell = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                cells[labelvalues] = cell
+            cell[0][index] += 1
+            cell[1] += value
+            cell[2] += 1
+
+    @staticmethod
+    def _copy_cells(cells):
+        return {labels: (list(counts), total, count) for labels, (counts, total, count) in cells.items()}
+
+    def time(self, *labelvalues):
+        return _HistogramTimer(self, labelvalues)
+
+    def _render_samples(self):
+        merged = {}
+        for cells in self._snapshot():
+            for labels, (counts, total, count) in cells.items():
+                cell = merged.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0, 0])
+                for index, bucket_count in enumerate(counts):
+                    cell[0][index] += bucket_count
+                cell[1] += total
+                cell[2] += count
+
+        lines = []
+        for labels, (counts, total, count) in sorted(merged.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class _HistogramTimer:
+    def __init__(self, histogram, labelvalues):
+        self._histogram = histogram
+        self._labelvalues = labelvalues
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start, *self._labelvalues)
+        return False
+
+
+class CallbackGauge:
+    """
+    Jauge calculée à la lecture de /metrics par une fonction qui retourne
+    {tuple d'étiquettes: valeur} (taille des pools, état des disjoncteurs, ...).
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames, callback):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self._callback().items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """
+    Ensemble des métriques d'un service, rendu au format texte Prometheus.
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback_gauge(self, name, documentation, labelnames, callback):
+        return self._register(CallbackGauge(name, documentation, labelnames, callback))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def instrument_flask(app, registry, service):
+    """
+    Ajoute à une application Flask les métriques HTTP communes (latence de bout en
+    bout, nombre de requêtes par code, requêtes en cours) et l'endpoint /metrics.
+    """
+    from flask import Response, g, request
+
+    requests_total = registry.counter(
+        f"{service}_http_requests_total", "HTTP requests handled", ("endpoint", "method", "status"))
+    request_duration = registry.histogram(
+        f"{service}_http_request_duration_seconds", "End-to-end HTTP request latency", ("endpoint", "method"))
+    in_flight = registry.gauge(f"{service}_http_requests_in_flight", "HTTP requests currently being handled")
+
+    @app.before_request
+    def _metrics_start():
+        g.metrics_start = time.perf_counter()
+        in_flight.inc()
+
+    @app.after_request
+    def _metrics_record(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            endpoint = request.endpoint or "unknown"
+            request_duration.observe(time.perf_counter() - start, endpoint, request.method)
+            requests_total.inc(endpoint, request.method, str(response.status_code))
+        return response
+
+    @app.teardown_request
+    def _metrics_end(exc):
+        in_flight.dec()
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """
+        Expose les métriques du service au format texte Prometheus.
+        """
+        return Response(registry.render(), content_type=CONTENT_TYPE)
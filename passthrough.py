@@ -0,0 +1,50 @@
+import json
+import os
+
+# ===========================
+# Relais sans décodage (Gatekeeper, Trusted Host)
+# ===========================
+# Les sauts intermédiaires ne font que relayer : le corps de la requête est décodé pour
+# la validation et la journalisation mais transmis tel quel, sans être réencodé, et la
+# réponse du service en aval (code, corps) est renvoyée morceau par morceau sans être
+# désérialisée. Le coût par saut ne dépend plus de la taille du résultat.
+
+# Taille maximale d'un morceau relayé (octets)
+RELAY_CHUNK_SIZE = int(os.getenv("RELAY_CHUNK_SIZE", str(64 * 1024)))
+
+# En-têtes de la réponse amont renvoyés au client (Server-Timing est reconstruit par le traçage)
+RELAYED_HEADERS = ("Content-Type", "Retry-After")
+
+def decode_body(body):
+    """
+    Décode le corps JSON d'une requête pour la validation et la journalisation (décodeur
+    C de json, plus rapide qu'un parcours partiel en Python) ; les octets reçus restent
+    ceux transmis en aval. Retourne None si le corps n'est pas un objet ; lève
+    ValueError si le JSON est invalide.
+    """
+    fields = json.loads(body)
+    return fields if isinstance(fields, dict) else None
+
+
+def _relay_body(response, chunk_size):
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if chunk:
+                yield chunk
+    finally:
+        response.close()
+
+
+def relay(response, chunk_size=RELAY_CHUNK_SIZE):
+    """
+    Réponse Flask renvoyant le code, le type et le corps d'une réponse amont (obtenue
+    avec stream=True) morceau par morceau, puis rendant la connexion au pool.
+    """
+    from flask import Response
+
+    headers = {name: response.headers[name] for name in RELAYED_HEADERS if name in response.headers}
+    # Le corps est relayé décompressé : la longueur amont n'est valable que sans Content-Encoding
+    if "Content-Length" in response.headers and "Content-Encoding" not in response.headers:
+        headers["Content-Length"] = response.headers["Content-Length"]
+    return Response(_relay_body(response, chunk_size), status=response.status_code, headers=headers,
+                    direct_passthrough=True)
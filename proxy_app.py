@@ -1,24 +1,43 @@
 import os
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 import mysql.connector
+from mysql.connector import FieldType
+import json
 import time
+import datetime
+from decimal import Decimal
 import random
+import re
+import hashlib
 import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from bisect import bisect
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from enum import Enum
+try:
+    import msgpack
+except ImportError:  # format binaire indisponible : seuls les formats JSON sont servis
+    msgpack = None
+from admission import RETRY_AFTER, ConcurrencyLimiter, Overloaded, remaining, request_deadline
+from log_pipeline import abbreviate, configure_logging
+from cluster_config import CLUSTER_CONFIG_FILE, ClusterConfigWatcher, load_cluster_config, parse_cluster_config
+from metrics import Registry, instrument_flask
+import tracing
+from sql_lexer import (
+    QueryType, changes_session, classify, classifier_cache_info, extract_routing_key, extract_tables, fingerprint,
+    normalize, parse_single_row_insert
+)
 
 # ===========================
 # Configuration de l'application Flask et des logs
 # ===========================
 app = Flask(__name__)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("proxy.log"),  # Log to a file
-        logging.StreamHandler()  # Log to console
-    ]
-)
+# Écriture en arrière-plan (fichier et console), échantillonnage et limitation de débit
+LOG_STATS = configure_logging("proxy.log")
 logger = logging.getLogger(__name__)
 
 # ===========================
@@ -27,9 +46,8 @@ logger = logging.getLogger(__name__)
 key_path = "my-key-pair.pem"
 password_file_path = "PW.txt"
 manager_ip_file = "public_ip_manager.txt"
-worker_ips_files = ["public_ip_worker1.txt", "public_ip_worker2.txt"]
 
-required_files = [key_path, password_file_path, manager_ip_file] + worker_ips_files
+required_files = [key_path, password_file_path, manager_ip_file]
 for file in required_files:
     if not os.path.exists(file):
         logger.error(f"Error: {file} is missing.")
@@ -47,10 +65,98 @@ def load_file_content(file_path):
 
 MYSQL_PASSWORD = load_file_content(password_file_path)
 MANAGER_IP = load_file_content(manager_ip_file)
-WORKERS = [load_file_content(worker_file) for worker_file in worker_ips_files]
 MYSQL_USER = os.getenv("MYSQL_USER", "admin")
 MYSQL_DB = os.getenv("MYSQL_DB", "sakila")
 
+# Paramètres du pool de connexions (par backend host:port)
+POOL_MAX_SIZE = int(os.getenv("POOL_MAX_SIZE", "20"))
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("POOL_ACQUIRE_TIMEOUT", "5"))
+POOL_MAX_IDLE_TIME = float(os.getenv("POOL_MAX_IDLE_TIME", "300"))
+POOL_VALIDATE_AFTER = float(os.getenv("POOL_VALIDATE_AFTER", "5"))
+POOL_REAP_INTERVAL = float(os.getenv("POOL_REAP_INTERVAL", "30"))
+
+# Paramètres de la sonde de latence des workers (stratégie CUSTOMIZED)
+PROBE_INTERVAL = float(os.getenv("PROBE_INTERVAL", "1"))
+PROBE_TIMEOUT = int(os.getenv("PROBE_TIMEOUT", "2"))
+PROBE_EWMA_ALPHA = float(os.getenv("PROBE_EWMA_ALPHA", "0.3"))
+PROBE_WINDOW = int(os.getenv("PROBE_WINDOW", "50"))
+
+# Paramètres du cache de résultats (désactivé par défaut)
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "30"))
+
+# Nombre de lignes lues par lot en mode streaming
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+
+# Disjoncteurs par worker et bilan de santé
+BACKEND_CONNECT_TIMEOUT = int(os.getenv("BACKEND_CONNECT_TIMEOUT", "2"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_OPEN_TIMEOUT = float(os.getenv("BREAKER_OPEN_TIMEOUT", "5"))
+BREAKER_MAX_OPEN_TIMEOUT = float(os.getenv("BREAKER_MAX_OPEN_TIMEOUT", "60"))
+BREAKER_RECOVERY_PROBES = int(os.getenv("BREAKER_RECOVERY_PROBES", "3"))
+READ_RETRIES = int(os.getenv("READ_RETRIES", "2"))
+
+# Cohérence de session : attente maximale (secondes) qu'un worker applique le GTID d'une session
+RYW_MAX_WAIT = float(os.getenv("RYW_MAX_WAIT", "0.5"))
+
+# Regroupement des INSERT mono-ligne en INSERT multi-lignes (désactivé par défaut)
+WRITE_COALESCING_ENABLED = os.getenv("WRITE_COALESCING_ENABLED", "false").lower() in ("1", "true", "yes")
+COALESCE_WINDOW_MS = float(os.getenv("COALESCE_WINDOW_MS", "2"))
+COALESCE_MAX_BATCH = int(os.getenv("COALESCE_MAX_BATCH", "100"))
+
+# Requêtes groupées (/query/batch)
+BATCH_MAX_STATEMENTS = int(os.getenv("BATCH_MAX_STATEMENTS", "1000"))
+BATCH_READ_CONCURRENCY = int(os.getenv("BATCH_READ_CONCURRENCY", "16"))
+
+# Nombre maximal de requêtes préparées conservées par connexion
+PREPARED_CACHE_SIZE = int(os.getenv("PREPARED_CACHE_SIZE", "256"))
+
+# Contrôle d'admission : requêtes simultanées par backend et par classe (lectures +
+# écritures = POOL_MAX_SIZE), puis file d'attente bornée en taille et en durée
+BACKEND_MAX_READS = int(os.getenv("BACKEND_MAX_READS", "12"))
+BACKEND_MAX_WRITES = int(os.getenv("BACKEND_MAX_WRITES", "8"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "50"))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "1"))
+# Délai maximal d'une requête dans le proxy, réduit par le budget transmis par le Trusted Host
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "10"))
+
+# Digest des requêtes par empreinte : formes suivies (LRU), échantillons conservés
+# par forme pour le p95, taille du classement et période d'écriture dans query_digest.log
+QUERY_DIGEST_ENABLED = os.getenv("QUERY_DIGEST_ENABLED", "true").lower() in ("1", "true", "yes")
+QUERY_DIGEST_MAX_ENTRIES = int(os.getenv("QUERY_DIGEST_MAX_ENTRIES", "1000"))
+QUERY_DIGEST_WINDOW = int(os.getenv("QUERY_DIGEST_WINDOW", "200"))
+QUERY_DIGEST_TOP = int(os.getenv("QUERY_DIGEST_TOP", "20"))
+QUERY_DIGEST_DUMP_INTERVAL = float(os.getenv("QUERY_DIGEST_DUMP_INTERVAL", "300"))
+
+# Stratégie SHARDED : clés des tables ("table.colonne,...", <table>_id par défaut),
+# nombre de clés entières consécutives routées ensemble (localité des pages InnoDB),
+# points virtuels par worker sur l'anneau et stratégie des requêtes sans clé
+SHARD_KEY_COLUMNS = dict(
+    item.strip().lower().split(".", 1) for item in os.getenv("SHARD_KEY_COLUMNS", "").split(",") if "." in item
+)
+SHARD_KEY_RANGE = int(os.getenv("SHARD_KEY_RANGE", "100"))
+SHARD_VIRTUAL_NODES = int(os.getenv("SHARD_VIRTUAL_NODES", "160"))
+SHARD_FALLBACK_STRATEGY = os.getenv("SHARD_FALLBACK_STRATEGY", "least_outstanding")
+
+# Lectures couvertes (hedging) : désactivées par défaut (activables par requête avec
+# "hedge": true), percentile de latence du worker au-delà duquel la lecture est relancée
+# sur un autre worker, délai plancher, échantillons requis avant de couvrir, part
+# maximale de lectures couvertes (seau de jetons) et threads d'exécution
+HEDGE_READS = os.getenv("HEDGE_READS", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "2"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", "0.05"))
+HEDGE_BUDGET_BURST = float(os.getenv("HEDGE_BUDGET_BURST", "10"))
+HEDGE_CONCURRENCY = int(os.getenv("HEDGE_CONCURRENCY", "32"))
+
+# Topologie dynamique : intervalle de surveillance de cluster.json (0 = désactivée)
+# et connexions ouvertes à l'avance vers un worker ajouté
+CLUSTER_CONFIG_POLL_INTERVAL = float(os.getenv("CLUSTER_CONFIG_POLL_INTERVAL", "5"))
+POOL_WARMUP_SIZE = int(os.getenv("POOL_WARMUP_SIZE", "2"))
+
 # ===========================
 # Enumération des stratégies
 # ===========================
@@ -58,6 +164,9 @@ class Strategy(Enum):
     DIRECT = "direct"
     RANDOM = "random"
     CUSTOMIZED = "customized"
+    LEAST_OUTSTANDING = "least_outstanding"
+    POWER_OF_TWO = "power_of_two"
+    SHARDED = "sharded"
 
 # ===========================
 # Port associé aux stratégies
@@ -65,102 +174,2286 @@ class Strategy(Enum):
 STRATEGY_PORTS = {
     Strategy.DIRECT.value: 3306,
     Strategy.RANDOM.value: 3306,
-    Strategy.CUSTOMIZED.value: 3306
+    Strategy.CUSTOMIZED.value: 3306,
+    Strategy.LEAST_OUTSTANDING.value: 3306,
+    Strategy.POWER_OF_TWO.value: 3306,
+    Strategy.SHARDED.value: 3306
 }
 
+if SHARD_FALLBACK_STRATEGY not in STRATEGY_PORTS or SHARD_FALLBACK_STRATEGY == Strategy.SHARDED.value:
+    raise ValueError(f"Invalid SHARD_FALLBACK_STRATEGY: {SHARD_FALLBACK_STRATEGY}")
+
+# Stratégie choisie requête par requête (sinon la stratégie par défaut, /set_strategy)
+STRATEGY_HEADER = "X-Proxy-Strategy"
+
+# ===========================
+# Poids statiques des workers
+# ===========================
+def parse_weights(value):
+    """
+    Analyse une liste de poids de la forme "ip1=2,ip2=1". Les workers absents ont un poids de 1.
+    """
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        host, _, weight = item.partition("=")
+        try:
+            weights[host.strip()] = max(float(weight), 0.01)
+        except ValueError:
+            raise ValueError(f"Invalid worker weight: {item}")
+    return weights
+
+WORKER_WEIGHTS = parse_weights(os.getenv("WORKER_WEIGHTS", ""))
+
+# Topologie initiale : cluster.json, ou à défaut les fichiers public_ip_worker*.txt
+CLUSTER = load_cluster_config(default_weights=WORKER_WEIGHTS)
+
+# ===========================
+# Anneau de hachage cohérent (stratégie SHARDED)
+# ===========================
+def _ring_hash(value):
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class ConsistentHashRing:
+    """
+    Anneau de hachage cohérent des workers, avec un nombre de points virtuels
+    proportionnel au poids de chaque worker. Ajouter ou retirer un worker ne déplace
+    que les clés de ses propres arcs ; un worker hors service est sauté au profit
+    du suivant sur l'anneau, sans remapper les clés des autres.
+    """
+    def __init__(self, nodes, weights=None, virtual_nodes=SHARD_VIRTUAL_NODES):
+        weights = weights or {}
+        points = []
+        for node in nodes:
+            replicas = max(1, int(round(virtual_nodes * weights.get(node, 1.0))))
+            points.extend((_ring_hash(f"{node}#{replica}"), node) for replica in range(replicas))
+        points.sort()
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def lookup(self, key, available):
+        """
+        Retourne le premier worker de `available` à partir de la position de la clé, ou None.
+        """
+        if not self._hashes:
+            return None
+        start = bisect(self._hashes, _ring_hash(key))
+        for offset in range(len(self._nodes)):
+            node = self._nodes[(start + offset) % len(self._nodes)]
+            if node in available:
+                return node
+        return None
+
+# ===========================
+# Pool de connexions MySQL
+# ===========================
+class ConnectionPool:
+    """
+    Pool de connexions MySQL borné et thread-safe pour un backend (host, port).
+
+    Les connexions inactives sont réutilisées en LIFO, validées par un ping
+    lorsqu'elles sont restées inactives plus de `validate_after` secondes, et
+    fermées par `reap_idle` au-delà de `max_idle_time`. Une connexion rendue au
+    milieu d'une transaction est fermée ; une connexion dont la session a été
+    modifiée (`session_dirty`) est remise à zéro par `reset_fn` avant d'être réutilisée.
+    """
+    def __init__(self, host, port, connect_fn, max_size=POOL_MAX_SIZE,
+                 acquire_timeout=POOL_ACQUIRE_TIMEOUT, max_idle_time=POOL_MAX_IDLE_TIME,
+                 validate_after=POOL_VALIDATE_AFTER, reset_fn=None):
+        self.host = host
+        self.port = port
+        self._connect_fn = connect_fn
+        self._reset_fn = reset_fn
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.max_idle_time = max_idle_time
+        self.validate_after = validate_after
+        self._idle = deque()  # (connexion, instant du dernier retour au pool)
+        self._size = 0  # connexions ouvertes (inactives + empruntées)
+        self.retired = False
+        self._cond = threading.Condition(threading.Lock())
+        self._stats = {
+            "created": 0,
+            "reused": 0,
+            "closed": 0,
+            "validation_failures": 0,
+            "session_resets": 0,
+            "waits": 0,
+            "timeouts": 0,
+        }
+
+    def acquire(self, deadline=None):
+        """
+        Emprunte une connexion valide au pool, en en ouvrant une nouvelle si la
+        taille maximale n'est pas atteinte. Lève PoolError après `acquire_timeout`,
+        ou plus tôt si l'échéance `deadline` (horloge monotone) est atteinte.
+        """
+        wait_until = time.monotonic() + self.acquire_timeout
+        deadline = wait_until if deadline is None else min(wait_until, deadline)
+        while True:
+            conn, last_used = None, None
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise mysql.connector.errors.PoolError(
+                            f"Connection pool for {self.host}:{self.port} exhausted "
+                            f"({self.max_size} connections in use)"
+                        )
+                    self._stats["waits"] += 1
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect_fn(self.host, self.port)
+                except Exception:
+                    self._discard_slot()
+                    raise
+                with self._cond:
+                    self._stats["created"] += 1
+                return conn
+
+            idle_for = time.monotonic() - last_used
+            if idle_for > self.max_idle_time or (idle_for > self.validate_after and not self._is_alive(conn)):
+                with self._cond:
+                    self._stats["validation_failures"] += 1
+                self._close(conn)
+                continue
+
+            with self._cond:
+                self._stats["reused"] += 1
+            return conn
+
+    def release(self, conn, discard=False):
+        """
+        Rend une connexion au pool, ou la ferme si elle est marquée comme inutilisable
+        ou si elle est restée dans une transaction ouverte.
+        """
+        if discard or self.retired or getattr(conn, "unread_result", False) or getattr(conn, "in_transaction", False):
+            self._close(conn)
+            return
+        if getattr(conn, "session_dirty", False):
+            # L'état laissé par la requête (SET, USE, LOCK TABLES...) ne doit pas atteindre la suivante
+            try:
+                if self._reset_fn is None:
+                    raise ValueError("no session reset function")
+                self._reset_fn(conn)
+                conn.session_dirty = False
+            except Exception as e:
+                logger.warning(f"Closing connection to {self.host}:{self.port} after failed session reset: {e}")
+                self._close(conn)
+                return
+            with self._cond:
+                self._stats["session_resets"] += 1
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, deadline=None):
+        """
+        Context manager qui emprunte une connexion (voir acquire) et la rend au pool. La
+        connexion est fermée si une erreur de communication survient pendant l'emprunt.
+        """
+        with tracing.span("connect", self.host):
+            conn = self.acquire(deadline)
+        discard = False
+        try:
+            yield conn
+        except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError):
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def reap_idle(self):
+        """
+        Ferme les connexions inactives depuis plus de `max_idle_time` secondes.
+        """
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            kept = deque()
+            for conn, last_used in self._idle:
+                if now - last_used > self.max_idle_time:
+                    expired.append(conn)
+                else:
+                    kept.append((conn, last_used))
+            self._idle = kept
+        for conn in expired:
+            self._close(conn)
+        return len(expired)
+
+    def warm_up(self, count):
+        """
+        Ouvre jusqu'à `count` connexions et les place dans le pool. Retourne le
+        nombre de connexions ouvertes.
+        """
+        opened = []
+        try:
+            while len(opened) < count:
+                opened.append(self.acquire())
+        except mysql.connector.Error as e:
+            logger.warning(f"Pool warm-up for {self.host}:{self.port} stopped after {len(opened)} connection(s): {e}")
+        for conn in opened:
+            self.release(conn)
+        return len(opened)
+
+    def retire(self):
+        """
+        Retire le pool du service : les connexions inactives sont fermées et celles
+        encore empruntées le seront à leur retour, une fois la requête terminée.
+        """
+        self.retired = True
+        self.close_all()
+
+    def close_all(self):
+        """
+        Ferme toutes les connexions inactives du pool.
+        """
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+        for conn, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        """
+        Retourne un instantané des statistiques du pool.
+        """
+        with self._cond:
+            return {
+                "host": self.host,
+                "port": self.port,
+                "retired": self.retired,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_size": self.max_size,
+                **self._stats,
+            }
+
+    def _is_alive(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._discard_slot()
+        with self._cond:
+            self._stats["closed"] += 1
+
+    def _discard_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+
+class PreparedStatementCache:
+    """
+    Cache LRU de requêtes préparées côté serveur, attaché à une connexion. Chaque
+    forme de requête est préparée une seule fois (COM_STMT_PREPARE) puis exécutée
+    via le protocole binaire à chaque appel.
+    """
+    def __init__(self, conn, max_size=PREPARED_CACHE_SIZE):
+        self._conn = conn
+        self.max_size = max_size
+        self._cursors = OrderedDict()  # texte de la requête -> (curseur préparé, texte)
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        """
+        Ferme tous les curseurs préparés (avant une remise à zéro de la session, qui
+        libère les requêtes préparées côté serveur).
+        """
+        cursors, self._cursors = list(self._cursors.values()), OrderedDict()
+        for cursor, _ in cursors:
+            cursor.close()
+
+    def execute(self, query, params):
+        """
+        Exécute la requête paramétrée avec le curseur préparé en cache et le retourne.
+        """
+        entry = self._cursors.get(query)
+        if entry is None:
+            self.misses += 1
+            entry = (self._conn.cursor(prepared=True), query)
+            self._cursors[query] = entry
+            while len(self._cursors) > self.max_size:
+                _, (evicted, _) = self._cursors.popitem(last=False)
+                evicted.close()
+        else:
+            self.hits += 1
+            self._cursors.move_to_end(query)
+
+        cursor, statement = entry
+        try:
+            # Le curseur ne re-prépare pas s'il reçoit le même objet texte qu'à la préparation
+            cursor.execute(statement, params)
+        except mysql.connector.Error:
+            self._cursors.pop(query, None)
+            cursor.close()
+            raise
+        return cursor
+
+
+class ConnectionPoolRegistry:
+    """
+    Registre des pools de connexions, un par backend (host, port), avec un thread
+    de fond qui ferme périodiquement les connexions inactives.
+    """
+    def __init__(self, connect_fn, reap_interval=POOL_REAP_INTERVAL, reset_fn=None):
+        self._connect_fn = connect_fn
+        self._reset_fn = reset_fn
+        self._pools = {}
+        self._retired = set()  # backends supprimés de la topologie : aucun pool n'y est recréé
+        self._lock = threading.Lock()
+        self._reaper = threading.Thread(target=self._reap_loop, args=(reap_interval,), daemon=True)
+        self._reaper.start()
+
+    def get(self, host, port):
+        """
+        Retourne le pool d'un backend, créé au premier appel. Lève PoolError pour un
+        backend retiré, pour qu'une requête encore en vol ne recrée pas son pool.
+        """
+        key = (host, port)
+        pool = self._pools.get(key)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    if key in self._retired:
+                        raise mysql.connector.errors.PoolError(f"Backend {host}:{port} was removed from the topology")
+                    pool = ConnectionPool(host, port, self._connect_fn, reset_fn=self._reset_fn)
+                    self._pools[key] = pool
+        return pool
+
+    def retire(self, host, port):
+        """
+        Retire du registre le pool d'un backend supprimé de la topologie.
+        """
+        with self._lock:
+            pool = self._pools.pop((host, port), None)
+            self._retired.add((host, port))
+        if pool is not None:
+            pool.retire()
+
+    def admit(self, host, port):
+        """
+        Autorise de nouveau un backend retiré (worker réintégré dans la topologie).
+        """
+        with self._lock:
+            self._retired.discard((host, port))
+
+    def stats(self):
+        with self._lock:
+            pools = list(self._pools.values())
+        return [pool.stats() for pool in pools]
+
+    def _reap_loop(self, interval):
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                pools = list(self._pools.values())
+            for pool in pools:
+                try:
+                    reaped = pool.reap_idle()
+                    if reaped:
+                        logger.info(f"Reaped {reaped} idle connection(s) to {pool.host}:{pool.port}")
+                except Exception as e:
+                    logger.error(f"Idle connection reaping failed for {pool.host}:{pool.port}: {e}")
+
+# ===========================
+# Ensembles de GTID (cohérence de session)
+# ===========================
+class GtidSet:
+    """
+    Ensemble de GTID MySQL (« uuid[:tag]:1-5:7,uuid2:1-3 ») représenté par des
+    intervalles fusionnés, pour vérifier localement qu'un worker a appliqué une écriture.
+    """
+    def __init__(self, text=""):
+        self.text = (text or "").replace("\n", "")
+        self.intervals = {}  # (uuid, tag) -> [(début, fin), ...] triés et fusionnés
+        for item in self.text.split(","):
+            parts = item.strip().split(":")
+            if not parts[0]:
+                continue
+            source, tag = parts[0].lower(), None
+            for part in parts[1:]:
+                if part and part[0].isdigit():
+                    start, _, end = part.partition("-")
+                    self.intervals.setdefault((source, tag), []).append((int(start), int(end or start)))
+                else:
+                    tag = part.lower() or None
+        for key, ranges in self.intervals.items():
+            self.intervals[key] = self._merge(ranges)
+
+    @staticmethod
+    def _merge(ranges):
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+
+    def issubset(self, other):
+        for key, ranges in self.intervals.items():
+            other_ranges = other.intervals.get(key, [])
+            for start, end in ranges:
+                if not any(o_start <= start and end <= o_end for o_start, o_end in other_ranges):
+                    return False
+        return True
+
+    def sources(self):
+        """
+        Sources (uuid, tag) dont l'ensemble contient au moins une transaction.
+        """
+        return set(self.intervals)
+
+    def __bool__(self):
+        return bool(self.intervals)
+
+    def __str__(self):
+        return self.text
+
+# ===========================
+# Sonde de latence des workers
+# ===========================
+def percentile(samples, pct):
+    """
+    Percentile `pct` (0-100) d'une série d'échantillons, None si elle est vide.
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class WorkerLatencyStats:
+    """
+    Latence lissée (EWMA) et fenêtre des derniers échantillons d'un worker.
+    """
+    def __init__(self, alpha=PROBE_EWMA_ALPHA, window=PROBE_WINDOW):
+        self.alpha = alpha
+        self.ewma = None
+        self.samples = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_probe = None
+        self.gtid_executed = None  # GtidSet appliqué par le worker lors de la dernière sonde
+
+    def record_success(self, latency):
+        self.ewma = latency if self.ewma is None else self.alpha * latency + (1 - self.alpha) * self.ewma
+        self.samples.append(latency)
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_probe = time.time()
+
+    def record_failure(self, error):
+        self.consecutive_failures += 1
+        self.last_error = str(error)
+        self.last_probe = time.time()
+
+    @property
+    def available(self):
+        return self.ewma is not None and self.consecutive_failures == 0
+
+    def percentile(self, pct):
+        return percentile(self.samples, pct)
+
+    def snapshot(self):
+        return {
+            "available": self.available,
+            "ewma_ms": None if self.ewma is None else round(self.ewma * 1000, 3),
+            "p50_ms": self._ms(self.percentile(50)),
+            "p95_ms": self._ms(self.percentile(95)),
+            "p99_ms": self._ms(self.percentile(99)),
+            "samples": len(self.samples),
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+            "last_probe": self.last_probe,
+        }
+
+    @staticmethod
+    def _ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+
+class LatencyProber:
+    """
+    Thread de fond qui mesure périodiquement la latence (COM_PING sur une connexion
+    dédiée) de chaque worker et maintient le worker le plus rapide, afin que la
+    stratégie CUSTOMIZED choisisse sa cible sans aucune E/S sur le chemin de la requête.
+    """
+    def __init__(self, hosts_fn, port_fn, connect_fn, interval=PROBE_INTERVAL, timeout=PROBE_TIMEOUT, on_result=None):
+        self._hosts_fn = hosts_fn
+        self._on_result = on_result
+        self._port_fn = port_fn
+        self._connect_fn = connect_fn
+        self.interval = interval
+        self.timeout = timeout
+        self._stats = {}
+        self._connections = {}
+        self._lock = threading.Lock()
+        self.fastest = None
+        self.ready = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            return {host: stat.snapshot() for host, stat in self._stats.items()}
+
+    def get(self, host):
+        return self._stats.get(host)
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.probe_all()
+            except Exception as e:
+                logger.error(f"Latency probe round failed: {e}")
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def probe_all(self):
+        hosts = list(self._hosts_fn())
+        port = self._port_fn()
+        for host in hosts:
+            self._probe(host, port)
+
+        with self._lock:
+            for host in list(self._stats):
+                if host not in hosts:
+                    del self._stats[host]
+                    self._close((host, port))
+            candidates = [(stat.ewma, host) for host, stat in self._stats.items() if stat.available]
+        self.fastest = min(candidates)[1] if candidates else None
+        self.ready = True
+
+    def _probe(self, host, port):
+        with self._lock:
+            stat = self._stats.setdefault(host, WorkerLatencyStats())
+        key = (host, port)
+        start = time.perf_counter()
+        try:
+            conn = self._connections.get(key)
+            if conn is None:
+                conn = self._connect_fn(host, port, connect_timeout=self.timeout)
+                self._connections[key] = conn
+                start = time.perf_counter()
+            conn.ping(reconnect=False)
+            latency = time.perf_counter() - start
+            # Position de réplication du worker, pour les lectures en cohérence de session
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT @@GLOBAL.gtid_executed")
+                gtid_executed = GtidSet(cursor.fetchone()[0])
+            finally:
+                cursor.close()
+            with self._lock:
+                stat.record_success(latency)
+                stat.gtid_executed = gtid_executed
+        except Exception as e:
+            self._close(key)
+            with self._lock:
+                if stat.consecutive_failures == 0:
+                    logger.warning(f"Latency probe to {host}:{port} failed: {e}")
+                stat.record_failure(e)
+            if self._on_result:
+                self._on_result(host, False)
+            return
+        if self._on_result:
+            self._on_result(host, True)
+
+    def _close(self, key):
+        conn = self._connections.pop(key, None)
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+# ===========================
+# Disjoncteurs (circuit breakers)
+# ===========================
+class CircuitBreaker:
+    """
+    Disjoncteur d'un worker. CLOSED : le worker reçoit du trafic. Après
+    `failure_threshold` échecs consécutifs il passe OPEN et est retiré du routage.
+    À l'expiration du délai d'ouverture (doublé à chaque rechute) il passe HALF_OPEN :
+    seules les sondes de santé le testent, et il ne redevient CLOSED qu'après
+    `recovery_probes` sondes réussies d'affilée.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, host, failure_threshold=BREAKER_FAILURE_THRESHOLD, open_timeout=BREAKER_OPEN_TIMEOUT,
+                 max_open_timeout=BREAKER_MAX_OPEN_TIMEOUT, recovery_probes=BREAKER_RECOVERY_PROBES):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.base_open_timeout = open_timeout
+        self.max_open_timeout = max_open_timeout
+        self.recovery_probes = recovery_probes
+        self.state = self.CLOSED
+        self.open_timeout = open_timeout
+        self.opened_at = None
+        self.failures = 0
+        self.successes = 0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def record_success(self, from_probe=False):
+        """
+        Enregistre un succès et retourne True si l'état a changé.
+        """
+        with self._lock:
+            self._expire_open()
+            if self.state == self.CLOSED:
+                self.failures = 0
+                return False
+            if self.state == self.HALF_OPEN and from_probe:
+                self.successes += 1
+                if self.successes >= self.recovery_probes:
+                    self.state = self.CLOSED
+                    self.failures = 0
+                    self.open_timeout = self.base_open_timeout
+                    return True
+            return False
+
+    def record_failure(self):
+        """
+        Enregistre un échec et retourne True si l'état a changé.
+        """
+        with self._lock:
+            self._expire_open()
+            if self.state == self.HALF_OPEN:
+                # Rechute pendant la remise en service : ouverture plus longue
+                self.open_timeout = min(self.open_timeout * 2, self.max_open_timeout)
+                self._trip()
+                return True
+            if self.state == self.CLOSED:
+                self.failures += 1
+                if self.failures >= self.failure_threshold:
+                    self._trip()
+                    return True
+            return False
+
+    def tick(self):
+        """
+        Fait passer un disjoncteur ouvert à HALF_OPEN une fois son délai écoulé.
+        """
+        with self._lock:
+            return self._expire_open()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "recovery_successes": self.successes,
+                "open_timeout": self.open_timeout,
+                "trips": self.trips,
+            }
+
+    def _trip(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.successes = 0
+        self.trips += 1
+
+    def _expire_open(self):
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.open_timeout:
+            self.state = self.HALF_OPEN
+            self.successes = 0
+            return True
+        return False
+
+# ===========================
+# Regroupement des écritures
+# ===========================
+# Préfixe normalisé par parse_single_row_insert : schéma, table et liste de colonnes
+_INSERT_PREFIX_RE = re.compile(
+    r"^INSERT INTO (?:(`[^`]+`|[\w$]+)\.)?(`[^`]+`|[\w$]+) \((.*)\) VALUES$", re.DOTALL
+)
+
+
+class CoalescedBatch:
+    """
+    Lot d'INSERT mono-ligne compatibles (même table, mêmes colonnes) en attente.
+    """
+    def __init__(self, key):
+        self.key = key
+        self.rows = []  # (tuple de valeurs, paramètres)
+        self.deadline = None  # échéance la plus proche parmi celles des appelants
+        self.results = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class WriteCoalescer:
+    """
+    Fusionne les INSERT mono-ligne arrivant dans une courte fenêtre en un seul INSERT
+    multi-lignes. Le premier appelant d'un lot (le meneur) attend la fenêtre ou que le
+    lot soit plein, puis l'exécute dans son propre thread ; les suivants attendent le
+    résultat. Chaque appelant reçoit sa propre réponse.
+    """
+    def __init__(self, execute_batch, window=COALESCE_WINDOW_MS / 1000, max_batch=COALESCE_MAX_BATCH):
+        self._execute_batch = execute_batch
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}  # (préfixe, paramétré) -> lot ouvert
+        self._lock = threading.Lock()
+        self._stats = {"statements": 0, "batches": 0, "max_batch_seen": 0}
+
+    def submit(self, prefix, values, params, deadline=None):
+        # Les lignes paramétrées et littérales ne sont jamais mélangées : l'interpolation
+        # des paramètres prendrait un « %s » littéral pour un paramètre
+        key = (prefix, bool(params))
+        with self._lock:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = CoalescedBatch(key)
+                self._pending[key] = batch
+            index = len(batch.rows)
+            batch.rows.append((values, params))
+            if deadline is not None:
+                batch.deadline = deadline if batch.deadline is None else min(batch.deadline, deadline)
+            if len(batch.rows) >= self.max_batch:
+                del self._pending[key]
+                batch.full.set()
+
+        if not leader:
+            batch.done.wait()
+            return batch.results[index]
+
+        batch.full.wait(self.window)
+        with self._lock:
+            if self._pending.get(key) is batch:
+                del self._pending[key]
+            rows = list(batch.rows)
+            deadline = batch.deadline
+            self._stats["statements"] += len(rows)
+            self._stats["batches"] += 1
+            self._stats["max_batch_seen"] = max(self._stats["max_batch_seen"], len(rows))
+        try:
+            batch.results = self._execute_batch(prefix, rows, deadline)
+        except Exception as e:
+            logger.error(f"Coalesced insert failed: {e}")
+            batch.results = [{"status": "error", "message": f"Coalesced insert failed: {e}"} for _ in rows]
+        finally:
+            batch.done.set()
+        return batch.results[index]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+# ===========================
+# Requêtes en cours par backend
+# ===========================
+class InFlightTracker:
+    """
+    Compte les requêtes en cours par hôte, pour les stratégies sensibles à la charge.
+    """
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def begin(self, host):
+        with self._lock:
+            self._counts[host] = self._counts.get(host, 0) + 1
+
+    def end(self, host):
+        with self._lock:
+            self._counts[host] = self._counts.get(host, 1) - 1
+
+    @contextmanager
+    def track(self, host):
+        self.begin(host)
+        try:
+            yield
+        finally:
+            self.end(host)
+
+    def get(self, host):
+        return self._counts.get(host, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+# ===========================
+# Contrôle d'admission par backend
+# ===========================
+class AdmissionController:
+    """
+    Limiteurs de concurrence par backend et par classe de requête ("read" ou "write").
+    Une requête au-delà de la limite attend au plus ADMISSION_MAX_WAIT secondes (et
+    jamais au-delà de son échéance) ; sinon elle est rejetée par Overloaded.
+    """
+    def __init__(self, max_reads=BACKEND_MAX_READS, max_writes=BACKEND_MAX_WRITES,
+                 max_queue=ADMISSION_MAX_QUEUE, max_wait=ADMISSION_MAX_WAIT):
+        self.limits = {"read": max_reads, "write": max_writes}
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def get(self, host, kind):
+        key = (host, kind)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.get(key)
+                if limiter is None:
+                    limiter = ConcurrencyLimiter(self.limits[kind], self.max_queue)
+                    self._limiters[key] = limiter
+        return limiter
+
+    def acquire(self, host, kind, deadline=None):
+        """
+        Réserve une place sur le backend et retourne le limiteur à libérer (release).
+        """
+        wait_until = time.monotonic() + self.max_wait
+        if deadline is not None:
+            if remaining(deadline) <= 0:
+                SHED_TOTAL.inc(host, kind, "deadline")
+                raise Overloaded("request deadline exceeded", "deadline")
+            wait_until = min(wait_until, deadline)
+        limiter = self.get(host, kind)
+        try:
+            with tracing.span("admission", host):
+                limiter.acquire(wait_until)
+        except Overloaded as e:
+            SHED_TOTAL.inc(host, kind, e.reason)
+            raise
+        return limiter
+
+    @contextmanager
+    def slot(self, host, kind, deadline=None):
+        limiter = self.acquire(host, kind, deadline)
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def stats(self):
+        with self._lock:
+            limiters = dict(self._limiters)
+        return [{"host": host, "kind": kind, **limiter.stats()} for (host, kind), limiter in limiters.items()]
+
+# ===========================
+# Lectures couvertes (hedging)
+# ===========================
+class HedgeBudget:
+    """
+    Seau de jetons limitant la charge ajoutée par les lectures couvertes : chaque
+    lecture éligible rapporte `ratio` jeton (au plus `burst`), chaque relance en coûte un.
+    """
+    def __init__(self, ratio=HEDGE_BUDGET_RATIO, burst=HEDGE_BUDGET_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_acquire(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class QueryCancelToken:
+    """
+    Permet d'interrompre depuis un autre thread la requête qu'un thread exécute sur
+    un backend (KILL QUERY sur l'identifiant de sa connexion). Tant qu'une
+    interruption est en cours, la connexion n'est pas rendue au pool : le KILL ne
+    peut pas atteindre la requête suivante d'une autre requête.
+    """
+    def __init__(self):
+        self.cancelled = False
+        self._target = None  # (hôte, port, identifiant de connexion MySQL)
+        self._lock = threading.Lock()
+
+    def attach(self, host, port, connection_id):
+        """
+        Associe la connexion qui va exécuter la requête. Retourne False si
+        l'annulation a déjà été demandée (la requête ne doit pas être lancée).
+        """
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._target = (host, port, connection_id)
+            return True
+
+    def detach(self):
+        with self._lock:
+            self._target = None
+
+    def cancel(self, kill):
+        """
+        Marque la requête comme annulée et appelle `kill(hôte, port, identifiant)`
+        si elle est en cours d'exécution.
+        """
+        with self._lock:
+            self.cancelled = True
+            if self._target is not None:
+                kill(*self._target)
+
+# ===========================
+# Digest des requêtes par empreinte
+# ===========================
+class QueryDigestEntry:
+    """
+    Agrégats d'une forme de requête : nombre d'exécutions et d'erreurs, temps total
+    et maximal, lignes retournées ou modifiées, hôtes ciblés et derniers temps
+    d'exécution (p95).
+    """
+    def __init__(self, query_fingerprint, example, window):
+        self.fingerprint = query_fingerprint
+        self.example = example
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.hosts = {}
+        self.samples = deque(maxlen=window)
+        self.first_seen = time.time()
+        self.last_seen = self.first_seen
+
+    def record(self, duration, rows, host, error):
+        self.count += 1
+        self.errors += error
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.rows += rows
+        self.hosts[host] = self.hosts.get(host, 0) + 1
+        self.samples.append(duration)
+        self.last_seen = time.time()
+
+    def snapshot(self):
+        return {
+            "fingerprint": self.fingerprint,
+            "example": self.example,
+            "count": self.count,
+            "errors": self.errors,
+            "total_time_s": round(self.total_time, 6),
+            "avg_ms": round(self.total_time / self.count * 1000, 3),
+            "p95_ms": round(percentile(self.samples, 95) * 1000, 3),
+            "max_ms": round(self.max_time * 1000, 3),
+            "rows": self.rows,
+            "rows_avg": round(self.rows / self.count, 2),
+            "hosts": dict(self.hosts),
+            "first_seen": self.first_seen,
+            "last_seen": self.last_seen,
+        }
+
+
+class QueryDigest:
+    """
+    Digest en ligne du temps passé sur les backends par forme de requête (empreinte :
+    littéraux retirés, listes IN/VALUES réduites), à la manière de pt-query-digest.
+    La mémoire est bornée : au-delà de `max_entries` formes, la moins récemment vue
+    est oubliée.
+    """
+    ORDERS = ("total_time", "count", "max_time", "p95", "rows", "errors")
+
+    def __init__(self, enabled=QUERY_DIGEST_ENABLED, max_entries=QUERY_DIGEST_MAX_ENTRIES, window=QUERY_DIGEST_WINDOW):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.window = window
+        self._entries = OrderedDict()  # empreinte -> QueryDigestEntry
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.since = time.time()
+
+    def record(self, query, duration, rows, host, error=False):
+        if not self.enabled:
+            return
+        key = fingerprint(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = QueryDigestEntry(key, abbreviate(normalize(query)), self.window)
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._entries.move_to_end(key)
+            entry.record(duration, rows, host, error)
+
+    def top(self, limit=QUERY_DIGEST_TOP, order="total_time"):
+        """
+        Retourne les `limit` formes les plus coûteuses selon `order` et le total global.
+        """
+        with self._lock:
+            snapshots = [entry.snapshot() for entry in self._entries.values()]
+            evicted = self.evicted
+        grand_total = sum(snapshot["total_time_s"] for snapshot in snapshots)
+        sort_key = {
+            "total_time": "total_time_s", "count": "count", "max_time": "max_ms",
+            "p95": "p95_ms", "rows": "rows", "errors": "errors",
+        }[order]
+        ranked = sorted(snapshots, key=lambda snapshot: snapshot[sort_key], reverse=True)[:limit]
+        for snapshot in ranked:
+            snapshot["share_pct"] = round(100 * snapshot["total_time_s"] / grand_total, 2) if grand_total else 0.0
+        return {
+            "since": self.since,
+            "queries": sum(snapshot["count"] for snapshot in snapshots),
+            "total_time_s": round(grand_total, 6),
+            "fingerprints": len(snapshots),
+            "evicted": evicted,
+            "top": ranked,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self.evicted = 0
+            self.since = time.time()
+
+    def report(self, limit=QUERY_DIGEST_TOP):
+        """
+        Rapport texte du classement par temps total (profil à la pt-query-digest).
+        """
+        digest = self.top(limit)
+        lines = [
+            f"# {digest['queries']} queries, {digest['total_time_s']:.3f}s total, "
+            f"{digest['fingerprints']} fingerprints ({digest['evicted']} evicted)",
+            f"# {'Rank':>4} {'Total(s)':>10} {'Share':>7} {'Calls':>8} {'Avg(ms)':>9} "
+            f"{'P95(ms)':>9} {'Max(ms)':>9} {'Rows':>8}  Fingerprint",
+        ]
+        for rank, entry in enumerate(digest["top"], start=1):
+            lines.append(
+                f"# {rank:>4} {entry['total_time_s']:>10.4f} {entry['share_pct']:>6.1f}% {entry['count']:>8} "
+                f"{entry['avg_ms']:>9.3f} {entry['p95_ms']:>9.3f} {entry['max_ms']:>9.3f} {entry['rows']:>8}  "
+                f"{abbreviate(entry['fingerprint'])}"
+            )
+        return "\n".join(lines)
+
+    def start_dumps(self, interval, log_file):
+        """
+        Écrit périodiquement le rapport dans `log_file` depuis un thread de fond.
+        """
+        digest_logger = logging.getLogger("proxy.digest")
+        digest_logger.propagate = False
+        digest_logger.setLevel(logging.INFO)
+        if not digest_logger.handlers:
+            handler = logging.FileHandler(log_file)
+            handler.setFormatter(logging.Formatter("%(asctime)s - Query digest\n%(message)s"))
+            digest_logger.addHandler(handler)
+
+        def dump_loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    if self._entries:
+                        digest_logger.info(self.report())
+                except Exception as e:
+                    logger.error(f"Query digest dump failed: {e}")
+
+        threading.Thread(target=dump_loop, name="query-digest-dump", daemon=True).start()
+
+# ===========================
+# Cache de résultats
+# ===========================
+# Fonctions dont le résultat varie d'un appel à l'autre : les requêtes qui les utilisent ne sont jamais mises en cache
+NON_DETERMINISTIC_FUNCTIONS = (
+    "NOW(", "CURDATE(", "CURTIME(", "SYSDATE(", "UNIX_TIMESTAMP(", "CURRENT_", "UTC_",
+    "RAND(", "UUID(", "LAST_INSERT_ID(", "FOUND_ROWS(", "ROW_COUNT(", "CONNECTION_ID(", "SLEEP(",
+)
+
+
+class ResultCache:
+    """
+    Cache LRU des résultats de lecture, borné en nombre d'entrées et en mémoire,
+    avec expiration (TTL) et invalidation par table lors des écritures.
+    """
+    def __init__(self, enabled=RESULT_CACHE_ENABLED, max_entries=RESULT_CACHE_MAX_ENTRIES,
+                 max_bytes=RESULT_CACHE_MAX_BYTES, ttl=RESULT_CACHE_TTL):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # clé -> (résultat, tables, taille, expiration)
+        self._by_table = {}  # table -> ensemble de clés
+        self._bytes = 0
+        self._epoch = 0  # incrémenté à chaque invalidation
+        # Tables dont l'écriture peut modifier d'autres tables (trigger, clé étrangère en
+        # cascade) ; None tant qu'elles ne sont pas connues
+        self.cascading_tables = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def make_key(self, query, params):
+        """
+        Construit la clé de cache (requête normalisée + paramètres), ou None si la
+        requête n'est pas cacheable.
+        """
+        upper = query.upper()
+        if any(function in upper for function in NON_DETERMINISTIC_FUNCTIONS):
+            return None
+        tables = extract_tables(query)
+        if not tables:
+            return None
+        return (normalize(query), repr(params) if params else None), frozenset(tables)
+
+    def epoch(self):
+        return self._epoch
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry[3] < now:
+                self._remove(key)
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key, tables, result, epoch):
+        """
+        Enregistre un résultat, sauf si une écriture a invalidé le cache depuis `epoch`
+        (le résultat pourrait alors être périmé).
+        """
+        size = len(repr(result))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, tables, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            self._stats["stores"] += 1
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, tables=None):
+        """
+        Supprime les entrées qui dépendent des tables données, ou tout le cache si
+        les tables sont inconnues, si l'une d'elles peut modifier d'autres tables
+        (`cascading_tables`) ou si ces dépendances ne sont pas connues.
+        """
+        cascading = self.cascading_tables
+        if tables and (cascading is None or cascading & set(tables)):
+            tables = None
+        with self._lock:
+            self._epoch += 1
+            if not tables:
+                removed = len(self._entries)
+                self._entries.clear()
+                self._by_table.clear()
+                self._bytes = 0
+            else:
+                keys = set()
+                for table in tables:
+                    keys |= self._by_table.get(table, set())
+                for key in keys:
+                    self._remove(key)
+                removed = len(keys)
+            self._stats["invalidations"] += removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                **self._stats,
+            }
+
+    def _remove(self, key):
+        result, tables, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        for table in tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+# ===========================
+# Métriques
+# ===========================
+METRICS = Registry()
+QUERY_DURATION = METRICS.histogram(
+    "proxy_query_duration_seconds", "End-to-end /query latency in the proxy", ("strategy", "kind", "target"))
+QUERIES_TOTAL = METRICS.counter(
+    "proxy_queries_total", "Queries handled by /query, by routing decision and outcome",
+    ("strategy", "kind", "target", "status"))
+BACKEND_DURATION = METRICS.histogram(
+    "proxy_backend_duration_seconds", "Time spent on a backend (checkout, execute, fetch)", ("host", "kind"))
+BACKEND_ERRORS = METRICS.counter("proxy_backend_errors_total", "Failed backend queries", ("host", "kind", "cause"))
+SHARD_ROUTING = METRICS.counter(
+    "proxy_shard_routing_total", "SHARDED reads routed by key or by the fallback strategy", ("outcome",))
+SHED_TOTAL = METRICS.counter(
+    "proxy_shed_total", "Queries rejected by admission control", ("host", "kind", "reason"))
+HEDGES_TOTAL = METRICS.counter(
+    "proxy_hedged_reads_total", "Hedged read decisions and which request answered first", ("outcome",))
+
 # ===========================
 # Classe ProxyManager
 # ===========================
 class ProxyManager:
-    def __init__(self, manager_host, worker_hosts, mysql_user, mysql_password):
+    def __init__(self, manager_host, worker_hosts, mysql_user, mysql_password, worker_weights=None):
         self.manager_host = manager_host
-        self.worker_hosts = worker_hosts
+        self.all_workers = list(worker_hosts)
+        # Workers routables : remplacée atomiquement quand un disjoncteur change d'état
+        self.worker_hosts = list(worker_hosts)
+        self.breakers = {worker: CircuitBreaker(worker) for worker in self.all_workers}
+        # L'anneau contient tous les workers configurés : une éjection ne remappe que les clés du worker éjecté
+        self.shard_ring = ConsistentHashRing(self.all_workers, worker_weights)
+        # Sérialise les changements de topologie et de santé des workers
+        self._topology_lock = threading.Lock()
         self.mysql_user = mysql_user
         self.mysql_password = mysql_password
         self.current_strategy = Strategy.DIRECT.value
         self.current_port = STRATEGY_PORTS[Strategy.DIRECT.value]
+        self.pools = ConnectionPoolRegistry(self._get_connection, reset_fn=self._reset_session)
+        self.result_cache = ResultCache()
+        self.in_flight = InFlightTracker()
+        self.admission = AdmissionController()
+        self.digest = QueryDigest()
+        # Latences des lectures réelles par worker : seuil de déclenchement des lectures couvertes
+        self.read_latency = {}
+        self.hedge_budget = HedgeBudget()
+        self.worker_weights = dict(worker_weights or {})
+        self.coalescer = WriteCoalescer(self._execute_coalesced) if WRITE_COALESCING_ENABLED else None
+        self._auto_increment_increment = None
+        # (schéma, table) -> colonne AUTO_INCREMENT (None si la table n'en a pas)
+        self._auto_increment_columns = {}
+        # La sonde sert aussi de bilan de santé : elle teste tous les workers, y compris ceux retirés
+        self.prober = LatencyProber(
+            lambda: self.all_workers, lambda: self.current_port, self._get_connection,
+            on_result=self._on_probe_result
+        )
         logger.info(f"ProxyManager initialized with strategy: {self.current_strategy}, port: {self.current_port}")
 
-    def _get_connection(self, host, port):
+    def _on_probe_result(self, host, ok):
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            return
+        changed = breaker.tick()
+        changed = (breaker.record_success(from_probe=True) if ok else breaker.record_failure()) or changed
+        if changed:
+            self._refresh_workers()
+
+    def _record_backend_result(self, host, ok):
+        """
+        Alimente le disjoncteur d'un worker avec le résultat d'une requête réelle.
+        """
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            return
+        if (breaker.record_success() if ok else breaker.record_failure()):
+            self._refresh_workers()
+
+    def _refresh_workers(self):
+        with self._topology_lock:
+            healthy = [worker for worker in self.all_workers if self.breakers[worker].state == CircuitBreaker.CLOSED]
+            ejected = set(self.worker_hosts) - set(healthy)
+            restored = set(healthy) - set(self.worker_hosts)
+            self.worker_hosts = healthy
+        for worker in ejected:
+            logger.warning(f"Worker {worker} ejected (circuit {self.breakers[worker].state})")
+        for worker in restored:
+            logger.info(f"Worker {worker} restored after successful health checks")
+
+    def apply_topology(self, config):
+        """
+        Remplace l'ensemble des workers et leurs poids. Les pools des nouveaux workers
+        sont préchauffés avant qu'ils ne reçoivent du trafic ; les workers supprimés
+        cessent d'être choisis immédiatement et leurs connexions sont fermées à la
+        fin des requêtes en cours. Deux mises à jour concurrentes sont appliquées l'une
+        après l'autre.
+        """
+        with self._topology_lock:
+            added = [worker for worker in config.workers if worker not in self.breakers]
+            removed = [worker for worker in dict.fromkeys(self.all_workers) if worker not in config.workers]
+            if added:
+                for worker in added:
+                    self.pools.admit(worker, self.current_port)
+                with ThreadPoolExecutor(max_workers=len(added)) as executor:
+                    list(executor.map(lambda worker: self.pools.get(worker, self.current_port).warm_up(POOL_WARMUP_SIZE), added))
+
+            breakers = {
+                worker: self.breakers.get(worker) or CircuitBreaker(worker)
+                for worker in config.workers
+            }
+            # Chaque attribut est remplacé d'un bloc : les workers routables sont publiés
+            # en dernier, une fois leurs disjoncteurs et poids en place
+            self.breakers = breakers
+            self.worker_weights = dict(config.weights)
+            self.shard_ring = ConsistentHashRing(config.workers, config.weights)
+            self.all_workers = list(config.workers)
+            self.worker_hosts = [worker for worker in config.workers if breakers[worker].state == CircuitBreaker.CLOSED]
+
+        for worker in removed:
+            # Le pool du manager sert aussi les écritures : il n'est jamais retiré
+            if worker != self.manager_host:
+                self.pools.retire(worker, self.current_port)
+        logger.info(f"Topology updated: {len(config.workers)} worker(s), added {added or 'none'}, removed {removed or 'none'}")
+        return {"workers": self.all_workers, "weights": self.worker_weights, "added": added, "removed": removed}
+
+    def _get_connection(self, host, port, connect_timeout=BACKEND_CONNECT_TIMEOUT):
         try:
-            return mysql.connector.connect(
+            conn = mysql.connector.connect(
                 host=host,
                 port=port,
                 user=self.mysql_user,
                 password=self.mysql_password,
                 database=MYSQL_DB,
-                connect_timeout=10
+                connect_timeout=connect_timeout,
+                autocommit=True
             )
+            conn.statement_cache = PreparedStatementCache(conn)
+            return conn
         except mysql.connector.Error as e:
             logger.error(f"Connection to {host}:{port} failed: {e}")
             raise e
 
-    def route_request(self, query, params=None, is_write=False):
-        target_host, target_port = None, None
-        if is_write or self.current_strategy == Strategy.DIRECT.value:
-            target_host, target_port = self.manager_host, self.current_port
-        elif self.current_strategy == Strategy.RANDOM.value:
-            target_host = random.choice(self.worker_hosts)
-            target_port = self.current_port
-        elif self.current_strategy == Strategy.CUSTOMIZED.value:
-            target_host = self._get_fastest_worker()
-            target_port = self.current_port
+    @staticmethod
+    def _reset_session(conn):
+        """
+        Remet à zéro la session d'une connexion rendue au pool (COM_RESET_CONNECTION :
+        variables, verrous, tables temporaires, requêtes préparées), puis rétablit les
+        réglages de connexion et la base par défaut.
+        """
+        conn.statement_cache.clear()
+        if not conn.cmd_reset_connection():
+            raise mysql.connector.errors.NotSupportedError("COM_RESET_CONNECTION is not supported by the server")
+        conn.database = MYSQL_DB
+
+    def route_request(self, query, params=None, is_write=False, use_cache=True, session_token=None, deadline=None,
+                      strategy=None, hedge=None):
+        """
+        Route une requête selon `strategy`, ou à défaut la stratégie par défaut du proxy
+        (lue une seule fois : un changement concurrent n'affecte pas la requête en cours).
+        Si `session_token` n'est pas None,
+        la cohérence de session (read-your-writes) est appliquée : une écriture renvoie
+        la position GTID du manager dans `session_token`, et une lecture n'est servie
+        que par un worker ayant appliqué cette position (sinon par le manager).
+        `deadline` (horloge monotone) borne l'attente dans le contrôle d'admission.
+        Avec `hedge` (HEDGE_READS par défaut), une lecture sur un worker est couverte
+        par une seconde lecture si elle tarde (voir _execute_hedged).
+        """
+        strategy = strategy or self.current_strategy
+        hedge = HEDGE_READS if hedge is None else hedge
+        session_gtid = GtidSet(session_token) if session_token else None
+        cache_key = None
+        if not is_write and use_cache and self.result_cache.enabled and not session_gtid:
+            cacheable = self.result_cache.make_key(query, params)
+            if cacheable is not None:
+                cache_key, cache_tables = cacheable
+                cached = self.result_cache.get(cache_key)
+                if cached is not None:
+                    return {**cached, "cached": True, "strategy": strategy}
+                cache_epoch = self.result_cache.epoch()
 
+        target_host, target_port = self._select_target(is_write, strategy, query, params)
         if not target_host:
             return {"status": "error", "message": "No available workers or strategy not implemented"}
 
-        return self._execute_query(target_host, target_port, query, params, is_write)
+        wait_gtid = None
+        if session_gtid and target_host != self.manager_host:
+            target_host, wait_gtid = self._select_consistent_worker(target_host, session_gtid)
 
-    def _get_fastest_worker(self):
-        response_times = {}
-        for worker in self.worker_hosts:
-            start_time = time.time()
+        coalescible = None
+        if is_write and self.coalescer is not None and session_token is None:
+            coalescible = self._coalescible_insert(query, params)
+
+        if coalescible is not None:
+            with tracing.span("coalesce"):
+                response = self.coalescer.submit(coalescible[0], coalescible[1], params, deadline)
+        elif hedge and not is_write and wait_gtid is None and target_host != self.manager_host:
+            response = self._execute_hedged(target_host, target_port, query, params, deadline, session_gtid)
+        else:
+            response = self._execute_query(
+                target_host, target_port, query, params, is_write,
+                capture_gtid=is_write and session_token is not None,
+                wait_gtid=wait_gtid,
+                deadline=deadline
+            )
+        if response is None:
+            # Aucun worker n'a rattrapé la session dans le délai : lecture sur le manager
+            logger.info(f"Session GTID not applied on {target_host} within {RYW_MAX_WAIT}s, reading from manager")
+            response = self._execute_query(self.manager_host, self.current_port, query, params, is_write, deadline=deadline)
+
+        if not is_write and response.get("backend_failure") and target_host != self.manager_host:
+            response = self._retry_read(target_host, target_port, query, params, session_gtid, deadline)
+        response.pop("backend_failure", None)
+        response["strategy"] = strategy
+
+        if is_write and self._auto_increment_columns and classify(query) is QueryType.DDL:
+            # Un ALTER TABLE peut ajouter ou retirer une colonne AUTO_INCREMENT
+            self._auto_increment_columns.clear()
+        if is_write and self.result_cache.enabled:
+            # Les tables inconnues (DDL, requête non analysable) vident tout le cache
+            self._invalidate_cache(extract_tables(query), classify(query) is QueryType.DDL)
+        elif cache_key is not None and response.get("status") == "success" and "result" in response:
+            self.result_cache.put(cache_key, cache_tables, response, cache_epoch)
+
+        if session_token is not None and "session_token" not in response:
+            response = {**response, "session_token": session_token}
+        return response
+
+    def _invalidate_cache(self, tables, ddl=False):
+        """
+        Invalide le cache de résultats après une écriture sur `tables`. Un DDL peut
+        créer ou supprimer un trigger ou une clé étrangère : les tables en cascade
+        sont alors relues à la prochaine écriture.
+        """
+        if ddl:
+            self.result_cache.cascading_tables = None
+        elif tables and self.result_cache.cascading_tables is None:
+            self.result_cache.cascading_tables = self._load_cascading_tables()
+        self.result_cache.invalidate(tables)
+
+    def _load_cascading_tables(self):
+        """
+        Retourne les tables dont l'écriture modifie d'autres tables : tables portant un
+        trigger et tables référencées par une clé étrangère ON DELETE/ON UPDATE autre que
+        RESTRICT/NO ACTION. Les noms sont sans schéma, comme ceux d'extract_tables.
+        None si la lecture échoue (le cache est alors vidé à chaque écriture).
+        """
+        try:
+            with self.pools.get(self.manager_host, self.current_port).connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(
+                        "SELECT EVENT_OBJECT_TABLE FROM information_schema.TRIGGERS "
+                        "UNION SELECT REFERENCED_TABLE_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS "
+                        "WHERE DELETE_RULE NOT IN ('RESTRICT', 'NO ACTION') "
+                        "OR UPDATE_RULE NOT IN ('RESTRICT', 'NO ACTION')"
+                    )
+                    rows = cursor.fetchall()
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
+            logger.warning(f"Trigger and foreign key lookup failed, writes will clear the result cache: {e}")
+            return None
+        return {row[0].lower() for row in rows}
+
+    def _coalescible_insert(self, query, params):
+        parsed = parse_single_row_insert(query)
+        if parsed is None:
+            return None
+        # L'interpolation côté client des lignes fusionnées interprète les « % » littéraux
+        if params and "%" in parsed[1].replace("%s", ""):
+            return None
+        # Une valeur explicite de la clé décale les identifiants générés pour les lignes suivantes
+        if self._sets_auto_increment(parsed[0]):
+            return None
+        return parsed
+
+    def _sets_auto_increment(self, prefix):
+        """
+        Indique si les colonnes d'un préfixe « INSERT INTO table (cols) VALUES »
+        contiennent la colonne AUTO_INCREMENT de la table, recherchée une fois par
+        table dans information_schema. En cas de doute, l'INSERT n'est pas fusionné.
+        """
+        match = _INSERT_PREFIX_RE.match(prefix)
+        if match is None:
+            return True
+        schema, table, columns = match.groups()
+        key = (schema and schema.strip("`"), table.strip("`"))
+        if key not in self._auto_increment_columns:
             try:
-                conn = self._get_connection(worker, self.current_port)
-                conn.close()
-                response_times[worker] = time.time() - start_time
-            except Exception:
-                response_times[worker] = float('inf')
+                with self.pools.get(self.manager_host, self.current_port).connection() as conn:
+                    cursor = conn.cursor()
+                    try:
+                        cursor.execute(
+                            "SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                            "WHERE TABLE_SCHEMA = COALESCE(%s, DATABASE()) AND TABLE_NAME = %s "
+                            "AND EXTRA LIKE %s",
+                            (*key, "%auto_increment%")
+                        )
+                        row = cursor.fetchone()
+                    finally:
+                        cursor.close()
+            except mysql.connector.Error as e:
+                logger.warning(f"AUTO_INCREMENT lookup for {table} failed, not coalescing: {e}")
+                return True
+            self._auto_increment_columns[key] = row[0].lower() if row else None
+        column = self._auto_increment_columns[key]
+        return column is not None and column in {name.strip("`").lower() for name in columns.split(", ")}
+
+    def _execute_coalesced(self, prefix, rows, deadline=None):
+        """
+        Exécute un lot d'INSERT mono-ligne sous forme d'un INSERT multi-lignes dans une
+        transaction sur le manager. Les identifiants générés sont consécutifs pour un
+        INSERT multi-lignes simple, ce qui permet de rendre à chaque appelant le sien.
+        Si le lot échoue, chaque ligne est rejouée seule pour isoler l'erreur.
+        `deadline` est l'échéance la plus proche des appelants du lot.
+        """
+        host, port = self.manager_host, self.current_port
+        query = f"{prefix} " + ", ".join(values for values, _ in rows)
+        params = [value for _, row_params in rows for value in (row_params or [])]
+        try:
+            with self.admission.slot(host, "write", deadline), self.in_flight.track(host), \
+                    self.pools.get(host, port).connection(deadline) as conn:
+                increment = self._get_auto_increment_increment(conn)
+                conn.start_transaction()
+                cursor = conn.cursor()
+                try:
+                    start = time.perf_counter()
+                    cursor.execute(query, params or None)
+                    first_id = cursor.lastrowid
+                    conn.commit()
+                    self.digest.record(query, time.perf_counter() - start, len(rows), host)
+                except mysql.connector.Error:
+                    conn.rollback()
+                    raise
+                finally:
+                    cursor.close()
+        except Overloaded as e:
+            return [self._overloaded_response(host, port, e) for _ in rows]
+        except mysql.connector.Error as e:
+            if len(rows) == 1:
+                logger.error(f"Query failed on {host}:{port}: {e}")
+                return [{"status": "error", "message": f"Query failed on {host}:{port}: {e}"}]
+            logger.warning(f"Coalesced insert of {len(rows)} rows failed, replaying individually: {e}")
+            return [
+                self._execute_query(host, port, f"{prefix} {values}", row_params, True, deadline=deadline)
+                for values, row_params in rows
+            ]
+
+        return [
+            {
+                "status": "success",
+                "message": "Query executed successfully.",
+                "rowcount": 1,
+                "lastrowid": first_id + index * increment if first_id else first_id,
+                "coalesced": len(rows),
+                "host": host,
+                "port": port
+            }
+            for index in range(len(rows))
+        ]
+
+    def _get_auto_increment_increment(self, conn):
+        if self._auto_increment_increment is None:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT @@SESSION.auto_increment_increment")
+                self._auto_increment_increment = int(cursor.fetchone()[0])
+            finally:
+                cursor.close()
+        return self._auto_increment_increment
+
+    def _retry_read(self, failed_host, port, query, params, session_gtid, deadline=None):
+        """
+        Rejoue une lecture échouée sur les autres workers en service, puis sur le manager.
+        """
+        tried = {failed_host}
+        response = None
+        for _ in range(READ_RETRIES):
+            others = [worker for worker in self.worker_hosts if worker not in tried]
+            if not others:
+                break
+            worker = self._get_least_loaded_worker(others)
+            tried.add(worker)
+            wait_gtid = session_gtid if session_gtid and not self._worker_has_applied(worker, session_gtid) else None
+            if wait_gtid and not self._worker_can_catch_up(worker, session_gtid):
+                continue
+            logger.warning(f"Retrying read from {failed_host} on {worker}")
+            response = self._execute_query(worker, port, query, params, False, wait_gtid=wait_gtid, deadline=deadline)
+            if response is not None and not response.get("backend_failure"):
+                return response
+        logger.warning(f"Retrying read from {failed_host} on manager")
+        return self._execute_query(self.manager_host, port, query, params, False, deadline=deadline)
+
+    def _execute_hedged(self, host, port, query, params, deadline=None, session_gtid=None):
+        """
+        Exécute une lecture sur `host` ; si elle n'a pas répondu après le percentile
+        HEDGE_PERCENTILE des lectures récentes de ce worker, la relance sur le worker le
+        moins chargé parmi les autres (dans la limite du budget) et retourne la première
+        réponse réussie. La requête perdante est interrompue par KILL QUERY.
+        Avec `session_gtid`, seuls les workers ayant appliqué la session sont candidats.
+        """
+        self.hedge_budget.record_request()
+        threshold = self._hedge_threshold(host)
+        if threshold is None:
+            return self._execute_query(host, port, query, params, False, deadline=deadline)
+        tokens = {}
+        primary = self._submit_read(host, port, query, params, deadline, tokens)
+        try:
+            return primary.result(timeout=threshold)
+        except FutureTimeout:
+            pass
+
+        others = [worker for worker in self.worker_hosts if worker != host
+                  and (session_gtid is None or self._worker_has_applied(worker, session_gtid))]
+        if not others:
+            return primary.result()
+        if not self.hedge_budget.try_acquire():
+            HEDGES_TOTAL.inc("budget_exhausted")
+            return primary.result()
+        hedge_host = self._get_least_loaded_worker(others)
+        logger.info(f"Read on {host} slower than {threshold * 1000:.1f}ms, hedging on {hedge_host}")
+        HEDGES_TOTAL.inc("sent")
+        with tracing.span("hedge", hedge_host):
+            hedged = self._submit_read(hedge_host, port, query, params, deadline, tokens)
+            pending = {primary, hedged}
+            response = None
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result = future.result()
+                    if result.get("status") == "success":
+                        HEDGES_TOTAL.inc("hedge_won" if future is hedged else "primary_won")
+                        for loser in pending:
+                            HEDGE_EXECUTOR.submit(tokens[loser].cancel, self._kill_query)
+                        return {**result, "hedged": True}
+                    if future is primary or response is None:
+                        response = result
+        # Les deux lectures ont échoué : la réponse du worker choisi permet le rejeu habituel
+        HEDGES_TOTAL.inc("both_failed")
+        return response
+
+    def _submit_read(self, host, port, query, params, deadline, tokens):
+        token = QueryCancelToken()
+        future = HEDGE_EXECUTOR.submit(
+            tracing.bind(self._execute_query), host, port, query, params, False, deadline=deadline, cancel=token
+        )
+        tokens[future] = token
+        return future
 
-        fastest_worker = min(response_times, key=response_times.get)
-        if response_times[fastest_worker] == float('inf'):
-            logger.error("All workers are unreachable.")
+    def _hedge_threshold(self, host):
+        """
+        Délai (secondes) avant de couvrir une lecture sur `host`, None tant que trop peu
+        de lectures ont été mesurées sur ce worker.
+        """
+        stats = self.read_latency.get(host)
+        if stats is None or len(stats.samples) < HEDGE_MIN_SAMPLES:
             return None
-        return fastest_worker
+        return max(stats.percentile(HEDGE_PERCENTILE), HEDGE_MIN_DELAY_MS / 1000)
 
-    def _execute_query(self, host, port, query, params, is_write):
+    def _kill_query(self, host, port, connection_id):
+        try:
+            with self.pools.get(host, port).connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(f"KILL QUERY {int(connection_id)}")
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as e:
+            logger.warning(f"Could not cancel hedged read on {host}:{port}: {e}")
+
+    def _worker_has_applied(self, worker, session_gtid):
+        stat = self.prober.get(worker)
+        return stat is not None and stat.available and stat.gtid_executed is not None \
+            and session_gtid.issubset(stat.gtid_executed)
+
+    def _worker_can_catch_up(self, worker, session_gtid):
+        """
+        Indique si attendre la session sur `worker` a un sens : un worker dont le dernier
+        gtid_executed sondé ne contient aucune transaction d'une source du jeton ne
+        réplique pas depuis elle (serveur autonome) et n'appliquera jamais la session.
+        """
+        stat = self.prober.get(worker)
+        if stat is None or stat.gtid_executed is None:
+            return True
+        return session_gtid.sources() <= stat.gtid_executed.sources()
+
+    def _select_consistent_worker(self, preferred, session_gtid):
+        """
+        Retourne (worker, GTID à attendre). Le worker choisi par la stratégie est conservé
+        s'il a déjà appliqué la session d'après la dernière sonde ; sinon un autre worker à
+        jour est préféré ; à défaut, la lecture attendra la position sur le premier worker
+        qui réplique depuis les sources du jeton, ou sera servie sans attente par le manager.
+        """
+        candidates = [preferred] + [worker for worker in self.worker_hosts if worker != preferred]
+        for worker in candidates:
+            if self._worker_has_applied(worker, session_gtid):
+                return worker, None
+        for worker in candidates:
+            if self._worker_can_catch_up(worker, session_gtid):
+                return worker, session_gtid
+        return self.manager_host, None
+
+    def stream_request(self, query, params=None, encode=None, pin_manager=False, deadline=None, strategy=None):
+        """
+        Exécute une lecture avec un curseur non bufferisé et retourne un générateur
+        de lignes NDJSON : un en-tête (colonnes, hôte), une ligne JSON par enregistrement
+        lue par lots de STREAM_BATCH_SIZE, puis un bilan (`row_count` ou erreur).
+        Retourne un dictionnaire d'erreur si la requête échoue avant le premier octet.
+        Avec `pin_manager`, la lecture est servie par le manager (cohérence de session).
+        """
+        strategy = strategy or self.current_strategy
+        target_host, target_port = self._select_target(pin_manager, strategy, query, params)
+        if not target_host:
+            return {"status": "error", "message": "No available workers or strategy not implemented"}
+
+        try:
+            limiter = self.admission.acquire(target_host, "read", deadline)
+        except Overloaded as e:
+            return self._overloaded_response(target_host, target_port, e)
+        pool = self.pools.get(target_host, target_port)
+        self.in_flight.begin(target_host)
+        try:
+            with tracing.span("connect", target_host):
+                conn = pool.acquire(deadline)
+        except mysql.connector.Error as e:
+            limiter.release()
+            self.in_flight.end(target_host)
+            logger.error(f"Query failed on {target_host}:{target_port}: {e}")
+            return {"status": "error", "message": f"Query failed on {target_host}:{target_port}: {e}"}
+        start = time.perf_counter()
+        if changes_session(query):
+            conn.session_dirty = True
         try:
-            conn = self._get_connection(host, port)
             cursor = conn.cursor()
-            cursor.execute(query, params or ())
+            with tracing.span("execute", target_host):
+                cursor.execute(query, tuple(params) if params else ())
+        except mysql.connector.Error as e:
+            self.digest.record(query, time.perf_counter() - start, 0, target_host, error=True)
+            pool.release(conn, discard=isinstance(e, (mysql.connector.errors.OperationalError,
+                                                      mysql.connector.errors.InterfaceError)))
+            limiter.release()
+            self.in_flight.end(target_host)
+            logger.error(f"Query failed on {target_host}:{target_port}: {e}")
+            return {"status": "error", "message": f"Query failed on {target_host}:{target_port}: {e}"}
+
+        header = {
+            "status": "success",
+            "columns": list(cursor.column_names),
+            "host": target_host,
+            "port": target_port,
+            "strategy": strategy
+        }
+
+        def generate():
+            discard = False
+            row_count = 0
+            try:
+                yield encode(header) + "\n"
+                if cursor.with_rows:
+                    while True:
+                        rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+                        if not rows:
+                            break
+                        row_count += len(rows)
+                        yield "".join(encode(row) + "\n" for row in rows)
+                yield encode({"status": "success", "row_count": row_count}) + "\n"
+            except mysql.connector.Error as e:
+                discard = True
+                logger.error(f"Streaming failed on {target_host}:{target_port}: {e}")
+                yield encode({"status": "error", "message": f"Query failed on {target_host}:{target_port}: {e}"}) + "\n"
+            finally:
+                # Un flux interrompu laisse des lignes non lues : la connexion est alors fermée
+                try:
+                    cursor.close()
+                except mysql.connector.Error:
+                    discard = True
+                pool.release(conn, discard=discard)
+                limiter.release()
+                self.in_flight.end(target_host)
+                self.digest.record(query, time.perf_counter() - start, row_count, target_host, error=discard)
+
+        return generate()
+
+    def _select_target(self, is_write, strategy, query=None, params=None):
+        """
+        Choisit l'hôte et le port cible selon la stratégie de la requête.
+        """
+        port = STRATEGY_PORTS[strategy]
+        if is_write or strategy == Strategy.DIRECT.value:
+            return self.manager_host, port
+        workers = self.worker_hosts
+        if not workers:
+            # Tous les workers sont retirés : le manager sert les lectures
+            return self.manager_host, port
+        if strategy == Strategy.RANDOM.value:
+            return random.choice(workers), port
+        if strategy == Strategy.CUSTOMIZED.value:
+            return self._get_fastest_worker(), port
+        if strategy == Strategy.LEAST_OUTSTANDING.value:
+            return self._get_least_loaded_worker(workers), port
+        if strategy == Strategy.POWER_OF_TWO.value:
+            candidates = random.sample(workers, min(2, len(workers)))
+            return self._get_least_loaded_worker(candidates), port
+        if strategy == Strategy.SHARDED.value:
+            worker = self._get_shard_worker(query, params, workers)
+            if worker is not None:
+                return worker, port
+            return self._select_target(is_write, SHARD_FALLBACK_STRATEGY)
+        return None, None
+
+    def _get_shard_worker(self, query, params, workers):
+        """
+        Retourne le worker propriétaire de la clé de routage de la requête (clé primaire
+        dans le WHERE), pour que chaque worker garde en cache un sous-ensemble distinct
+        des données. Les clés entières sont regroupées par plages de SHARD_KEY_RANGE.
+        """
+        key = extract_routing_key(query, params, SHARD_KEY_COLUMNS) if query else None
+        if key is None:
+            SHARD_ROUTING.inc("fallback")
+            return None
+        table, _, value = key
+        if SHARD_KEY_RANGE > 1 and value.lstrip("-").isdigit():
+            value = str(int(value) // SHARD_KEY_RANGE)
+        worker = self.shard_ring.lookup(f"{table}:{value}", set(workers))
+        SHARD_ROUTING.inc("keyed" if worker is not None else "fallback")
+        return worker
+
+    def _get_least_loaded_worker(self, candidates):
+        """
+        Retourne le candidat ayant le moins de requêtes en cours rapporté à son poids.
+        Les égalités sont départagées au hasard pour ne pas toujours favoriser le premier worker.
+        """
+        if not candidates:
+            return None
+        best, best_score = [], None
+        for worker in candidates:
+            score = (self.in_flight.get(worker) + 1) / self.worker_weights.get(worker, 1.0)
+            if best_score is None or score < best_score:
+                best, best_score = [worker], score
+            elif score == best_score:
+                best.append(worker)
+        return random.choice(best)
+
+    def _get_fastest_worker(self):
+        """
+        Retourne le worker ayant la plus faible latence lissée selon la sonde de fond.
+        Avant la première mesure, un worker est choisi au hasard.
+        """
+        fastest = self.prober.fastest
+        workers = self.worker_hosts
+        if fastest is not None and fastest in workers:
+            return fastest
+        if fastest is not None:
+            # Le plus rapide est retiré du routage : meilleur worker encore en service
+            candidates = [
+                (stat.ewma, worker) for worker, stat in ((w, self.prober.get(w)) for w in workers)
+                if stat is not None and stat.available
+            ]
+            if candidates:
+                return min(candidates)[1]
+        if not self.prober.ready:
+            return random.choice(workers) if workers else None
+        logger.error("All workers are unreachable.")
+        return None
+
+    def _execute_query(self, host, port, query, params, is_write, capture_gtid=False, wait_gtid=None, deadline=None,
+                       cancel=None):
+        """
+        Exécute une requête sur un backend. Avec `wait_gtid`, attend d'abord (au plus
+        RYW_MAX_WAIT secondes) que le backend ait appliqué ces GTID et retourne None s'il
+        ne les a pas appliqués. Avec `capture_gtid`, la réponse inclut la position GTID
+        du backend après l'exécution, dans `session_token`. Si le backend est saturé,
+        la réponse porte `overloaded` au lieu d'attendre au-delà de `deadline`.
+        `cancel` (QueryCancelToken) permet d'interrompre la requête depuis un autre thread.
+        """
+        kind = "write" if is_write else "read"
+        try:
+            with self.admission.slot(host, kind, deadline):
+                start = time.perf_counter()
+                with self.in_flight.track(host), self.pools.get(host, port).connection(deadline) as conn:
+                    if wait_gtid is not None:
+                        with tracing.span("gtid_wait", host):
+                            applied = self._wait_for_gtid(conn, wait_gtid)
+                        if not applied:
+                            return None
+                    if cancel is not None and not cancel.attach(host, port, conn.connection_id):
+                        self._record_read_latency(host, time.perf_counter() - start)
+                        return self._cancelled_response(host, port)
+                    try:
+                        response = self._run_statement(conn, host, port, query, params)
+                    finally:
+                        if cancel is not None:
+                            cancel.detach()
+                    if capture_gtid:
+                        response["session_token"] = self._read_gtid_executed(conn)
+            duration = time.perf_counter() - start
+            BACKEND_DURATION.observe(duration, host, kind)
+            if not is_write:
+                self._record_read_latency(host, duration)
+            self._record_backend_result(host, True)
+            return response
+        except Overloaded as e:
+            return self._overloaded_response(host, port, e)
+        except mysql.connector.Error as e:
+            if cancel is not None and cancel.cancelled:
+                # Interrompue volontairement (lecture couverte) : ni erreur ni échec du backend.
+                # La durée écoulée minore sa latence réelle : l'ignorer ferait baisser le seuil
+                # de couverture, les lectures lentes n'étant alors jamais mesurées
+                self._record_read_latency(host, time.perf_counter() - start)
+                return self._cancelled_response(host, port)
+            BACKEND_DURATION.observe(time.perf_counter() - start, host, kind)
+            logger.error(f"Query failed on {host}:{port}: {e}")
+            response = {"status": "error", "message": f"Query failed on {host}:{port}: {e}"}
+            if self._is_backend_failure(e):
+                BACKEND_ERRORS.inc(host, kind, "backend")
+                self._record_backend_result(host, False)
+                response["backend_failure"] = True
+            else:
+                BACKEND_ERRORS.inc(host, kind, "query")
+            return response
+
+    def _record_read_latency(self, host, duration):
+        stats = self.read_latency.get(host)
+        if stats is None:
+            stats = self.read_latency.setdefault(host, WorkerLatencyStats())
+        stats.record_success(duration)
+
+    def _overloaded_response(self, host, port, error):
+        logger.warning(f"Shedding query for {host}:{port}: {error}")
+        return {
+            "status": "error",
+            "message": f"Backend {host}:{port} overloaded: {error}",
+            "overloaded": True,
+            "retry_after": RETRY_AFTER
+        }
+
+    @staticmethod
+    def _cancelled_response(host, port):
+        return {"status": "error", "message": f"Query on {host}:{port} cancelled", "cancelled": True}
+
+    @staticmethod
+    def _is_backend_failure(error):
+        """
+        Indique si l'erreur vient du backend lui-même (injoignable, connexion perdue)
+        plutôt que de la requête (erreur SQL) ou d'un pool saturé.
+        """
+        if isinstance(error, (mysql.connector.errors.InterfaceError, mysql.connector.errors.OperationalError)):
+            return True
+        # CR_CONN_HOST_ERROR, CR_SERVER_GONE_ERROR, CR_SERVER_LOST, CR_SERVER_LOST_EXTENDED
+        return getattr(error, "errno", None) in (2003, 2006, 2013, 2055)
+
+    @staticmethod
+    def _wait_for_gtid(conn, gtid_set):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT WAIT_FOR_EXECUTED_GTID_SET(%s, %s)", (str(gtid_set), RYW_MAX_WAIT))
+            return cursor.fetchone()[0] == 0
+        finally:
+            cursor.close()
 
+    @staticmethod
+    def _read_gtid_executed(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT @@GLOBAL.gtid_executed")
+            return (cursor.fetchone()[0] or "").replace("\n", "")
+        finally:
+            cursor.close()
+
+    def _run_statement(self, conn, host, port, query, params):
+        """
+        Exécute une requête sur une connexion déjà empruntée et construit la réponse.
+        Le temps d'exécution est ajouté au digest des requêtes.
+        """
+        start = time.perf_counter()
+        try:
+            response = self._execute_statement(conn, host, port, query, params)
+        except mysql.connector.Error:
+            self.digest.record(query, time.perf_counter() - start, 0, host, error=True)
+            raise
+        rows = len(response["result"]) if "result" in response else max(response["rowcount"], 0)
+        self.digest.record(query, time.perf_counter() - start, rows, host)
+        return response
+
+    def _execute_statement(self, conn, host, port, query, params):
+        if changes_session(query):
+            # Marquée avant l'exécution : un échec partiel peut aussi laisser un état
+            conn.session_dirty = True
+        with tracing.span("execute", host):
+            if params:
+                cursor = conn.statement_cache.execute(query, tuple(params))
+            else:
+                cursor = conn.cursor()
+                cursor.execute(query)
+        try:
             if cursor.with_rows:
-                result = cursor.fetchall()
-                response = {
+                with tracing.span("fetch", host):
+                    result = cursor.fetchall()
+                return {
                     "status": "success",
                     "result": result,
+                    "columns": [[column[0], FieldType.get_info(column[1])] for column in cursor.description],
                     "host": host,
-                    "port": port,
-                    "strategy": self.current_strategy
+                    "port": port
                 }
+            return {
+                "status": "success",
+                "message": "Query executed successfully.",
+                "rowcount": cursor.rowcount,
+                "lastrowid": cursor.lastrowid,
+                "host": host,
+                "port": port
+            }
+        finally:
+            # Les curseurs préparés restent ouverts dans le cache de la connexion
+            if not params:
+                cursor.close()
+
+    def route_batch(self, statements, use_cache=True, deadline=None, strategy=None):
+        """
+        Exécute une liste ordonnée de (requête, paramètres). Chaque suite d'écritures
+        consécutives est exécutée dans une seule transaction sur une connexion du
+        manager ; chaque suite de lectures est répartie en parallèle selon la stratégie.
+        Les lectures qui suivent une écriture du lot sont servies par le manager (stratégie
+        DIRECT), les workers pouvant ne pas l'avoir encore appliquée.
+        Retourne un résultat par instruction, dans l'ordre.
+        """
+        strategy = strategy or self.current_strategy
+        read_strategy = strategy
+        results = []
+        for is_write, group in self._group_statements(statements):
+            if is_write:
+                transaction = self._execute_transaction(self.manager_host, STRATEGY_PORTS[strategy], group, deadline)
+                results.extend({**result, "strategy": strategy} for result in transaction)
+                read_strategy = Strategy.DIRECT.value
+            elif len(group) == 1:
+                query, params = group[0]
+                results.append(self.route_request(
+                    query, params=params, use_cache=use_cache, deadline=deadline, strategy=read_strategy
+                ))
             else:
-                conn.commit()
-                response = {
-                    "status": "success",
-                    "message": "Query executed successfully.",
-                    "host": host,
-                    "port": port,
-                    "strategy": self.current_strategy
-                }
+                futures = [
+                    BATCH_EXECUTOR.submit(
+                        tracing.bind(self.route_request), query, params=params, use_cache=use_cache,
+                        deadline=deadline, strategy=read_strategy
+                    )
+                    for query, params in group
+                ]
+                results.extend(future.result() for future in futures)
+        return results
 
-            cursor.close()
-            conn.close()
-            return response
+    @staticmethod
+    def _group_statements(statements):
+        groups = []
+        for query, params in statements:
+            is_write = classify(query) is not QueryType.READ
+            if groups and groups[-1][0] == is_write:
+                groups[-1][1].append((query, params))
+            else:
+                groups.append((is_write, [(query, params)]))
+        return groups
+
+    def _execute_transaction(self, host, port, statements, deadline=None):
+        """
+        Exécute des écritures dans une seule transaction. En cas d'échec, la transaction
+        est annulée et toutes les instructions du groupe sont signalées en erreur.
+        """
+        results = []
+        try:
+            with self.admission.slot(host, "write", deadline):
+                start = time.perf_counter()
+                with self.in_flight.track(host), self.pools.get(host, port).connection(deadline) as conn:
+                    conn.start_transaction()
+                    try:
+                        for query, params in statements:
+                            results.append(self._run_statement(conn, host, port, query, params))
+                        conn.commit()
+                    except mysql.connector.Error:
+                        conn.rollback()
+                        raise
+            BACKEND_DURATION.observe(time.perf_counter() - start, host, "write")
+        except Overloaded as e:
+            return [self._overloaded_response(host, port, e) for _ in statements]
         except mysql.connector.Error as e:
-            logger.error(f"Query failed on {host}:{port}: {e}")
-            return {"status": "error", "message": f"Query failed on {host}:{port}: {e}"}
+            BACKEND_DURATION.observe(time.perf_counter() - start, host, "write")
+            BACKEND_ERRORS.inc(host, "write", "backend" if self._is_backend_failure(e) else "query")
+            logger.error(f"Transaction failed on {host}:{port}: {e}")
+            results = [
+                {"status": "error", "message": f"Transaction failed on {host}:{port}: {e}"}
+                for _ in statements
+            ]
+
+        if self.result_cache.enabled:
+            tables = set()
+            for query, _ in statements:
+                statement_tables = extract_tables(query)
+                if not statement_tables:
+                    tables = None
+                    break
+                tables |= statement_tables
+            ddl = any(classify(query) is QueryType.DDL for query, _ in statements)
+            self._invalidate_cache(tables, ddl)
+        return results
+
+BATCH_EXECUTOR = ThreadPoolExecutor(max_workers=BATCH_READ_CONCURRENCY, thread_name_prefix="batch-read")
+HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=HEDGE_CONCURRENCY, thread_name_prefix="hedged-read")
 
-proxy = ProxyManager(MANAGER_IP, WORKERS, MYSQL_USER, MYSQL_PASSWORD)
+proxy = ProxyManager(MANAGER_IP, CLUSTER.workers, MYSQL_USER, MYSQL_PASSWORD, worker_weights=CLUSTER.weights)
+
+if QUERY_DIGEST_ENABLED and QUERY_DIGEST_DUMP_INTERVAL > 0:
+    proxy.digest.start_dumps(QUERY_DIGEST_DUMP_INTERVAL, "query_digest.log")
+
+if CLUSTER_CONFIG_POLL_INTERVAL > 0:
+    TOPOLOGY_WATCHER = ClusterConfigWatcher(CLUSTER_CONFIG_FILE, proxy.apply_topology, CLUSTER_CONFIG_POLL_INTERVAL)
+
+instrument_flask(app, METRICS, "proxy")
+METRICS.callback_gauge(
+    "proxy_log_records_dropped", "Log records dropped since start (sampling, rate limit, full queue)", ("reason",),
+    lambda: {(reason,): count for reason, count in LOG_STATS.snapshot().items()})
+tracing.instrument_flask(app, "proxy")
+METRICS.callback_gauge(
+    "proxy_backend_in_flight", "Queries currently running on each backend", ("host",),
+    lambda: {(host,): count for host, count in proxy.in_flight.snapshot().items()})
+METRICS.callback_gauge(
+    "proxy_pool_connections", "Pooled connections per backend and state", ("host", "state"),
+    lambda: {
+        key: value
+        for pool in proxy.pools.stats()
+        for key, value in (((pool["host"], "idle"), pool["idle"]), ((pool["host"], "in_use"), pool["in_use"]))
+    })
+METRICS.callback_gauge(
+    "proxy_worker_circuit_state", "Worker circuit breaker state (0 closed, 1 half-open, 2 open)", ("host",),
+    lambda: {
+        (worker,): {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}[breaker.state]
+        for worker, breaker in proxy.breakers.items()
+    })
+
+# ===========================
+# Formats de réponse
+# ===========================
+# Types MIME négociés sur /query (en-tête Accept ou champ "format" du corps)
+FORMAT_MIMETYPES = {
+    "json": "application/json",
+    "columnar": "application/vnd.sqlproxy.columnar+json",
+    "msgpack": "application/msgpack",
+}
+
+# Codes des types MessagePack « ext » utilisés pour conserver les types SQL
+MSGPACK_EXT_DECIMAL = 1
+MSGPACK_EXT_DATE = 2
+MSGPACK_EXT_TIME = 3
+
+
+def negotiate_format(data):
+    """
+    Retourne le format demandé : champ "format" du corps, sinon meilleur type de
+    l'en-tête Accept, sinon JSON (forme historique).
+    """
+    requested = data.get("format")
+    if requested:
+        return requested if requested in FORMAT_MIMETYPES else None
+    best = request.accept_mimetypes.best_match(list(FORMAT_MIMETYPES.values()), default=FORMAT_MIMETYPES["json"])
+    for name, mimetype in FORMAT_MIMETYPES.items():
+        if mimetype == best:
+            return name
+    return "json"
+
+
+def _columnar_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, set):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _msgpack_default(value):
+    if isinstance(value, Decimal):
+        return msgpack.ExtType(MSGPACK_EXT_DECIMAL, str(value).encode())
+    if isinstance(value, datetime.datetime):
+        # Timestamp MessagePack natif (ext -1) ; les dates naïves sont considérées en UTC
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=datetime.timezone.utc)
+        return msgpack.Timestamp.from_datetime(value)
+    if isinstance(value, datetime.date):
+        return msgpack.ExtType(MSGPACK_EXT_DATE, value.isoformat().encode())
+    if isinstance(value, (datetime.time, datetime.timedelta)):
+        return msgpack.ExtType(MSGPACK_EXT_TIME, str(value).encode())
+    if isinstance(value, set):
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not MessagePack serializable")
+
+
+def json_view(result):
+    """
+    Forme JSON historique d'un résultat : lignes sans métadonnées de colonnes.
+    """
+    if "columns" not in result:
+        return result
+    return {key: value for key, value in result.items() if key != "columns"}
+
+
+def render_result(result, fmt):
+    """
+    Sérialise le résultat d'une requête dans le format négocié. Les erreurs restent en JSON.
+    """
+    if fmt == "json" or result.get("status") != "success":
+        return jsonify(json_view(result))
+
+    body = {key: value for key, value in result.items() if key not in ("result", "columns")}
+    if fmt == "columnar":
+        rows = result.get("result")
+        if rows is not None:
+            columns = result.get("columns", [])
+            body["columns"] = [{"name": name, "type": type_name} for name, type_name in columns]
+            body["row_count"] = len(rows)
+            body["data"] = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+        payload = json.dumps(body, default=_columnar_default, separators=(",", ":"))
+        return Response(payload, mimetype=FORMAT_MIMETYPES["columnar"])
+
+    if "result" in result:
+        body["columns"] = [{"name": name, "type": type_name} for name, type_name in result.get("columns", [])]
+        body["result"] = result["result"]
+    payload = msgpack.packb(body, default=_msgpack_default, datetime=False, use_bin_type=True)
+    return Response(payload, mimetype=FORMAT_MIMETYPES["msgpack"])
+
+def requested_strategy(data):
+    """
+    Stratégie choisie par la requête (champ "strategy" ou en-tête X-Proxy-Strategy),
+    None pour la stratégie par défaut.
+    """
+    return (data.get("strategy") if data else None) or request.headers.get(STRATEGY_HEADER)
+
+def overloaded(result=None):
+    """
+    Réponse 503 avec l'en-tête Retry-After, pour une requête rejetée par le contrôle d'admission.
+    """
+    result = result or {"status": "error", "message": "Request deadline exceeded", "overloaded": True}
+    return jsonify(json_view(result)), 503, {"Retry-After": str(RETRY_AFTER)}
 
 # ===========================
 # Endpoints Flask
@@ -168,7 +2461,7 @@ proxy = ProxyManager(MANAGER_IP, WORKERS, MYSQL_USER, MYSQL_PASSWORD)
 @app.route('/set_strategy/<strategy>', methods=['GET'])
 def set_strategy(strategy):
     """
-    Définit la stratégie utilisée pour le routage des requêtes.
+    Définit la stratégie par défaut, utilisée par les requêtes qui n'en précisent pas.
     """
     if strategy not in STRATEGY_PORTS:
         logger.warning(f"Invalid strategy requested: {strategy}")
@@ -179,20 +2472,237 @@ def set_strategy(strategy):
     logger.info(f"Strategy set to: {strategy}")
     return jsonify({"status": "success", "strategy": strategy, "port": proxy.current_port})
 
+@app.route('/pool_stats', methods=['GET'])
+def pool_stats():
+    """
+    Retourne les statistiques des pools de connexions par backend.
+    """
+    return jsonify({"status": "success", "pools": proxy.pools.stats()})
+
+@app.route('/worker_stats', methods=['GET'])
+def worker_stats():
+    """
+    Retourne les latences mesurées par la sonde de fond pour chaque worker.
+    """
+    return jsonify({
+        "status": "success",
+        "fastest": proxy.prober.fastest,
+        "workers": proxy.prober.stats(),
+        "in_flight": proxy.in_flight.snapshot(),
+        "routable": proxy.worker_hosts,
+        "breakers": {worker: breaker.snapshot() for worker, breaker in proxy.breakers.items()},
+        "weights": proxy.worker_weights,
+        "hedging": {
+            "default": HEDGE_READS,
+            "budget_tokens": round(proxy.hedge_budget.tokens, 2),
+            "thresholds_ms": {
+                worker: None if threshold is None else round(threshold * 1000, 3)
+                for worker, threshold in ((w, proxy._hedge_threshold(w)) for w in proxy.all_workers)
+            }
+        }
+    })
+
+@app.route('/topology', methods=['GET'])
+def topology():
+    """
+    Retourne la topologie courante : workers configurés, poids et workers routables.
+    """
+    return jsonify({
+        "status": "success",
+        "workers": proxy.all_workers,
+        "weights": proxy.worker_weights,
+        "routable": proxy.worker_hosts
+    })
+
+@app.route('/admin/reload_topology', methods=['POST'])
+def reload_topology():
+    """
+    Recharge la topologie depuis le corps JSON de la requête ({"workers": [...]})
+    ou, sans corps, depuis le fichier de configuration du cluster.
+    """
+    data = request.get_json(silent=True)
+    try:
+        if data:
+            config = parse_cluster_config(data)
+        else:
+            config = load_cluster_config(default_weights=WORKER_WEIGHTS)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Rejected topology reload: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    return jsonify({"status": "success", **proxy.apply_topology(config)})
+
+@app.route('/admission_stats', methods=['GET'])
+def admission_stats():
+    """
+    Retourne l'état des limiteurs de concurrence par backend et par classe.
+    """
+    return jsonify({"status": "success", "limiters": proxy.admission.stats()})
+
+@app.route('/query_digest', methods=['GET'])
+def query_digest():
+    """
+    Retourne les formes de requêtes les plus coûteuses (paramètres `limit` et `order` :
+    total_time, count, max_time, p95, rows ou errors).
+    """
+    order = request.args.get("order", "total_time")
+    if order not in QueryDigest.ORDERS:
+        return jsonify({"status": "error", "message": f"Invalid order: {order}"}), 400
+    limit = request.args.get("limit", QUERY_DIGEST_TOP, type=int)
+    return jsonify({"status": "success", "enabled": proxy.digest.enabled, **proxy.digest.top(limit, order)})
+
+@app.route('/query_digest', methods=['DELETE'])
+def reset_query_digest():
+    """
+    Remet le digest des requêtes à zéro.
+    """
+    proxy.digest.reset()
+    return jsonify({"status": "success"})
+
+@app.route('/classifier_stats', methods=['GET'])
+def classifier_stats():
+    """
+    Retourne les statistiques du cache de classification lecture/écriture.
+    """
+    return jsonify({"status": "success", "cache": classifier_cache_info()})
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """
+    Retourne les statistiques du cache de résultats (succès, échecs, évictions).
+    """
+    return jsonify({"status": "success", "cache": proxy.result_cache.stats()})
+
+@app.route('/coalescer_stats', methods=['GET'])
+def coalescer_stats():
+    """
+    Retourne les statistiques du regroupement des écritures.
+    """
+    if proxy.coalescer is None:
+        return jsonify({"status": "success", "enabled": False})
+    return jsonify({"status": "success", "enabled": True, **proxy.coalescer.stats()})
+
 @app.route('/query', methods=['POST'])
 def query():
     """
     Reçoit une requête SQL et la transmet selon la stratégie définie.
     """
+    start = time.perf_counter()
+    deadline = request_deadline(request.headers, REQUEST_TIMEOUT)
+    if remaining(deadline) <= 0:
+        return overloaded()
     data = request.json
     query = data.get("query")
     if not query:
         logger.warning("Query not provided in request.")
         return jsonify({"status": "error", "message": "Query not provided"}), 400
 
-    is_write = any(word in query.upper() for word in ["INSERT", "UPDATE", "DELETE"])
-    result = proxy.route_request(query, is_write=is_write)
-    return jsonify(result)
+    params = data.get("params")
+    if params is not None and not isinstance(params, list):
+        logger.warning("Invalid params provided in request.")
+        return jsonify({"status": "error", "message": "Params must be an array"}), 400
+
+    strategy = requested_strategy(data) or proxy.current_strategy
+    if not isinstance(strategy, str) or strategy not in STRATEGY_PORTS:
+        logger.warning(f"Invalid strategy requested: {strategy}")
+        return jsonify({"status": "error", "message": f"Invalid strategy: {strategy}"}), 400
+
+    fmt = negotiate_format(data)
+    if fmt is None or (fmt == "msgpack" and msgpack is None):
+        logger.warning(f"Unsupported response format requested: {data.get('format')}")
+        return jsonify({"status": "error", "message": "Unsupported response format"}), 406
+
+    # Seules les lectures pures peuvent quitter le manager (écritures, DDL et transactions y restent)
+    is_write = classify(query) is not QueryType.READ
+
+    # Jeton de session (read-your-writes) : "" pour ouvrir une session, puis la valeur renvoyée
+    session_token = data.get("session_token")
+    if session_token is not None and not isinstance(session_token, str):
+        return jsonify({"status": "error", "message": "session_token must be a string"}), 400
+
+    hedge = data.get("hedge")
+    if hedge is not None and not isinstance(hedge, bool):
+        return jsonify({"status": "error", "message": "hedge must be a boolean"}), 400
+
+    if data.get("stream") and not is_write:
+        stream = proxy.stream_request(
+            query, params=params, encode=app.json.dumps, pin_manager=bool(session_token), deadline=deadline,
+            strategy=strategy
+        )
+        if isinstance(stream, dict):
+            return overloaded(stream) if stream.get("overloaded") else jsonify(stream)
+        return Response(stream_with_context(stream), mimetype="application/x-ndjson")
+
+    result = proxy.route_request(
+        query,
+        params=params,
+        is_write=is_write,
+        use_cache=not data.get("bypass_cache", False),
+        session_token=session_token,
+        deadline=deadline,
+        strategy=strategy,
+        hedge=hedge
+    )
+    kind = "write" if is_write else "read"
+    target = "cache" if result.get("cached") else result.get("host", "none")
+    QUERY_DURATION.observe(time.perf_counter() - start, strategy, kind, target)
+    QUERIES_TOTAL.inc(strategy, kind, target, result.get("status", "error"))
+    if result.get("overloaded"):
+        return overloaded(result)
+    return render_result(result, fmt)
+
+@app.route('/query/batch', methods=['POST'])
+def query_batch():
+    """
+    Reçoit une liste ordonnée d'instructions SQL et retourne un résultat par instruction.
+    Chaque instruction est soit une chaîne, soit un objet {"query": ..., "params": [...]}.
+    """
+    deadline = request_deadline(request.headers, REQUEST_TIMEOUT)
+    if remaining(deadline) <= 0:
+        return overloaded()
+    data = request.json
+    entries = data.get("statements") if data else None
+    if not entries or not isinstance(entries, list):
+        logger.warning("Statements not provided in batch request.")
+        return jsonify({"status": "error", "message": "Statements not provided"}), 400
+    if len(entries) > BATCH_MAX_STATEMENTS:
+        logger.warning(f"Batch too large: {len(entries)} statements.")
+        return jsonify({"status": "error", "message": f"Batch exceeds {BATCH_MAX_STATEMENTS} statements"}), 400
+
+    strategy = requested_strategy(data) or proxy.current_strategy
+    if not isinstance(strategy, str) or strategy not in STRATEGY_PORTS:
+        logger.warning(f"Invalid strategy requested: {strategy}")
+        return jsonify({"status": "error", "message": f"Invalid strategy: {strategy}"}), 400
+
+    statements = []
+    for index, entry in enumerate(entries):
+        if isinstance(entry, str):
+            entry = {"query": entry}
+        query = entry.get("query") if isinstance(entry, dict) else None
+        params = entry.get("params") if isinstance(entry, dict) else None
+        if not query or (params is not None and not isinstance(params, list)):
+            return jsonify({"status": "error", "message": f"Invalid statement at index {index}"}), 400
+        # Les transactions explicites sont gérées par le proxy lui-même, et un DDL validerait
+        # implicitement la transaction des écritures qui le précèdent
+        query_type = classify(query)
+        if query_type is QueryType.TRANSACTION:
+            return jsonify({"status": "error", "message": f"Transaction control not allowed in batch (index {index})"}), 400
+        if query_type is QueryType.DDL:
+            return jsonify({"status": "error", "message": f"DDL not allowed in batch (index {index})"}), 400
+        statements.append((query, params))
+
+    results = [
+        json_view(result)
+        for result in proxy.route_batch(
+            statements, use_cache=not data.get("bypass_cache", False), deadline=deadline, strategy=strategy
+        )
+    ]
+    if all(result.get("overloaded") for result in results):
+        return overloaded({"status": "error", "message": "All statements shed by admission control", "overloaded": True})
+    failed = sum(1 for result in results if result.get("status") != "success")
+    status = "success" if not failed else ("error" if failed == len(results) else "partial")
+    return jsonify({"status": status, "results": results})
 
 if __name__ == "__main__":
+    # Serveur de développement, sans keep-alive : en déploiement, le service tourne sous gunicorn
     app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,428 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import datetime
+from decimal import Decimal
+from enum import Enum
+from functools import partial
+
+import aiomysql
+from aiohttp import web
+from log_pipeline import configure_logging
+from cluster_config import load_cluster_config
+from sql_lexer import QueryType, classify
+
+# ===========================
+# Moteur asyncio du Proxy
+# ===========================
+# Alternative non bloquante à proxy_app.py : même surface HTTP (/query, /set_strategy)
+# et mêmes stratégies, mais un seul thread et une boucle d'événements, de sorte que
+# des milliers de requêtes peuvent être en vol sans un thread (et une pile) par requête.
+
+# Écriture en arrière-plan (fichier et console), échantillonnage et limitation de débit
+LOG_STATS = configure_logging("proxy.log")
+logger = logging.getLogger(__name__)
+
+# ===========================
+# Chargement des mots de passe et adresses IP
+# ===========================
+# Lus au démarrage du service (create_app) et non à l'import : le module peut être
+# importé sans les fichiers de déploiement, par exemple par les tests
+password_file_path = "PW.txt"
+manager_ip_file = "public_ip_manager.txt"
+
+
+def load_file_content(file_path):
+    with open(file_path, 'r') as f:
+        content = f.read().strip()
+        if not content:
+            raise ValueError(f"File {file_path} is empty.")
+        return content
+
+
+def load_credentials():
+    """
+    Retourne (mot de passe MySQL, adresse du manager) ; lève FileNotFoundError si un
+    fichier requis manque.
+    """
+    for file in (password_file_path, manager_ip_file):
+        if not os.path.exists(file):
+            logger.error(f"Error: {file} is missing.")
+            raise FileNotFoundError(f"Error: {file} is missing.")
+    return load_file_content(password_file_path), load_file_content(manager_ip_file)
+
+MYSQL_USER = os.getenv("MYSQL_USER", "admin")
+MYSQL_DB = os.getenv("MYSQL_DB", "sakila")
+
+# Pools et sonde de latence (mêmes variables que le moteur Flask)
+POOL_MAX_SIZE = int(os.getenv("POOL_MAX_SIZE", "20"))
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("POOL_ACQUIRE_TIMEOUT", "5"))
+POOL_MAX_IDLE_TIME = float(os.getenv("POOL_MAX_IDLE_TIME", "300"))
+PROBE_INTERVAL = float(os.getenv("PROBE_INTERVAL", "1"))
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", "2"))
+PROBE_EWMA_ALPHA = float(os.getenv("PROBE_EWMA_ALPHA", "0.3"))
+PROXY_PORT = int(os.getenv("PROXY_PORT", "5000"))
+
+# ===========================
+# Enumération des stratégies
+# ===========================
+class Strategy(Enum):
+    DIRECT = "direct"
+    RANDOM = "random"
+    CUSTOMIZED = "customized"
+    LEAST_OUTSTANDING = "least_outstanding"
+    POWER_OF_TWO = "power_of_two"
+
+STRATEGY_PORTS = {
+    Strategy.DIRECT.value: 3306,
+    Strategy.RANDOM.value: 3306,
+    Strategy.CUSTOMIZED.value: 3306,
+    Strategy.LEAST_OUTSTANDING.value: 3306,
+    Strategy.POWER_OF_TWO.value: 3306
+}
+
+# Stratégie choisie requête par requête (sinon la stratégie par défaut, /set_strategy)
+STRATEGY_HEADER = "X-Proxy-Strategy"
+
+def parse_weights(value):
+    """
+    Analyse une liste de poids de la forme "ip1=2,ip2=1". Les workers absents ont un poids de 1.
+    """
+    weights = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        host, _, weight = item.partition("=")
+        try:
+            weights[host.strip()] = max(float(weight), 0.01)
+        except ValueError:
+            raise ValueError(f"Invalid worker weight: {item}")
+    return weights
+
+WORKER_WEIGHTS = parse_weights(os.getenv("WORKER_WEIGHTS", ""))
+
+# ===========================
+# Sérialisation JSON
+# ===========================
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    if isinstance(value, set):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+json_dumps = partial(json.dumps, default=_json_default)
+
+# ===========================
+# Classe AsyncProxyManager
+# ===========================
+class AsyncProxyManager:
+    """
+    Équivalent asyncio de ProxyManager : routage selon la stratégie courante,
+    pools de connexions aiomysql par backend et sonde de latence en tâche de fond.
+    """
+    def __init__(self, manager_host, worker_hosts, mysql_user, mysql_password, worker_weights=None):
+        self.manager_host = manager_host
+        self.worker_hosts = worker_hosts
+        self.mysql_user = mysql_user
+        self.mysql_password = mysql_password
+        self.current_strategy = Strategy.DIRECT.value
+        self.current_port = STRATEGY_PORTS[Strategy.DIRECT.value]
+        self._pools = {}
+        self._pool_locks = {}
+        self.latencies = {}  # worker -> latence EWMA (secondes), None si injoignable
+        self.fastest = None
+        self.in_flight = {}  # hôte -> requêtes en cours (boucle unique : pas de verrou)
+        self.worker_weights = dict(worker_weights or {})
+        self._probe_task = None
+        # Connexion dédiée de la sonde par backend : elle n'emprunte pas au pool des requêtes
+        self._probe_connections = {}
+        logger.info(f"AsyncProxyManager initialized with strategy: {self.current_strategy}, port: {self.current_port}")
+
+    async def start(self):
+        self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def close(self):
+        if self._probe_task:
+            self._probe_task.cancel()
+        for key in list(self._probe_connections):
+            self._close_probe_connection(key)
+        for pool in self._pools.values():
+            pool.close()
+            await pool.wait_closed()
+
+    async def _get_pool(self, host, port):
+        key = (host, port)
+        pool = self._pools.get(key)
+        if pool is not None:
+            return pool
+        lock = self._pool_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = await aiomysql.create_pool(
+                    host=host,
+                    port=port,
+                    user=self.mysql_user,
+                    password=self.mysql_password,
+                    db=MYSQL_DB,
+                    minsize=0,
+                    maxsize=POOL_MAX_SIZE,
+                    pool_recycle=POOL_MAX_IDLE_TIME,
+                    connect_timeout=10,
+                    autocommit=True
+                )
+                self._pools[key] = pool
+        return pool
+
+    def pool_stats(self):
+        return [
+            {
+                "host": host,
+                "port": port,
+                "size": pool.size,
+                "idle": pool.freesize,
+                "in_use": pool.size - pool.freesize,
+                "max_size": pool.maxsize,
+            }
+            for (host, port), pool in self._pools.items()
+        ]
+
+    async def route_request(self, query, params=None, is_write=False, strategy=None):
+        """
+        Route une requête selon `strategy`, ou à défaut la stratégie par défaut du proxy.
+        """
+        strategy = strategy or self.current_strategy
+        target_host, target_port = self._select_target(is_write, strategy)
+        if not target_host:
+            return {"status": "error", "message": "No available workers or strategy not implemented"}
+        response = await self._execute_query(target_host, target_port, query, params)
+        response["strategy"] = strategy
+        return response
+
+    def _select_target(self, is_write, strategy):
+        if is_write or strategy == Strategy.DIRECT.value:
+            return self.manager_host, self.current_port
+        workers = self.worker_hosts
+        if not workers:
+            # Aucun worker configuré : le manager sert les lectures
+            return self.manager_host, self.current_port
+        if strategy == Strategy.RANDOM.value:
+            return random.choice(workers), self.current_port
+        if strategy == Strategy.CUSTOMIZED.value:
+            return self._get_fastest_worker(), self.current_port
+        if strategy == Strategy.LEAST_OUTSTANDING.value:
+            return self._get_least_loaded_worker(workers), self.current_port
+        if strategy == Strategy.POWER_OF_TWO.value:
+            candidates = random.sample(workers, min(2, len(workers)))
+            return self._get_least_loaded_worker(candidates), self.current_port
+        return None, None
+
+    def _get_least_loaded_worker(self, candidates):
+        if not candidates:
+            return None
+        scores = {
+            worker: (self.in_flight.get(worker, 0) + 1) / self.worker_weights.get(worker, 1.0)
+            for worker in candidates
+        }
+        best_score = min(scores.values())
+        return random.choice([worker for worker, score in scores.items() if score == best_score])
+
+    def _get_fastest_worker(self):
+        if self.fastest is not None:
+            return self.fastest
+        if not self.latencies:
+            return random.choice(self.worker_hosts) if self.worker_hosts else None
+        logger.error("All workers are unreachable.")
+        return None
+
+    async def _execute_query(self, host, port, query, params):
+        self.in_flight[host] = self.in_flight.get(host, 0) + 1
+        try:
+            return await self._run_query(host, port, query, params)
+        finally:
+            self.in_flight[host] -= 1
+
+    async def _run_query(self, host, port, query, params):
+        try:
+            pool = await self._get_pool(host, port)
+            conn = await asyncio.wait_for(pool.acquire(), POOL_ACQUIRE_TIMEOUT)
+            try:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(query, tuple(params) if params else None)
+                    if cursor.description:
+                        result = await cursor.fetchall()
+                        return {
+                            "status": "success",
+                            "result": result,
+                            "host": host,
+                            "port": port
+                        }
+                    return {
+                        "status": "success",
+                        "message": "Query executed successfully.",
+                        "rowcount": cursor.rowcount,
+                        "lastrowid": cursor.lastrowid,
+                        "host": host,
+                        "port": port
+                    }
+            except aiomysql.OperationalError:
+                # Connexion rompue : fermée pour que le pool ne la redistribue pas
+                conn.close()
+                raise
+            finally:
+                pool.release(conn)
+        except asyncio.TimeoutError:
+            logger.error(f"Query failed on {host}:{port}: connection pool exhausted")
+            return {"status": "error", "message": f"Query failed on {host}:{port}: connection pool exhausted"}
+        except (aiomysql.Error, OSError) as e:
+            logger.error(f"Query failed on {host}:{port}: {e}")
+            return {"status": "error", "message": f"Query failed on {host}:{port}: {e}"}
+
+    async def _probe_loop(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.gather(*(self._probe(worker) for worker in list(self.worker_hosts)))
+            available = [(latency, worker) for worker, latency in self.latencies.items() if latency is not None]
+            self.fastest = min(available)[1] if available else None
+            await asyncio.sleep(max(0.0, PROBE_INTERVAL - (time.monotonic() - started)))
+
+    async def _probe(self, worker):
+        key = (worker, self.current_port)
+        try:
+            conn = self._probe_connections.get(key)
+            if conn is None:
+                conn = await asyncio.wait_for(aiomysql.connect(
+                    host=worker,
+                    port=self.current_port,
+                    user=self.mysql_user,
+                    password=self.mysql_password,
+                    db=MYSQL_DB,
+                    connect_timeout=PROBE_TIMEOUT,
+                    autocommit=True
+                ), PROBE_TIMEOUT)
+                self._probe_connections[key] = conn
+            start = time.perf_counter()
+            await asyncio.wait_for(conn.ping(reconnect=False), PROBE_TIMEOUT)
+            latency = time.perf_counter() - start
+            previous = self.latencies.get(worker)
+            self.latencies[worker] = latency if previous is None else (
+                PROBE_EWMA_ALPHA * latency + (1 - PROBE_EWMA_ALPHA) * previous
+            )
+        except Exception as e:
+            self._close_probe_connection(key)
+            if self.latencies.get(worker) is not None:
+                logger.warning(f"Latency probe to {worker}:{self.current_port} failed: {e}")
+            self.latencies[worker] = None
+
+    def _close_probe_connection(self, key):
+        conn = self._probe_connections.pop(key, None)
+        if conn is not None:
+            conn.close()
+
+# ===========================
+# Endpoints HTTP
+# ===========================
+routes = web.RouteTableDef()
+
+
+def requested_strategy(data, headers):
+    """
+    Stratégie choisie par la requête (champ "strategy" ou en-tête X-Proxy-Strategy),
+    None pour la stratégie par défaut.
+    """
+    return data.get("strategy") or headers.get(STRATEGY_HEADER)
+
+
+@routes.get('/set_strategy/{strategy}')
+async def set_strategy(request):
+    """
+    Définit la stratégie utilisée pour le routage des requêtes.
+    """
+    proxy = request.app["proxy"]
+    strategy = request.match_info["strategy"]
+    if strategy not in STRATEGY_PORTS:
+        logger.warning(f"Invalid strategy requested: {strategy}")
+        return web.json_response({"status": "error", "message": f"Invalid strategy: {strategy}"}, status=400)
+
+    proxy.current_strategy = strategy
+    proxy.current_port = STRATEGY_PORTS[strategy]
+    logger.info(f"Strategy set to: {strategy}")
+    return web.json_response({"status": "success", "strategy": strategy, "port": proxy.current_port})
+
+
+@routes.get('/pool_stats')
+async def pool_stats(request):
+    """
+    Retourne les statistiques des pools de connexions par backend.
+    """
+    return web.json_response({"status": "success", "pools": request.app["proxy"].pool_stats()})
+
+
+@routes.post('/query')
+async def query(request):
+    """
+    Reçoit une requête SQL et la transmet selon la stratégie demandée (champ "strategy"
+    ou en-tête X-Proxy-Strategy), ou à défaut la stratégie par défaut.
+    """
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    query = data.get("query") if isinstance(data, dict) else None
+    if not query:
+        logger.warning("Query not provided in request.")
+        return web.json_response({"status": "error", "message": "Query not provided"}, status=400)
+
+    params = data.get("params")
+    if params is not None and not isinstance(params, list):
+        logger.warning("Invalid params provided in request.")
+        return web.json_response({"status": "error", "message": "Params must be an array"}, status=400)
+
+    proxy = request.app["proxy"]
+    strategy = requested_strategy(data, request.headers) or proxy.current_strategy
+    if not isinstance(strategy, str) or strategy not in STRATEGY_PORTS:
+        logger.warning(f"Invalid strategy requested: {strategy}")
+        return web.json_response({"status": "error", "message": f"Invalid strategy: {strategy}"}, status=400)
+
+    is_write = classify(query) is not QueryType.READ
+    result = await proxy.route_request(query, params=params, is_write=is_write, strategy=strategy)
+    return web.json_response(result, dumps=json_dumps)
+
+
+async def _on_startup(app):
+    await app["proxy"].start()
+
+
+async def _on_cleanup(app):
+    await app["proxy"].close()
+
+
+def create_app(proxy=None):
+    """
+    Construit l'application aiohttp ; un AsyncProxyManager peut être injecté
+    (par exemple pointant vers un serveur MySQL local de substitution).
+    """
+    if proxy is None:
+        mysql_password, manager_ip = load_credentials()
+        # Topologie lue au démarrage : cluster.json, ou à défaut les fichiers public_ip_worker*.txt
+        cluster = load_cluster_config(default_weights=WORKER_WEIGHTS)
+        proxy = AsyncProxyManager(manager_ip, cluster.workers, MYSQL_USER, mysql_password,
+                                  worker_weights=cluster.weights)
+    app = web.Application()
+    app["proxy"] = proxy
+    app.add_routes(routes)
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host="0.0.0.0", port=PROXY_PORT)
@@ -1,4 +1,6 @@
 import os
+import glob
+import json
 import paramiko
 import time
 
@@ -14,6 +16,15 @@ trust_host_ip_file = "public_ip_trust-host.txt"
 gatekeeper_ip_file = "public_ip_gatekeeper.txt"
 password_file_path = "PW.txt"
 
+# Moteur du Proxy : "flask" (proxy_app.py) ou "asyncio" (proxy_async_app.py)
+proxy_engine = os.getenv("PROXY_ENGINE", "flask")
+
+# Services Flask servis par gunicorn (un seul processus : l'état du service est en
+# mémoire) : threads de traitement et durée (secondes) pendant laquelle une connexion
+# keep-alive inactive reste ouverte pour le service en amont
+WSGI_THREADS = int(os.getenv("WSGI_THREADS", "32"))
+WSGI_KEEPALIVE = int(os.getenv("WSGI_KEEPALIVE", "75"))
+
 # Fichiers additionnels à transférer
 additional_files = [
     key_path,
@@ -23,7 +34,16 @@ additional_files = [
     worker2_ip_file,
     trust_host_ip_file,
     gatekeeper_ip_file,
-    password_file_path
+    password_file_path,
+    "sql_lexer.py",
+    "metrics.py",
+    "tracing.py",
+    "cluster_config.py",
+    "admission.py",
+    "log_pipeline.py",
+    "upstream.py",
+    "passthrough.py",
+    "cluster.json"
 ]
 
 # Vérification de l'existence des fichiers
@@ -35,6 +55,23 @@ def check_file_exists(file_path):
         raise RuntimeError(f"Erreur : Le fichier {file_path} est introuvable.")
     return True
 
+# Topologie initiale du Proxy : générée à partir des fichiers public_ip_worker*.txt
+# si cluster.json n'existe pas encore (il peut ensuite être édité puis rechargé à chaud)
+def write_cluster_config(path="cluster.json"):
+    """
+    Écrit cluster.json avec un poids de 1 pour chaque worker connu.
+    """
+    if os.path.exists(path):
+        return
+    workers = []
+    for worker_file in sorted(glob.glob("public_ip_worker*.txt")):
+        with open(worker_file, 'r') as file:
+            workers.append({"host": file.read().strip(), "weight": 1})
+    with open(path, 'w') as file:
+        json.dump({"workers": workers}, file, indent=2)
+
+write_cluster_config()
+
 # Validation des fichiers nécessaires
 for file in additional_files:
     check_file_exists(file)
@@ -127,9 +164,10 @@ WantedBy=multi-user.target
                 return False
         return True
 
-    def deploy_service(self, host, service_name, local_code_path, args, additional_files):
+    def deploy_service(self, host, service_name, local_code_path, args, additional_files, wsgi=False):
         """
-        Déploie un service sur une instance EC2 et transfère les fichiers requis.
+        Déploie un service sur une instance EC2 et transfère les fichiers requis. Avec
+        `wsgi`, l'application Flask `app` est servie par gunicorn (connexions keep-alive).
         """
         try:
             print(f"\nDéploiement de {service_name} sur {host}...")
@@ -144,7 +182,7 @@ WantedBy=multi-user.target
                 'sudo apt-get update -y',
                 'sudo apt-get install -y python3-venv',
                 'python3 -m venv /home/ubuntu/venv',
-                '/home/ubuntu/venv/bin/pip install flask requests mysql-connector-python'
+                '/home/ubuntu/venv/bin/pip install flask gunicorn requests mysql-connector-python aiohttp aiomysql msgpack'
             ]
             for cmd in setup_commands:
                 stdout, error = execute_with_retry(ssh, cmd)
@@ -167,9 +205,17 @@ WantedBy=multi-user.target
                     return False
 
             # Création d'un script de démarrage
+            if wsgi:
+                # Le serveur de développement de Flask ferme la connexion après chaque réponse
+                command = (
+                    f"gunicorn --chdir /home/ubuntu --workers 1 --worker-class gthread --threads {WSGI_THREADS} "
+                    f"--keep-alive {WSGI_KEEPALIVE} --bind 0.0.0.0:5000 {service_name}:app"
+                )
+            else:
+                command = f"python3 {remote_code_path} {' '.join(map(str, args))}"
             start_script = f'''#!/bin/bash
 source /home/ubuntu/venv/bin/activate
-python3 {remote_code_path} {' '.join(map(str, args))}
+{command}
 '''
             remote_start_script = f'/home/ubuntu/start_{service_name}.sh'
             with sftp.file(remote_start_script, 'w') as f:
@@ -207,18 +253,21 @@ def main():
     services = {
         "proxy": {
             "host": proxy_ip,
-            "local_code_path": "proxy_app.py",
-            "args": [manager_ip, f"{worker1_ip},{worker2_ip}"]
+            "local_code_path": "proxy_async_app.py" if proxy_engine == "asyncio" else "proxy_app.py",
+            "args": [manager_ip, f"{worker1_ip},{worker2_ip}"],
+            "wsgi": proxy_engine != "asyncio"
         },
         "trusted_host": {
             "host": trust_host_ip,
             "local_code_path": "trusted_host.py",
-            "args": [proxy_ip]
+            "args": [proxy_ip],
+            "wsgi": True
         },
         "gatekeeper": {
             "host": gatekeeper_ip,
             "local_code_path": "gatekeeper_app.py",
-            "args": [trust_host_ip]
+            "args": [trust_host_ip],
+            "wsgi": True
         }
     }
 
@@ -228,7 +277,8 @@ def main():
             service_name=service_name,
             local_code_path=config["local_code_path"],
             args=config["args"],
-            additional_files=additional_files
+            additional_files=additional_files,
+            wsgi=config["wsgi"]
         ):
             print(f"Échec du déploiement pour {service_name}.")
             return
@@ -77,6 +77,8 @@ class MySQLClusterManager:
                 f'sudo mysql -uroot -p"{mysql_password}" -e "ALTER USER \'root\'@\'localhost\' IDENTIFIED WITH mysql_native_password BY \'{mysql_password}\';"',
                 'sudo sed -i "s/^bind-address.*/bind-address = 0.0.0.0/" /etc/mysql/mysql.conf.d/mysqld.cnf',
                 'echo "max_connections = 500\nwait_timeout = 600\ninteractive_timeout = 600" | sudo tee -a /etc/mysql/mysql.conf.d/mysqld.cnf',
+                # GTID requis par la cohérence de session (read-your-writes) du Proxy
+                'echo "gtid_mode = ON\nenforce_gtid_consistency = ON" | sudo tee -a /etc/mysql/mysql.conf.d/mysqld.cnf',
                 'sudo systemctl restart mysql',
                 f'sudo mysql -uroot -p"{mysql_password}" -e "CREATE USER IF NOT EXISTS \'{mysql_user}\'@\'%\' IDENTIFIED BY \'{mysql_password}\';"',
                 f'sudo mysql -uroot -p"{mysql_password}" -e "GRANT ALL PRIVILEGES ON *.* TO \'{mysql_user}\'@\'%\' WITH GRANT OPTION;"',
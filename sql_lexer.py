@@ -0,0 +1,502 @@
+import os
+import re
+from collections import namedtuple
+from enum import Enum
+from functools import lru_cache
+
+# ===========================
+# Configuration
+# ===========================
+CLASSIFIER_CACHE_SIZE = int(os.getenv("CLASSIFIER_CACHE_SIZE", "4096"))
+
+# ===========================
+# Types de requêtes
+# ===========================
+class QueryType(Enum):
+    READ = "read"
+    WRITE = "write"
+    DDL = "ddl"
+    TRANSACTION = "transaction"
+
+READ_KEYWORDS = {"SELECT", "SHOW", "DESCRIBE", "DESC", "EXPLAIN", "HELP", "TABLE", "VALUES"}
+WRITE_KEYWORDS = {"INSERT", "UPDATE", "DELETE", "REPLACE", "LOAD", "CALL", "DO", "HANDLER", "IMPORT", "SET"}
+DDL_KEYWORDS = {
+    "CREATE", "ALTER", "DROP", "TRUNCATE", "RENAME", "GRANT", "REVOKE",
+    "ANALYZE", "OPTIMIZE", "REPAIR", "CHECK", "FLUSH", "INSTALL", "UNINSTALL",
+}
+TRANSACTION_KEYWORDS = {"BEGIN", "START", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "XA", "LOCK", "UNLOCK"}
+
+# Suites de mots-clés qui transforment une lecture en opération à exécuter sur le manager
+_LOCKING_READ_PAIRS = {("FOR", "UPDATE"), ("FOR", "SHARE"), ("LOCK", "IN"), ("INTO", "OUTFILE"), ("INTO", "DUMPFILE")}
+
+# Gravité croissante : une requête multi-instructions prend le type le plus « fort »
+_SEVERITY = {QueryType.READ: 0, QueryType.WRITE: 1, QueryType.TRANSACTION: 2, QueryType.DDL: 3}
+
+# ===========================
+# Lexer
+# ===========================
+Token = namedtuple("Token", ["kind", "value"])
+
+_TOKEN_PATTERNS = [
+    ("comment", r"/\*.*?(?:\*/|$)|--(?=\s|$)[^\n]*|#[^\n]*"),
+    ("ws", r"\s+"),
+    ("string", r"'(?:[^'\\]|\\.|'')*(?:'|$)|\"(?:[^\"\\]|\\.|\"\")*(?:\"|$)"),
+    ("quoted_ident", r"`(?:[^`]|``)*(?:`|$)"),
+    ("number", r"0x[0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?(?![\w$])"),
+    ("param", r"\?|%\(\w+\)s|%s"),
+    ("variable", r"@@?[\w.$]*"),
+    ("word", r"[A-Za-z_$\d][\w$]*"),
+    ("punct", r"[(),;.]"),
+    ("operator", r"(?:(?!%\(\w+\)s|%s)[^\s\w'\"`(),;.?])+"),
+]
+_TOKEN_RE = re.compile("|".join(f"(?P<{kind}>{pattern})" for kind, pattern in _TOKEN_PATTERNS), re.DOTALL)
+
+
+def tokenize(query):
+    """
+    Découpe une requête SQL en jetons en ignorant les espaces et les commentaires.
+    Les littéraux (chaînes, nombres) sont conservés comme jetons opaques, de sorte
+    que les mots qu'ils contiennent ne sont jamais pris pour des mots-clés.
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(query):
+        kind = match.lastgroup
+        if kind in ("ws", "comment"):
+            continue
+        value = match.group()
+        if kind == "word":
+            value = value.upper()
+        tokens.append(Token(kind, value))
+    return tokens
+
+
+def split_statements(tokens):
+    """
+    Sépare une liste de jetons en instructions selon les points-virgules.
+    """
+    statements, current = [], []
+    for token in tokens:
+        if token.kind == "punct" and token.value == ";":
+            if current:
+                statements.append(current)
+            current = []
+        else:
+            current.append(token)
+    if current:
+        statements.append(current)
+    return statements
+
+# ===========================
+# Empreinte normalisée
+# ===========================
+_FINGERPRINT_RE = re.compile(
+    r"(?P<comment>/\*.*?(?:\*/|$)|--(?=\s|$)[^\n]*|#[^\n]*)"
+    r"|(?P<literal>'(?:[^'\\]|\\.|'')*(?:'|$)|\"(?:[^\"\\]|\\.|\"\")*(?:\"|$)"
+    r"|(?<![\w$])(?:0x[0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)(?![\w$]))"
+    r"|(?P<quoted>`(?:[^`]|``)*(?:`|$))"
+    r"|(?P<ws>\s+)",
+    re.DOTALL,
+)
+_LIST_RE = re.compile(r"\((?:\s*\?\s*,)*\s*\?\s*\)")
+_VALUES_RE = re.compile(r"\b(values?)\s*\(\?\+\)(?:\s*,\s*\(\?\+\))*")
+
+
+def _fingerprint_token(match):
+    kind = match.lastgroup
+    if kind == "literal":
+        return "?"
+    if kind == "quoted":
+        return match.group()
+    return " "
+
+
+def fingerprint(query):
+    """
+    Retourne l'empreinte normalisée d'une requête : commentaires supprimés,
+    littéraux remplacés par `?`, espaces réduits, mots-clés en minuscules et
+    listes IN/VALUES réduites à `(?+)`. Deux requêtes de même forme ont la même empreinte.
+    """
+    normalized = _FINGERPRINT_RE.sub(_fingerprint_token, query).strip().lower()
+    normalized = normalized.replace("%s", "?")
+    normalized = _LIST_RE.sub("(?+)", normalized)
+    normalized = _VALUES_RE.sub(r"\1 (?+)", normalized)
+    return normalized.rstrip("; ")
+
+def _normalize_token(match):
+    kind = match.lastgroup
+    if kind in ("literal", "quoted"):
+        return match.group()
+    return " "
+
+
+def normalize(query):
+    """
+    Normalise une requête en conservant ses littéraux : commentaires supprimés et
+    espaces réduits. Sert de clé aux caches qui dépendent des valeurs de la requête.
+    """
+    return _FINGERPRINT_RE.sub(_normalize_token, query).strip().rstrip("; ")
+
+# ===========================
+# Commentaires exécutables
+# ===========================
+# MySQL exécute le contenu des commentaires /*! ... */ (éventuellement versionnés,
+# /*!80000 ... */) et interprète les indications d'optimiseur /*+ ... */ : l'empreinte,
+# qui supprime les commentaires, les ignorerait. Les commentaires ordinaires et les
+# littéraux sont parcourus dans le même passage, comme le fait le serveur : un /*!
+# à l'intérieur d'une chaîne ou d'un commentaire ordinaire n'est pas exécuté.
+_EXECUTABLE_COMMENT_RE = re.compile(
+    r"(?P<executable>/\*(?:M?!\d{0,6}|\+)(?P<body>.*?)(?:\*/|$))"
+    r"|(?P<keep>/\*.*?(?:\*/|$)|--(?=\s|$)[^\n]*|#[^\n]*"
+    r"|'(?:[^'\\]|\\.|'')*(?:'|$)|\"(?:[^\"\\]|\\.|\"\")*(?:\"|$)|`(?:[^`]|``)*(?:`|$))",
+    re.DOTALL,
+)
+
+
+def _expand_comment(match):
+    if match.group("keep") is not None:
+        return match.group()
+    return f" {match.group('body')} "
+
+
+def expand_executable_comments(query):
+    """
+    Remplace chaque commentaire exécutable (/*!...*/, /*M!...*/, /*+...*/) par son
+    contenu, pour analyser la requête telle que le serveur l'exécute.
+    """
+    if "/*" not in query:
+        return query
+    return _EXECUTABLE_COMMENT_RE.sub(_expand_comment, query)
+
+# ===========================
+# Extraction des tables
+# ===========================
+# Mots-clés suivis d'une ou plusieurs tables
+_TABLE_INTRODUCERS = {"FROM", "JOIN", "UPDATE", "INTO", "TABLE", "TRUNCATE"}
+_TABLE_STOP_WORDS = {
+    "WHERE", "SET", "VALUES", "VALUE", "SELECT", "ON", "USING", "GROUP", "ORDER", "LIMIT",
+    "HAVING", "UNION", "JOIN", "INNER", "LEFT", "RIGHT", "CROSS", "NATURAL", "STRAIGHT_JOIN",
+    "FOR", "LOCK", "WINDOW", "PARTITION", "IF", "EXISTS", "AS", "DUAL",
+}
+# Modificateurs placés entre le verbe et la table (UPDATE IGNORE t, DELETE QUICK FROM t)
+DML_MODIFIERS = {"LOW_PRIORITY", "DELAYED", "HIGH_PRIORITY", "IGNORE", "QUICK"}
+# Premiers mots d'une sous-requête entre parenthèses (sinon, référence de table parenthésée)
+_SUBQUERY_WORDS = {"SELECT", "WITH", "VALUES", "TABLE"}
+
+
+def _table_name(token):
+    name = token.value
+    if token.kind == "quoted_ident":
+        name = name[1:-1].replace("``", "`")
+    return name.lower()
+
+
+def extract_tables(query):
+    """
+    Retourne l'ensemble des tables référencées par une requête (FROM, JOIN, UPDATE,
+    INSERT INTO, ...). Les préfixes de schéma sont retirés et les noms mis en minuscules.
+    Un ensemble vide signifie que les tables n'ont pas pu être déterminées. Les
+    commentaires exécutables sont pris en compte.
+    """
+    tables = set()
+    _collect_tables(tokenize(expand_executable_comments(query)), tables)
+    return tables
+
+
+def _matching_paren(tokens, start):
+    depth = 0
+    for j in range(start, len(tokens)):
+        if tokens[j].kind == "punct":
+            if tokens[j].value == "(":
+                depth += 1
+            elif tokens[j].value == ")":
+                depth -= 1
+                if depth == 0:
+                    return j
+    return len(tokens)
+
+
+def _collect_tables(tokens, tables):
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        i += 1
+        if token.kind == "word" and token.value in _TABLE_INTRODUCERS:
+            i = _collect_table_list(tokens, i, tables)
+
+
+def _collect_table_list(tokens, i, tables):
+    """
+    Lit une liste de tables séparées par des virgules à partir de `tokens[i]` :
+    a, b AS x, schema.c, (SELECT ...) t, (d JOIN e ON ...). Retourne la position atteinte.
+    """
+    expect_table = True
+    while i < len(tokens):
+        token = tokens[i]
+        if token.kind == "word" and token.value in _TABLE_STOP_WORDS:
+            if token.value in ("IF", "EXISTS", "AS"):
+                i += 1
+                continue
+            break
+        if token.kind == "word" and expect_table and token.value in DML_MODIFIERS:
+            i += 1
+            continue
+        if token.kind == "punct" and token.value == "(":
+            if not expect_table:
+                break
+            end = _matching_paren(tokens, i)
+            inner = tokens[i + 1:end]
+            if not (inner and inner[0].kind == "word" and inner[0].value in _SUBQUERY_WORDS):
+                # Référence de table entre parenthèses : FROM (t), FROM (a JOIN b ON ...)
+                _collect_table_list(inner, 0, tables)
+            # Table dérivée ou jointure : on analyse le contenu puis on reprend après l'alias
+            _collect_tables(inner, tables)
+            i = end + 1
+            expect_table = False
+            continue
+        if token.kind == "punct" and token.value == ",":
+            expect_table = True
+            i += 1
+            continue
+        if token.kind == "punct" and token.value == ".":
+            # schema.table : la partie après le point remplace le schéma
+            if i + 1 < len(tokens) and tokens[i + 1].kind in ("word", "quoted_ident"):
+                tables.discard(_table_name(tokens[i - 1]))
+                tables.add(_table_name(tokens[i + 1]))
+                i += 2
+                continue
+            break
+        if token.kind in ("word", "quoted_ident"):
+            if expect_table:
+                tables.add(_table_name(token))
+                expect_table = False
+            i += 1
+            continue
+        break
+    return i
+
+# ===========================
+# INSERT mono-ligne (regroupement d'écritures)
+# ===========================
+_SINGLE_ROW_INSERT_RE = re.compile(
+    r"^\s*INSERT\s+INTO\s+((?:`[^`]+`|[\w$]+)(?:\.(?:`[^`]+`|[\w$]+))?)\s*"
+    r"\(([^()]*)\)\s*VALUES?\s*(\(.*\))\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+# Valeurs dont le résultat change si la ligne est insérée avec d'autres
+_UNCOALESCIBLE_WORDS = {"SELECT", "LAST_INSERT_ID"}
+
+
+def parse_single_row_insert(query):
+    """
+    Reconnaît un `INSERT INTO table (colonnes) VALUES (...)` d'une seule ligne, sans
+    IGNORE ni ON DUPLICATE KEY. Retourne (préfixe normalisé « INSERT INTO table (cols) »,
+    tuple de valeurs) ou None si la requête ne peut pas être fusionnée avec d'autres :
+    paramètres « ? » (la requête fusionnée est interpolée côté client, qui ne connaît
+    que « %s »), sous-requête ou LAST_INSERT_ID() (valeur dépendant des lignes précédentes).
+    """
+    match = _SINGLE_ROW_INSERT_RE.match(query)
+    if not match:
+        return None
+    table, columns, values = match.groups()
+    # Le tuple de valeurs doit être unique et équilibré : aucune autre ligne ni clause après lui
+    tokens = tokenize(values)
+    depth = 0
+    for index, token in enumerate(tokens):
+        if token.kind == "punct" and token.value == "(":
+            depth += 1
+        elif token.kind == "punct" and token.value == ")":
+            depth -= 1
+            if depth == 0 and index != len(tokens) - 1:
+                return None
+        elif token.kind == "punct" and token.value == ";":
+            return None
+        elif token.kind == "param" and token.value == "?":
+            return None
+        elif token.kind == "word" and token.value.upper() in _UNCOALESCIBLE_WORDS:
+            return None
+    if depth != 0:
+        return None
+    column_list = ", ".join(column.strip() for column in columns.split(","))
+    return f"INSERT INTO {table} ({column_list}) VALUES", values.strip()
+
+# ===========================
+# Clé de routage (stratégie SHARDED)
+# ===========================
+# Mots-clés qui terminent la clause WHERE
+_WHERE_END_WORDS = {"GROUP", "ORDER", "LIMIT", "HAVING", "UNION", "FOR", "WINDOW", "LOCK", "INTO"}
+
+
+def _literal_value(token):
+    if token.kind == "string":
+        quote = token.value[0]
+        return token.value[1:-1].replace(quote * 2, quote)
+    return token.value
+
+
+def extract_routing_key(query, params=None, key_columns=None):
+    """
+    Retourne (table, colonne, valeur) pour la première égalité `colonne = valeur` de
+    la clause WHERE principale qui porte sur la clé d'une table de la requête, ou None.
+    La clé d'une table est donnée par `key_columns` ({table: colonne}), et par
+    défaut `<table>_id`. La valeur peut être un littéral ou un paramètre positionnel.
+    """
+    statements = split_statements(tokenize(query))
+    if len(statements) != 1:
+        return None
+    tokens = statements[0]
+    tables = set()
+    _collect_tables(tokens, tables)
+    if not tables:
+        return None
+    key_columns = key_columns or {}
+    keys = {key_columns.get(table, f"{table}_id"): table for table in tables}
+
+    depth = 0
+    in_where = False
+    for index, token in enumerate(tokens):
+        if token.kind == "punct" and token.value in "()":
+            depth += 1 if token.value == "(" else -1
+            continue
+        if depth != 0 or token.kind != "word":
+            continue
+        if token.value == "WHERE":
+            in_where = True
+            continue
+        if not in_where:
+            continue
+        if token.value in _WHERE_END_WORDS:
+            break
+        column = token.value.lower()
+        if column not in keys or index + 2 >= len(tokens):
+            continue
+        operator, value = tokens[index + 1], tokens[index + 2]
+        # Colonne qualifiée (table.colonne ou alias.colonne) : le qualificatif est ignoré
+        if operator.kind != "operator" or operator.value != "=":
+            continue
+        if value.kind in ("number", "string"):
+            return keys[column], column, _literal_value(value)
+        if value.kind == "param" and value.value in ("%s", "?") and params:
+            position = sum(1 for previous in tokens[:index + 2] if previous.kind == "param")
+            if position < len(params):
+                return keys[column], column, str(params[position])
+        return None
+    return None
+
+# ===========================
+# Classification lecture / écriture
+# ===========================
+def main_verb(tokens):
+    """
+    Retourne le verbe principal d'une instruction (jetons de tokenize), en ignorant
+    les parenthèses ouvrantes et les CTE (WITH ... AS (...) DELETE ...) ; None sans verbe.
+    """
+    depth = 0
+    in_cte = False
+    for token in tokens:
+        if token.kind == "punct" and token.value == "(":
+            depth += 1
+            continue
+        if token.kind == "punct" and token.value == ")":
+            depth -= 1
+            continue
+        if token.kind != "word":
+            continue
+        if not in_cte and token.value == "WITH":
+            in_cte = True
+            continue
+        if in_cte:
+            if depth == 0 and token.value in READ_KEYWORDS | WRITE_KEYWORDS:
+                return token.value
+            continue
+        return token.value
+    return None
+
+
+def _classify_statement(tokens):
+    words = [token.value for token in tokens if token.kind == "word"]
+    verb = main_verb(tokens)
+    if verb is None:
+        return QueryType.WRITE
+
+    if verb in READ_KEYWORDS:
+        # Les lectures verrouillantes ou qui écrivent un fichier doivent aller sur le manager
+        for first, second in zip(words, words[1:]):
+            if (first, second) in _LOCKING_READ_PAIRS:
+                return QueryType.WRITE
+        return QueryType.READ
+    if verb == "SET" and "TRANSACTION" in words:
+        return QueryType.TRANSACTION
+    if verb == "SET" and "AUTOCOMMIT" in words:
+        return QueryType.TRANSACTION
+    if verb in TRANSACTION_KEYWORDS:
+        return QueryType.TRANSACTION
+    if verb in DDL_KEYWORDS:
+        return QueryType.DDL
+    # Instructions inconnues ou d'écriture : routées vers le manager par prudence
+    return QueryType.WRITE
+
+
+@lru_cache(maxsize=CLASSIFIER_CACHE_SIZE)
+def _classify_fingerprint(query_fingerprint):
+    statements = split_statements(tokenize(query_fingerprint))
+    if not statements:
+        return QueryType.WRITE
+    return max((_classify_statement(statement) for statement in statements), key=_SEVERITY.get)
+
+
+def classify(query):
+    """
+    Classe une requête en READ, WRITE, DDL ou TRANSACTION, telle que le serveur
+    l'exécute (commentaires exécutables compris). Le résultat est mis en cache (LRU)
+    par empreinte, de sorte qu'une forme de requête déjà vue n'est pas re-analysée.
+    """
+    return _classify_fingerprint(fingerprint(expand_executable_comments(query)))
+
+
+# ===========================
+# État de session
+# ===========================
+# Verbes sans effet durable sur la session qui les exécute (avec autocommit)
+_STATELESS_VERBS = {
+    "SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "SHOW", "DESCRIBE", "DESC", "EXPLAIN", "HELP",
+    "TABLE", "VALUES",
+}
+# Fonctions qui prennent un verrou nommé attaché à la session
+_SESSION_FUNCTIONS = {"GET_LOCK"}
+
+
+@lru_cache(maxsize=CLASSIFIER_CACHE_SIZE)
+def _fingerprint_changes_session(query_fingerprint):
+    for statement in split_statements(tokenize(query_fingerprint)):
+        if main_verb(statement) not in _STATELESS_VERBS:
+            return True
+        for token in statement:
+            if token.kind == "variable" and not token.value.startswith("@@"):
+                return True
+            if token.kind == "word" and token.value in _SESSION_FUNCTIONS:
+                return True
+    return False
+
+
+def changes_session(query):
+    """
+    Indique si une requête peut laisser un état sur la connexion qui l'exécute
+    (transaction, SET, USE, LOCK TABLES, variables utilisateur, tables temporaires,
+    verrous nommés...). Par prudence, tout verbe inconnu est considéré comme tel.
+    """
+    return _fingerprint_changes_session(fingerprint(expand_executable_comments(query)))
+
+
+def is_read(query):
+    """
+    Indique si la requête peut être servie par un worker.
+    """
+    return classify(query) is QueryType.READ
+
+
+def classifier_cache_info():
+    """
+    Retourne les statistiques du cache de classification.
+    """
+    info = _classify_fingerprint.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
@@ -0,0 +1,42 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def service_dir(tmp_path_factory):
+    """
+    Répertoire de travail contenant les fichiers lus à l'import des services
+    (adresses IP, mot de passe MySQL) ; les journaux y sont aussi écrits.
+    """
+    path = tmp_path_factory.mktemp("service")
+    for name in ("public_ip_trust-host.txt", "public_ip_proxy.txt", "public_ip_manager.txt",
+                 "public_ip_worker1.txt"):
+        (path / name).write_text("127.0.0.1")
+    (path / "PW.txt").write_text("password")
+    (path / "my-key-pair.pem").write_text("")
+    previous = os.getcwd()
+    os.chdir(path)
+    yield path
+    os.chdir(previous)
+
+
+@pytest.fixture(scope="session")
+def gatekeeper(service_dir):
+    os.environ["FIREWALL_POLL_INTERVAL"] = "0"
+    return importlib.import_module("gatekeeper_app")
+
+
+@pytest.fixture(scope="session")
+def proxy_async_app(service_dir):
+    return importlib.import_module("proxy_async_app")
+
+
+@pytest.fixture(scope="session")
+def proxy_app(service_dir):
+    return importlib.import_module("proxy_app")
@@ -0,0 +1,112 @@
+import asyncio
+import struct
+
+# ===========================
+# Serveur MySQL de substitution
+# ===========================
+# Implémente juste assez du protocole client/serveur MySQL pour les tests : poignée de
+# main (toute authentification est acceptée), COM_PING, COM_INIT_DB et COM_QUERY. Un
+# SELECT retourne une ligne d'une colonne contenant le texte de la requête ; toute autre
+# requête retourne un OK (une ligne modifiée, LAST_INSERT_ID() = LAST_INSERT_ID).
+
+LAST_INSERT_ID = 42
+
+_COM_QUIT, _COM_INIT_DB, _COM_QUERY, _COM_PING = 0x01, 0x02, 0x03, 0x0e
+_CAPABILITIES = 0x00000001 | 0x00000002 | 0x00000004 | 0x00000200 | 0x00008000 | 0x00080000
+_STATUS_AUTOCOMMIT = 0x0002
+
+
+def _packet(seq, payload):
+    return struct.pack("<I", len(payload))[:3] + bytes([seq & 0xff]) + payload
+
+
+def _lenenc_int(value):
+    if value < 251:
+        return bytes([value])
+    if value < 2 ** 16:
+        return b"\xfc" + struct.pack("<H", value)
+    return b"\xfd" + struct.pack("<I", value)[:3]
+
+
+def _lenenc_str(value):
+    return _lenenc_int(len(value)) + value
+
+
+def _ok(seq, affected=0, last_insert_id=0):
+    return _packet(seq, b"\x00" + _lenenc_int(affected) + _lenenc_int(last_insert_id)
+                   + struct.pack("<HH", _STATUS_AUTOCOMMIT, 0))
+
+
+def _eof(seq):
+    return _packet(seq, b"\xfe" + struct.pack("<HH", 0, _STATUS_AUTOCOMMIT))
+
+
+def _handshake():
+    salt = b"s" * 20
+    return (b"\x0a" + b"8.0.0-standin\x00" + struct.pack("<I", 1) + salt[:8] + b"\x00"
+            + struct.pack("<H", _CAPABILITIES & 0xffff) + b"\x21" + struct.pack("<H", _STATUS_AUTOCOMMIT)
+            + struct.pack("<H", _CAPABILITIES >> 16) + bytes([21]) + b"\x00" * 10 + salt[8:] + b"\x00"
+            + b"mysql_native_password\x00")
+
+
+def _result_set(text):
+    column = (_lenenc_str(b"def") + _lenenc_str(b"") + _lenenc_str(b"t") + _lenenc_str(b"t")
+              + _lenenc_str(b"q") + _lenenc_str(b"q") + b"\x0c" + struct.pack("<HIB", 0x21, 255, 0xfd)
+              + b"\x00\x00" + b"\x00" + b"\x00\x00")
+    return (_packet(1, b"\x01") + _packet(2, column) + _eof(3)
+            + _packet(4, _lenenc_str(text.encode())) + _eof(5))
+
+
+class MySQLStandIn:
+    """
+    Serveur MySQL de substitution sur 127.0.0.1 (port choisi par le système). Compte
+    les connexions ouvertes et les requêtes reçues.
+    """
+    def __init__(self):
+        self.connections = 0
+        self.queries = []
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self
+
+    @property
+    def port(self):
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _read_packet(self, reader):
+        header = await reader.readexactly(4)
+        length = header[0] | header[1] << 8 | header[2] << 16
+        return header[3], await reader.readexactly(length)
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        writer.write(_packet(0, _handshake()))
+        try:
+            seq, _ = await self._read_packet(reader)
+            writer.write(_ok(seq + 1))
+            while True:
+                await writer.drain()
+                _, payload = await self._read_packet(reader)
+                command = payload[0]
+                if command == _COM_QUIT:
+                    break
+                if command == _COM_QUERY:
+                    query = payload[1:].decode()
+                    self.queries.append(query)
+                    if query.lstrip().upper().startswith("SELECT"):
+                        writer.write(_result_set(query))
+                    else:
+                        writer.write(_ok(1, affected=1, last_insert_id=LAST_INSERT_ID))
+                else:
+                    # COM_PING, COM_INIT_DB et autres commandes sans résultat
+                    writer.write(_ok(1))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
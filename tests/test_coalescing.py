@@ -0,0 +1,35 @@
+import threading
+import time
+
+import pytest
+
+
+def test_batch_runs_under_the_tightest_caller_deadline(proxy_app):
+    seen = []
+
+    def execute_batch(prefix, rows, deadline):
+        seen.append(deadline)
+        return [{"status": "success"} for _ in rows]
+
+    coalescer = proxy_app.WriteCoalescer(execute_batch, window=0.2, max_batch=3)
+    now = time.monotonic()
+    deadlines = [now + 30, now + 5, None]
+    threads = [
+        threading.Thread(target=coalescer.submit, args=("INSERT INTO actor (first_name) VALUES", "(%s)", ["A"], d))
+        for d in deadlines
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+    assert seen == [now + 5]
+
+
+def test_pool_acquire_stops_at_deadline(proxy_app):
+    pool = proxy_app.ConnectionPool("127.0.0.1", 3306, lambda host, port: object(), max_size=1, acquire_timeout=5)
+    pool.acquire()
+    start = time.monotonic()
+    with pytest.raises(proxy_app.mysql.connector.errors.PoolError):
+        pool.acquire(deadline=start + 0.05)
+    assert time.monotonic() - start < 1
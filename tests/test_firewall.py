@@ -0,0 +1,82 @@
+import pytest
+
+from sql_lexer import expand_executable_comments
+
+
+RULES = {
+    "forbidden_statements": ["DROP"],
+    "forbidden_types": ["ddl"],
+    "deny_patterns": ["sleep *[(]"],
+}
+
+
+@pytest.fixture
+def policy(gatekeeper):
+    return gatekeeper.FirewallPolicy(RULES)
+
+
+def test_allows_plain_read(policy):
+    assert policy.check("SELECT * FROM actor WHERE actor_id = 1") is None
+
+
+@pytest.mark.parametrize("query", [
+    "/*!80000 DROP TABLE actor */",
+    "/*!DROP TABLE actor*/",
+    "/*M!100000 DROP TABLE actor */",
+    "/* note /*!*/ DROP TABLE actor",
+])
+def test_executable_comment_cannot_hide_statement(policy, query):
+    assert policy.check(query) is not None
+
+
+def test_executable_comment_cannot_hide_deny_pattern(policy):
+    assert policy.check("SELECT 1 /*!50000 , SLEEP(5) */") == ("deny_pattern", "sleep *[(]")
+
+
+def test_optimizer_hint_is_analysed(policy):
+    assert policy.check("SELECT /*+ SLEEP(1) */ 1") is not None
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT '/*!80000 DROP TABLE actor */'",
+    "SELECT 1 /* /*!80000 DROP TABLE actor */",
+    "SELECT 1 -- /*!80000 DROP TABLE actor */",
+])
+def test_non_executed_comment_is_ignored(policy, query):
+    assert policy.check(query) is None
+
+
+def test_expand_keeps_literals_and_plain_comments():
+    assert expand_executable_comments("SELECT 1") == "SELECT 1"
+    assert expand_executable_comments("SELECT '/*!x*/' /* c */") == "SELECT '/*!x*/' /* c */"
+    assert expand_executable_comments("SELECT 1 /*!50000 , 2 */").split() == ["SELECT", "1", ",", "2"]
+
+
+@pytest.fixture
+def table_policy(gatekeeper):
+    return gatekeeper.FirewallPolicy({
+        "forbidden_statements": ["DELETE"],
+        "tables": {"allow": ["actor", "film", "staff"], "deny": ["staff"], "read_only": ["film"]},
+    })
+
+
+@pytest.mark.parametrize("query, rejected", [
+    ("SELECT * FROM (staff)", ("table", "staff")),
+    ("SELECT * FROM ((staff)) s JOIN actor USING (actor_id)", ("table", "staff")),
+    ("SELECT @@version", ("table", "unknown")),
+    ("UPDATE IGNORE film SET title = 'x'", ("read_only_table", "film")),
+    ("UPDATE LOW_PRIORITY film SET title = 'x'", ("read_only_table", "film")),
+    ("WITH x AS (SELECT 1) DELETE FROM actor", ("forbidden_statement", "DELETE")),
+])
+def test_table_and_verb_rules_cannot_be_bypassed(table_policy, query, rejected):
+    assert table_policy.check(query) == rejected
+
+
+def test_table_rules_allow_known_tables(table_policy):
+    assert table_policy.check("SELECT * FROM (actor) a JOIN film f ON a.actor_id = f.film_id") is None
+
+
+def test_read_only_rules_allow_reads_without_tables(gatekeeper):
+    policy = gatekeeper.FirewallPolicy({"tables": {"read_only": ["film"]}})
+    assert policy.check("SELECT @@version") is None
+    assert policy.check("SET @v = 1") == ("table", "unknown")
@@ -0,0 +1,40 @@
+import time
+
+
+def make_proxy(proxy_app, monkeypatch, workers, applied):
+    """
+    ProxyManager sans worker configuré (aucune sonde) dont les lectures sont simulées :
+    `workers[0]` est lent, les autres répondent immédiatement.
+    """
+    proxy = proxy_app.ProxyManager("127.0.0.1", [], "admin", "password")
+    proxy.worker_hosts = list(workers)
+    reads = []
+
+    def execute_query(host, port, query, params, is_write, deadline=None, cancel=None):
+        reads.append(host)
+        if host == workers[0]:
+            time.sleep(0.2)
+        return {"status": "success", "result": [[host]]}
+
+    monkeypatch.setattr(proxy, "_execute_query", execute_query)
+    monkeypatch.setattr(proxy, "_hedge_threshold", lambda host: 0.01)
+    monkeypatch.setattr(proxy, "_worker_has_applied", lambda worker, session_gtid: worker in applied)
+    monkeypatch.setattr(proxy, "_get_least_loaded_worker", lambda candidates: candidates[0])
+    monkeypatch.setattr(proxy.hedge_budget, "try_acquire", lambda: True)
+    return proxy, reads
+
+
+def test_hedge_goes_to_a_worker_that_applied_the_session(proxy_app, monkeypatch):
+    proxy, reads = make_proxy(proxy_app, monkeypatch, ["w1", "w2", "w3"], applied={"w1", "w3"})
+    session_gtid = proxy_app.GtidSet("3e11fa47-71ca-11e1-9e33-c80aa9429562:1-5")
+    response = proxy._execute_hedged("w1", 3306, "SELECT 1", None, session_gtid=session_gtid)
+    assert response["result"] == [["w3"]] and response["hedged"]
+    assert "w2" not in reads
+
+
+def test_no_hedge_when_no_other_worker_applied_the_session(proxy_app, monkeypatch):
+    proxy, reads = make_proxy(proxy_app, monkeypatch, ["w1", "w2"], applied={"w1"})
+    session_gtid = proxy_app.GtidSet("3e11fa47-71ca-11e1-9e33-c80aa9429562:1-5")
+    response = proxy._execute_hedged("w1", 3306, "SELECT 1", None, session_gtid=session_gtid)
+    assert response["result"] == [["w1"]] and "hedged" not in response
+    assert reads == ["w1"]
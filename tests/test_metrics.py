@@ -0,0 +1,59 @@
+import threading
+
+from metrics import METRIC_STRIPES, Registry
+
+
+def run_in_threads(fn, count):
+    threads = [threading.Thread(target=fn) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_short_lived_threads_do_not_grow_shards():
+    registry = Registry()
+    counter = registry.counter("requests_total", "Requests", ("status",))
+    histogram = registry.histogram("latency_seconds", "Latency")
+
+    def request():
+        counter.inc("200")
+        histogram.observe(0.003)
+
+    run_in_threads(request, 300)
+
+    assert len(counter._shards) == METRIC_STRIPES
+    assert len(histogram._shards) == METRIC_STRIPES
+    text = registry.render()
+    assert 'requests_total{status="200"} 300' in text
+    assert "latency_seconds_count 300" in text
+    assert 'latency_seconds_bucket{le="0.005"} 300' in text
+
+
+def test_gauge_sums_increments_and_decrements():
+    registry = Registry()
+    gauge = registry.gauge("in_flight", "In flight")
+
+    def request():
+        with gauge.track():
+            pass
+        gauge.inc()
+
+    run_in_threads(request, 50)
+    assert "in_flight 50" in registry.render()
+
+
+def test_concurrent_threads_write_to_several_stripes():
+    registry = Registry()
+    counter = registry.counter("requests_total", "Requests")
+    barrier = threading.Barrier(8)
+
+    def request():
+        # Les threads restent vivants ensemble : leurs identifiants sont distincts
+        barrier.wait()
+        counter.inc()
+        barrier.wait()
+
+    run_in_threads(request, 8)
+    assert sum(1 for _, cells in counter._shards if cells) > 1
+    assert "requests_total 8" in registry.render()
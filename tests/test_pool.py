@@ -0,0 +1,54 @@
+
+
+class FakeConnection:
+    """
+    Connexion factice : état de transaction et de session pilotés par le test.
+    """
+    def __init__(self):
+        self.in_transaction = False
+        self.closed = False
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(proxy_app, reset_fn):
+    return proxy_app.ConnectionPool("127.0.0.1", 3306, lambda host, port: FakeConnection(), reset_fn=reset_fn)
+
+
+def test_connection_left_in_transaction_is_closed(proxy_app):
+    pool = make_pool(proxy_app, reset_fn=lambda conn: None)
+    with pool.connection() as conn:
+        conn.in_transaction = True
+    assert conn.closed
+    assert pool.stats()["idle"] == 0
+    with pool.connection() as other:
+        assert other is not conn
+
+
+def test_dirty_session_is_reset_before_reuse(proxy_app):
+    resets = []
+    pool = make_pool(proxy_app, reset_fn=resets.append)
+    with pool.connection() as conn:
+        conn.session_dirty = True
+    assert resets == [conn]
+    assert not conn.session_dirty
+    with pool.connection() as again:
+        assert again is conn
+    # Une session propre n'est pas remise à zéro
+    assert resets == [conn]
+    assert pool.stats()["session_resets"] == 1
+
+
+def test_failed_reset_closes_connection(proxy_app):
+    def reset(conn):
+        raise RuntimeError("reset failed")
+
+    pool = make_pool(proxy_app, reset_fn=reset)
+    with pool.connection() as conn:
+        conn.session_dirty = True
+    assert conn.closed
+    assert pool.stats()["idle"] == 0
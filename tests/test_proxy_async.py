@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from mysql_standin import LAST_INSERT_ID, MySQLStandIn
+
+
+def run(proxy_async_app, scenario):
+    """
+    Exécute `scenario(client, proxy, mysql)` contre le moteur asyncio branché sur un
+    serveur MySQL de substitution qui sert de manager et de worker.
+    """
+    async def main():
+        mysql = await MySQLStandIn().start()
+        proxy = proxy_async_app.AsyncProxyManager("127.0.0.1", ["127.0.0.1"], "admin", "password")
+        proxy.current_port = mysql.port
+        try:
+            async with TestClient(TestServer(proxy_async_app.create_app(proxy))) as client:
+                return await scenario(client, proxy, mysql)
+        finally:
+            await mysql.close()
+    return asyncio.run(main())
+
+
+def test_create_app_reads_credentials_at_startup(proxy_async_app, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(FileNotFoundError):
+        proxy_async_app.create_app()
+
+
+def test_read_and_write_reach_mysql(proxy_async_app):
+    async def scenario(client, proxy, mysql):
+        read = await (await client.post("/query", json={"query": "SELECT 1"})).json()
+        write = await (await client.post("/query", json={"query": "INSERT INTO actor (first_name) VALUES (%s)",
+                                                         "params": ["ADA"]})).json()
+        return read, write, mysql.queries
+
+    read, write, queries = run(proxy_async_app, scenario)
+    assert read["status"] == "success" and read["result"] == [["SELECT 1"]]
+    assert write["status"] == "success" and write["lastrowid"] == LAST_INSERT_ID
+    assert "INSERT INTO actor (first_name) VALUES ('ADA')" in queries
+
+
+def test_probe_uses_its_own_connection(proxy_async_app):
+    async def main():
+        mysql = await MySQLStandIn().start()
+        proxy = proxy_async_app.AsyncProxyManager("127.0.0.1", ["127.0.0.1"], "admin", "password")
+        proxy.current_port = mysql.port
+        try:
+            await proxy._probe("127.0.0.1")
+            await proxy._probe("127.0.0.1")
+            return proxy.latencies["127.0.0.1"], proxy.pool_stats(), mysql.connections
+        finally:
+            await proxy.close()
+            await mysql.close()
+
+    latency, pools, connections = asyncio.run(main())
+    assert latency is not None
+    # Les sondes réutilisent une connexion dédiée et n'ouvrent aucun pool de requêtes
+    assert connections == 1
+    assert pools == []
+
+
+def test_request_selects_strategy(proxy_async_app):
+    async def scenario(client, proxy, mysql):
+        by_body = await client.post("/query", json={"query": "SELECT 1", "strategy": "random"})
+        by_header = await client.post("/query", json={"query": "SELECT 1"},
+                                      headers={proxy_async_app.STRATEGY_HEADER: "power_of_two"})
+        default = await client.post("/query", json={"query": "SELECT 1"})
+        return [(await response.json())["strategy"] for response in (by_body, by_header, default)]
+
+    assert run(proxy_async_app, scenario) == ["random", "power_of_two", "direct"]
+
+
+@pytest.mark.parametrize("strategy", ["sharded", ["random"], {"name": "random"}])
+def test_invalid_strategy_is_rejected(proxy_async_app, strategy):
+    async def scenario(client, proxy, mysql):
+        response = await client.post("/query", json={"query": "SELECT 1", "strategy": strategy})
+        return response.status, mysql.queries
+
+    status, queries = run(proxy_async_app, scenario)
+    assert status == 400
+    assert queries == []
+
+
+@pytest.mark.parametrize("strategy", ["random", "customized", "least_outstanding", "power_of_two"])
+def test_reads_fall_back_to_manager_without_workers(proxy_async_app, strategy):
+    proxy = proxy_async_app.AsyncProxyManager("127.0.0.1", [], "admin", "password")
+    assert proxy._select_target(False, strategy) == ("127.0.0.1", proxy.current_port)
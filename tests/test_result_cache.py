@@ -0,0 +1,56 @@
+def filled_cache(proxy_app, cascading_tables):
+    cache = proxy_app.ResultCache(enabled=True)
+    cache.cascading_tables = cascading_tables
+    for query in ("SELECT * FROM actor", "SELECT * FROM film_text"):
+        key, tables = cache.make_key(query, None)
+        cache.put(key, tables, {"status": "success", "result": []}, cache.epoch())
+    return cache
+
+
+def cached_tables(cache):
+    return {table for _, tables, _, _ in cache._entries.values() for table in tables}
+
+
+def test_write_invalidates_only_its_tables(proxy_app):
+    cache = filled_cache(proxy_app, set())
+    cache.invalidate({"actor"})
+    assert cached_tables(cache) == {"film_text"}
+
+
+def test_dml_modifiers_are_not_tables(proxy_app):
+    for query in ("UPDATE IGNORE actor SET first_name = 'A'", "DELETE QUICK FROM actor WHERE actor_id = 1",
+                  "UPDATE LOW_PRIORITY actor SET first_name = 'A'"):
+        cache = filled_cache(proxy_app, set())
+        cache.invalidate(proxy_app.extract_tables(query))
+        assert cached_tables(cache) == {"film_text"}, query
+
+
+def test_write_on_cascading_table_clears_everything(proxy_app):
+    # Un trigger sur film met à jour film_text
+    cache = filled_cache(proxy_app, {"film"})
+    cache.invalidate({"film"})
+    assert cached_tables(cache) == set()
+
+
+def test_unknown_dependencies_clear_everything(proxy_app):
+    cache = filled_cache(proxy_app, None)
+    cache.invalidate({"actor"})
+    assert cached_tables(cache) == set()
+
+
+def test_dependencies_are_reloaded_after_ddl(proxy_app, monkeypatch):
+    proxy = proxy_app.ProxyManager("127.0.0.1", [], "admin", "password")
+    loads = []
+
+    def load():
+        loads.append(True)
+        return {"film"}
+
+    monkeypatch.setattr(proxy, "_load_cascading_tables", load)
+    proxy._invalidate_cache({"actor"})
+    proxy._invalidate_cache({"actor"})
+    assert len(loads) == 1 and proxy.result_cache.cascading_tables == {"film"}
+    proxy._invalidate_cache({"actor"}, ddl=True)
+    assert proxy.result_cache.cascading_tables is None
+    proxy._invalidate_cache({"actor"})
+    assert len(loads) == 2
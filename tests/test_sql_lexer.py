@@ -0,0 +1,78 @@
+import pytest
+
+from sql_lexer import QueryType, changes_session, classify, extract_tables, parse_single_row_insert
+
+
+def test_single_row_insert_is_coalescible():
+    assert parse_single_row_insert("INSERT INTO actor (first_name, last_name) VALUES (%s, %s)") == (
+        "INSERT INTO actor (first_name, last_name) VALUES", "(%s, %s)"
+    )
+
+
+@pytest.mark.parametrize("query", [
+    "INSERT INTO actor (first_name, last_name) VALUES (?, ?)",
+    "INSERT INTO actor (first_name) VALUES ((SELECT first_name FROM staff LIMIT 1))",
+    "INSERT INTO payment (rental_id) VALUES (LAST_INSERT_ID())",
+    "INSERT INTO actor (first_name) VALUES ('a'), ('b')",
+    "INSERT INTO actor (first_name) VALUES ('a') ON DUPLICATE KEY UPDATE first_name = 'b'",
+])
+def test_uncoalescible_insert(query):
+    assert parse_single_row_insert(query) is None
+
+
+def test_question_mark_in_literal_is_not_a_placeholder():
+    assert parse_single_row_insert("INSERT INTO actor (first_name) VALUES ('a?')") is not None
+
+
+@pytest.mark.parametrize("query", [
+    "BEGIN",
+    "SET autocommit = 0",
+    "SET SESSION sql_mode = ''",
+    "LOCK TABLES actor READ",
+    "USE mysql",
+    "SELECT @v := 1",
+    "SELECT first_name INTO @name FROM actor LIMIT 1",
+    "CREATE TEMPORARY TABLE t (id INT)",
+    "SELECT GET_LOCK('job', 10)",
+    "/*!40101 SET NAMES latin1 */",
+])
+def test_session_changing_statements(query):
+    assert changes_session(query)
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM actor",
+    "INSERT INTO actor (first_name) VALUES (%s)",
+    "SELECT @@version",
+    "WITH a AS (SELECT 1) SELECT * FROM a",
+])
+def test_stateless_statements(query):
+    assert not changes_session(query)
+
+
+@pytest.mark.parametrize("query, expected", [
+    # Mot-clé en préfixe d'un identifiant
+    ("SELECT last_update FROM actor", QueryType.READ),
+    ("SELECT update_count, delete_flag FROM film", QueryType.READ),
+    # Mots-clés dans des littéraux
+    ("SELECT * FROM film WHERE title = 'DROP TABLE actor'", QueryType.READ),
+    ("SELECT * FROM film WHERE description = 'FOR UPDATE'", QueryType.READ),
+    # CTE suivie d'une écriture
+    ("WITH a AS (SELECT actor_id FROM actor) DELETE FROM film_actor", QueryType.WRITE),
+    ("WITH a AS (SELECT 1) SELECT * FROM a", QueryType.READ),
+    # Lectures verrouillantes
+    ("SELECT * FROM film FOR UPDATE", QueryType.WRITE),
+    ("SELECT * FROM film LOCK IN SHARE MODE", QueryType.WRITE),
+    # Commentaires exécutables
+    ("SELECT * FROM film /*!80000 FOR UPDATE */", QueryType.WRITE),
+    ("/*!80000 DROP TABLE actor */", QueryType.DDL),
+    ("/*!COMMIT*/", QueryType.TRANSACTION),
+    ("SELECT * FROM film /* FOR UPDATE */", QueryType.READ),
+])
+def test_classify(query, expected):
+    assert classify(query) is expected
+
+
+def test_tables_in_executable_comments_are_extracted():
+    assert extract_tables("SELECT * FROM film /*!80000 JOIN staff */") == {"film", "staff"}
+    assert extract_tables("/*!80000 DELETE FROM actor */") == {"actor"}
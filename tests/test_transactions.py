@@ -0,0 +1,48 @@
+import pytest
+
+
+class FakeConnection:
+    in_transaction = False
+
+    def start_transaction(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakePools:
+    def __init__(self, proxy_app):
+        self.pool = proxy_app.ConnectionPool("127.0.0.1", 3306, lambda host, port: FakeConnection())
+
+    def get(self, host, port):
+        return self.pool
+
+
+@pytest.mark.parametrize("fails", [False, True])
+def test_transaction_is_tracked_and_timed(proxy_app, monkeypatch, fails):
+    proxy = proxy_app.ProxyManager("127.0.0.1", [], "admin", "password")
+    monkeypatch.setattr(proxy, "pools", FakePools(proxy_app))
+    in_flight = []
+
+    def run_statement(conn, host, port, query, params):
+        in_flight.append(proxy.in_flight.get(host))
+        if fails:
+            raise proxy_app.mysql.connector.errors.ProgrammingError("syntax error")
+        return {"status": "success"}
+
+    monkeypatch.setattr(proxy, "_run_statement", run_statement)
+    observed = []
+    monkeypatch.setattr(proxy_app.BACKEND_DURATION, "observe", lambda value, *labels: observed.append(labels))
+
+    results = proxy._execute_transaction("127.0.0.1", 3306, [("INSERT INTO actor VALUES (1)", None)])
+    assert results[0]["status"] == ("error" if fails else "success")
+    assert in_flight == [1]
+    assert proxy.in_flight.get("127.0.0.1") == 0
+    assert observed == [("127.0.0.1", "write")]
@@ -0,0 +1,222 @@
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# ===========================
+# Traçage des requêtes entre les services
+# ===========================
+# Chaque service (Gatekeeper, Trusted Host, Proxy) ajoute ses propres intervalles
+# (spans) à la trace de la requête et les publie dans l'en-tête Server-Timing, à la
+# suite de ceux du service en aval : la réponse finale porte le détail de chaque saut.
+
+REQUEST_ID_HEADER = "X-Request-ID"
+REQUEST_START_HEADER = "X-Request-Start"
+SAMPLED_HEADER = "X-Trace-Sampled"
+SERVER_TIMING_HEADER = "Server-Timing"
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+TRACE_LOG_MAX_PENDING = int(os.getenv("TRACE_LOG_MAX_PENDING", 10000))
+
+_current = threading.local()
+
+
+class Trace:
+    """
+    Intervalles mesurés par un service pour une requête, identifiée par son
+    X-Request-ID, et en-tête Server-Timing reçu du service en aval.
+    """
+    def __init__(self, service, request_id, sampled):
+        self.service = service
+        self.request_id = request_id
+        self.sampled = sampled
+        self.spans = []
+        self.upstream_timing = ""
+
+    def add(self, name, duration, description=None):
+        self.spans.append((f"{self.service}.{name}", duration * 1000, description))
+
+    def server_timing(self):
+        entries = []
+        for name, duration_ms, description in self.spans:
+            entry = f"{name};dur={duration_ms:.2f}"
+            if description:
+                entry += f';desc="{description}"'
+            entries.append(entry)
+        if self.upstream_timing:
+            entries.append(self.upstream_timing)
+        return ", ".join(entries)
+
+    def to_dict(self):
+        return {
+            "request_id": self.request_id,
+            "service": self.service,
+            "spans": [
+                {"name": name, "dur_ms": round(duration_ms, 3), "desc": description}
+                for name, duration_ms, description in self.spans
+            ],
+            "upstream": self.upstream_timing,
+        }
+
+
+def current():
+    """
+    Retourne la trace de la requête traitée par le thread courant, ou None.
+    """
+    return getattr(_current, "trace", None)
+
+
+@contextmanager
+def span(name, description=None):
+    """
+    Mesure la durée du bloc et l'ajoute à la trace courante (sans effet hors requête).
+    """
+    trace = current()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start, description)
+
+
+def bind(fn):
+    """
+    Rattache `fn` à la trace courante pour qu'elle puisse être exécutée dans un autre thread.
+    """
+    trace = current()
+
+    def wrapper(*args, **kwargs):
+        previous = current()
+        _current.trace = trace
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.trace = previous
+    return wrapper
+
+
+def outgoing_headers(headers=None):
+    """
+    Ajoute aux en-têtes d'un appel vers le service en aval l'identifiant de la
+    requête, la décision d'échantillonnage et l'heure d'envoi (temps d'attente en aval).
+    """
+    headers = dict(headers or {})
+    trace = current()
+    if trace is not None:
+        headers[REQUEST_ID_HEADER] = trace.request_id
+        headers[SAMPLED_HEADER] = "1" if trace.sampled else "0"
+    headers[REQUEST_START_HEADER] = f"t={int(time.time() * 1_000_000)}"
+    return headers
+
+
+def record_upstream(response):
+    """
+    Conserve l'en-tête Server-Timing de la réponse du service en aval.
+    """
+    trace = current()
+    if trace is not None:
+        trace.upstream_timing = response.headers.get(SERVER_TIMING_HEADER, "")
+
+
+def _queue_time(header_value):
+    """
+    Temps écoulé depuis l'envoi par le service en amont (réseau et file d'attente),
+    à partir de l'en-tête X-Request-Start (`t=<microsecondes>`).
+    """
+    if not header_value:
+        return None
+    try:
+        sent_at = int(header_value.strip().removeprefix("t=")) / 1_000_000
+    except ValueError:
+        return None
+    # Les horloges des machines ne sont pas parfaitement synchronisées
+    return max(0.0, time.time() - sent_at)
+
+
+class TraceLog:
+    """
+    Écrit les traces échantillonnées depuis un thread dédié : la requête ne fait que
+    déposer la trace dans une file bornée, et la trace est abandonnée si la file est pleine.
+    """
+    def __init__(self, logger, max_pending=TRACE_LOG_MAX_PENDING):
+        self._logger = logger
+        self._queue = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._run, name="trace-log", daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            try:
+                self._logger.info(json.dumps(record))
+            except Exception:
+                pass
+
+
+def instrument_flask(app, service, sample_rate=TRACE_SAMPLE_RATE):
+    """
+    Ouvre une trace pour chaque requête Flask, publie l'en-tête Server-Timing et
+    X-Request-ID dans la réponse, et journalise les traces échantillonnées dans
+    `<service>_trace.log`. Le premier service décide de l'échantillonnage, les
+    suivants respectent l'en-tête X-Trace-Sampled.
+    """
+    from flask import g, request
+
+    trace_logger = logging.getLogger(f"{service}.trace")
+    trace_logger.propagate = False
+    trace_logger.setLevel(logging.INFO)
+    if not trace_logger.handlers:
+        handler = logging.FileHandler(f"{service}_trace.log")
+        handler.setFormatter(logging.Formatter("%(asctime)s - %(message)s"))
+        trace_logger.addHandler(handler)
+    trace_log = TraceLog(trace_logger)
+
+    @app.before_request
+    def _trace_start():
+        request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+        sampled_header = request.headers.get(SAMPLED_HEADER)
+        if sampled_header is None:
+            sampled = random.random() < sample_rate
+        else:
+            sampled = sampled_header == "1"
+        trace = Trace(service, request_id, sampled)
+        queued = _queue_time(request.headers.get(REQUEST_START_HEADER))
+        if queued is not None:
+            trace.add("queue", queued)
+        g.trace_start = time.perf_counter()
+        _current.trace = trace
+
+    @app.after_request
+    def _trace_finish(response):
+        trace = current()
+        if trace is None:
+            return response
+        trace.add("total", time.perf_counter() - g.pop("trace_start"))
+        response.headers[REQUEST_ID_HEADER] = trace.request_id
+        response.headers[SERVER_TIMING_HEADER] = trace.server_timing()
+        if trace.sampled:
+            record = trace.to_dict()
+            record.update(endpoint=request.endpoint, status=response.status_code)
+            trace_log.submit(record)
+        return response
+
+    @app.teardown_request
+    def _trace_end(exc):
+        _current.trace = None
+
+    return trace_log
@@ -2,18 +2,18 @@ import os
 from flask import Flask, request, jsonify
 import requests
 import logging
+from log_pipeline import abbreviate, configure_logging
+from admission import RETRY_AFTER, budget_header, remaining, request_deadline
+from metrics import Registry, instrument_flask
+from passthrough import decode_body, relay
+from upstream import UpstreamClient, instrument_client
+import tracing
 
 # ===========================
 # Configuration et Logs
 # ===========================
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("trusted_host.log"),  # Log to a file
-        logging.StreamHandler()  # Log to console
-    ]
-)
+# Écriture en arrière-plan (fichier et console), échantillonnage et limitation de débit
+LOG_STATS = configure_logging("trusted_host.log")
 logger = logging.getLogger(__name__)
 
 # ===========================
@@ -56,6 +56,29 @@ PROXY_IP = read_ip(proxy_ip_file)
 # ===========================
 app = Flask(__name__)
 
+# Délais maximaux d'attente du Proxy (secondes), réduits par le budget reçu de l'amont
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+BATCH_UPSTREAM_TIMEOUT = float(os.getenv("BATCH_UPSTREAM_TIMEOUT", "30"))
+
+# Stratégie du Proxy choisie requête par requête (le champ "strategy" du corps est relayé tel quel)
+STRATEGY_HEADER = "X-Proxy-Strategy"
+
+# Métriques exposées sur /metrics
+METRICS = Registry()
+instrument_flask(app, METRICS, "trusted_host")
+METRICS.callback_gauge(
+    "trusted_host_log_records_dropped", "Log records dropped since start (sampling, rate limit, full queue)", ("reason",),
+    lambda: {(reason,): count for reason, count in LOG_STATS.snapshot().items()})
+tracing.instrument_flask(app, "trusted_host")
+UPSTREAM_DURATION = METRICS.histogram(
+    "trusted_host_upstream_duration_seconds", "Time waiting for the Proxy response", ("endpoint",))
+UPSTREAM_ERRORS = METRICS.counter(
+    "trusted_host_upstream_errors_total", "Failed calls to the Proxy", ("endpoint", "cause"))
+
+# Connexions persistantes (keep-alive) vers le Proxy, partagées par tous les threads
+UPSTREAM = UpstreamClient()
+instrument_client(UPSTREAM, METRICS, "trusted_host")
+
 @app.route('/health', methods=['GET'])
 def health():
     """
@@ -63,19 +86,44 @@ def health():
     """
     return jsonify({"status": "ok"})
 
+def strategy_header():
+    """
+    Relaie l'en-tête X-Proxy-Strategy (stratégie choisie pour cette requête seulement).
+    """
+    strategy = request.headers.get(STRATEGY_HEADER)
+    return {STRATEGY_HEADER: strategy} if strategy else {}
+
+def shed():
+    """
+    Réponse 503 immédiate pour une requête dont le budget est déjà épuisé.
+    """
+    return jsonify({"status": "error", "message": "Request deadline exceeded"}), 503, {"Retry-After": str(RETRY_AFTER)}
+
+def forward(response, what):
+    """
+    Relaie la réponse du Proxy (code, type, corps, Retry-After) sans la décoder.
+    """
+    if response.status_code == 200:
+        logger.info(f"{what} successfully forwarded to Proxy.")
+    else:
+        UPSTREAM_ERRORS.inc(request.endpoint, str(response.status_code))
+        # Corps d'erreur : court, lu pour le journal puis relayé tel quel
+        logger.error(f"Error from Proxy: {abbreviate(response.text)}")
+    return relay(response)
+
 @app.route('/set_strategy/<strategy>', methods=['GET'])
 def set_strategy(strategy):
     """
     Transmet la stratégie choisie au Proxy.
     """
-    valid_strategies = ["direct", "random", "customized"]
+    valid_strategies = ["direct", "random", "customized", "least_outstanding", "power_of_two", "sharded"]
     if strategy not in valid_strategies:
         logger.warning(f"Invalid strategy requested: {strategy}")
         return jsonify({"status": "error", "message": f"Invalid strategy: {strategy}"}), 400
 
     try:
         proxy_url = f'http://{PROXY_IP}:5000/set_strategy/{strategy}'
-        response = requests.get(proxy_url, timeout=5)
+        response = UPSTREAM.get(proxy_url, timeout=5)
         if response.status_code == 200:
             logger.info(f"Strategy set to {strategy} successfully on Proxy.")
             return jsonify({"status": "success", "strategy": strategy})
@@ -89,27 +137,88 @@ def set_strategy(strategy):
 @app.route('/query', methods=['POST'])
 def handle_request():
     """
-    Transmet les requêtes SQL au service Proxy.
+    Transmet les requêtes SQL au service Proxy. Le corps est transmis tel quel et la réponse
+    relayée sans être désérialisée.
     """
+    deadline = request_deadline(request.headers, UPSTREAM_TIMEOUT)
+    if remaining(deadline) <= 0:
+        return shed()
     try:
-        data = request.json
-        if not data or 'query' not in data:
+        body = request.get_data()
+        try:
+            fields = decode_body(body)
+        except ValueError as e:
+            logger.warning(f"Invalid request: malformed JSON body: {e}")
+            return jsonify({"status": "error", "message": "Invalid JSON body"}), 400
+        if not fields or 'query' not in fields:
             logger.warning("Invalid request: Missing 'query' field.")
             return jsonify({"status": "error", "message": "Query is missing"}), 400
 
-        logger.info(f"Received query: {data['query']}")
+        logger.info(f"Received query: {abbreviate(fields['query'])}")
 
-        # URL du Proxy
         proxy_url = f'http://{PROXY_IP}:5000/query'
-        response = requests.post(proxy_url, json=data, timeout=10)
+        # Le format de réponse est négocié par le Proxy : l'en-tête Accept est transmis tel quel
+        headers = tracing.outgoing_headers({
+            "Accept": request.headers.get("Accept", "application/json"),
+            "Content-Type": "application/json"
+        })
+        headers.update(budget_header(deadline))
+        headers.update(strategy_header())
+        # Réponses simples, colonnaires, binaires ou en flux NDJSON : toutes relayées par morceaux
+        with UPSTREAM_DURATION.time("query"), tracing.span("forward"):
+            response = UPSTREAM.post(proxy_url, data=body, headers=headers, timeout=remaining(deadline), stream=True)
+        tracing.record_upstream(response)
+        return forward(response, "Query")
+    except requests.Timeout as e:
+        UPSTREAM_ERRORS.inc(request.endpoint, type(e).__name__)
+        logger.error(f"Proxy did not answer within the request deadline: {e}")
+        return jsonify({"status": "error", "message": f"Upstream timeout: {e}"}), 504
+    except requests.RequestException as e:
+        UPSTREAM_ERRORS.inc(request.endpoint, type(e).__name__)
+        logger.error(f"Error communicating with Proxy: {e}")
+        return jsonify({"status": "error", "message": f"Unable to process request: {e}"}), 500
+    except Exception as e:
+        logger.error(f"Unexpected error: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
 
-        if response.status_code == 200:
-            logger.info("Query successfully forwarded to Proxy.")
-            return response.json()
-        else:
-            logger.error(f"Error from Proxy: {response.text}")
-            return jsonify({"status": "error", "message": response.text}), response.status_code
+@app.route('/query/batch', methods=['POST'])
+def handle_batch_request():
+    """
+    Transmet une liste ordonnée de requêtes SQL au Proxy. Le corps est transmis tel quel et
+    la réponse relayée sans être désérialisée.
+    """
+    deadline = request_deadline(request.headers, BATCH_UPSTREAM_TIMEOUT)
+    if remaining(deadline) <= 0:
+        return shed()
+    try:
+        body = request.get_data()
+        try:
+            fields = decode_body(body)
+        except ValueError as e:
+            logger.warning(f"Invalid batch request: malformed JSON body: {e}")
+            return jsonify({"status": "error", "message": "Invalid JSON body"}), 400
+        statements = fields.get('statements') if fields else None
+        if not statements or not isinstance(statements, list):
+            logger.warning("Invalid batch request: Missing 'statements' field.")
+            return jsonify({"status": "error", "message": "Statements are missing"}), 400
+
+        logger.info(f"Received batch of {len(statements)} statements")
+
+        # Un lot peut contenir beaucoup d'instructions : délai plus long qu'une requête simple
+        proxy_url = f'http://{PROXY_IP}:5000/query/batch'
+        headers = tracing.outgoing_headers({
+            "Content-Type": "application/json", **budget_header(deadline), **strategy_header()
+        })
+        with UPSTREAM_DURATION.time("batch"), tracing.span("forward"):
+            response = UPSTREAM.post(proxy_url, data=body, headers=headers, timeout=remaining(deadline), stream=True)
+        tracing.record_upstream(response)
+        return forward(response, "Batch")
+    except requests.Timeout as e:
+        UPSTREAM_ERRORS.inc(request.endpoint, type(e).__name__)
+        logger.error(f"Proxy did not answer within the request deadline: {e}")
+        return jsonify({"status": "error", "message": f"Upstream timeout: {e}"}), 504
     except requests.RequestException as e:
+        UPSTREAM_ERRORS.inc(request.endpoint, type(e).__name__)
         logger.error(f"Error communicating with Proxy: {e}")
         return jsonify({"status": "error", "message": f"Unable to process request: {e}"}), 500
     except Exception as e:
@@ -119,6 +228,7 @@ def handle_request():
 if __name__ == '__main__':
     try:
         logger.info("Starting Trusted Host service...")
+        # Serveur de développement, sans keep-alive : en déploiement, le service tourne sous gunicorn
         app.run(host='0.0.0.0', port=5000)
     except Exception as e:
         logger.critical(f"Failed to start the Trusted Host service: {e}")
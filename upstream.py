@@ -0,0 +1,136 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+# ===========================
+# Connexions HTTP persistantes vers le service en aval
+# ===========================
+# Les requêtes vers le saut suivant passent par une session partagée : les connexions
+# TCP sont conservées (keep-alive) et réutilisées au lieu d'être ouvertes à chaque
+# requête. Une connexion fermée par le serveur est détectée à sa sortie du pool et
+# remplacée ; un échec de connexion est retenté, jamais une requête déjà envoyée.
+
+# Les serveurs en aval doivent garder les connexions ouvertes : ils sont lancés sous
+# gunicorn (workers gthread), le serveur de développement de Flask fermant la connexion
+# après chaque réponse.
+
+# Connexions conservées par hôte (au-delà, les connexions supplémentaires sont fermées après usage)
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "32"))
+# Délai d'établissement d'une connexion (secondes), borné par le budget de la requête
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "2"))
+# Nouvelles tentatives après un échec de connexion
+UPSTREAM_CONNECT_RETRIES = int(os.getenv("UPSTREAM_CONNECT_RETRIES", "2"))
+
+
+def _counting_pool(pool_class, on_connect):
+    """
+    Sous-classe de `pool_class` dont les connexions appellent `on_connect(hôte)` à
+    chaque établissement TCP, y compris quand urllib3 rouvre une connexion fermée.
+    """
+    class CountingConnection(pool_class.ConnectionCls):
+        def connect(self):
+            super().connect()
+            on_connect(f"{self.host}:{self.port}")
+
+    return type(pool_class.__name__, (pool_class,), {"ConnectionCls": CountingConnection})
+
+
+class _CountingAdapter(HTTPAdapter):
+    def __init__(self, on_connect, **kwargs):
+        self._on_connect = on_connect
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self._on_connect),
+            "https": _counting_pool(HTTPSConnectionPool, self._on_connect),
+        }
+
+
+class UpstreamClient:
+    """
+    Session HTTP à connexions persistantes vers un service, avec compteur de
+    requêtes en cours pour les statistiques du pool.
+    """
+    def __init__(self, pool_size=UPSTREAM_POOL_SIZE, connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+                 connect_retries=UPSTREAM_CONNECT_RETRIES):
+        self.connect_timeout = connect_timeout
+        retries = Retry(total=connect_retries, connect=connect_retries, read=0, status=0, other=0,
+                        redirect=0, backoff_factor=0.05, raise_on_status=False)
+        self._adapter = _CountingAdapter(
+            self._record_connect, pool_connections=1, pool_maxsize=pool_size, max_retries=retries
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        self._in_flight = 0
+        self._connects = {}  # hôte -> connexions TCP établies
+        self._lock = threading.Lock()
+
+    def _record_connect(self, host):
+        with self._lock:
+            self._connects[host] = self._connects.get(host, 0) + 1
+
+    def request(self, method, url, timeout, **kwargs):
+        """
+        Envoie une requête ; `timeout` (secondes) borne la réponse et, au plus
+        `connect_timeout`, l'établissement de la connexion.
+        """
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return self.session.request(
+                method, url, timeout=(min(self.connect_timeout, timeout), timeout), **kwargs
+            )
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def get(self, url, timeout, **kwargs):
+        return self.request("GET", url, timeout, **kwargs)
+
+    def post(self, url, timeout, **kwargs):
+        return self.request("POST", url, timeout, **kwargs)
+
+    def stats(self):
+        """
+        État des pools par hôte : connexions inactives, connexions TCP réellement
+        établies (reconnexions comprises) et requêtes envoyées depuis le démarrage
+        (l'écart entre les deux mesure la réutilisation).
+        """
+        pools = self._adapter.poolmanager.pools
+        stats = []
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            # La file du pool contient None pour chaque place sans connexion
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0
+            stats.append({
+                "host": f"{pool.host}:{pool.port}",
+                "idle": idle,
+                "opened": self._connects.get(f"{pool.host}:{pool.port}", 0),
+                "requests": pool.num_requests,
+                "max_size": pool.pool.maxsize if pool.pool is not None else 0,
+            })
+        return {"in_flight": self._in_flight, "pools": stats}
+
+
+def instrument_client(client, registry, service):
+    """
+    Expose l'utilisation des connexions vers le service en aval sur /metrics.
+    """
+    registry.callback_gauge(
+        f"{service}_upstream_in_flight", "Requests currently waiting on the upstream service", (),
+        lambda: {(): client.stats()["in_flight"]})
+    registry.callback_gauge(
+        f"{service}_upstream_pool_connections", "Idle keep-alive connections to the upstream service", ("host",),
+        lambda: {(pool["host"],): pool["idle"] for pool in client.stats()["pools"]})
+    registry.callback_gauge(
+        f"{service}_upstream_connections_opened", "Connections opened to the upstream service since start", ("host",),
+        lambda: {(pool["host"],): pool["opened"] for pool in client.stats()["pools"]})